@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""
+timing of pre-edge subtraction and normalization for a stack of spectra
+on a common energy grid, comparing pre_edge() for each spectrum with
+pre_edge_stack() for all spectra at once.
+"""
+import time
+import numpy as np
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import pre_edge, preedge, pre_edge_stack
+
+dat = read_ascii('../xafsdata/cu_metal_rt.xdi')
+energy, mu = dat.energy, dat.mutrans
+
+nspectra = 5000
+stack = np.array([(1+0.0001*i)*np.interp(energy, energy+np.random.uniform(-5, 5), mu)
+                  for i in range(nspectra)])
+
+nloop = 200
+t0 = time.time()
+for i in range(nloop):
+    pre_edge(energy, stack[i], group=Group())
+t1 = time.time()
+for i in range(nloop):
+    preedge(energy, stack[i])
+t2 = time.time()
+out = pre_edge_stack(energy, stack, make_flat=False)
+t3 = time.time()
+out = pre_edge_stack(energy, stack, make_flat=True)
+t4 = time.time()
+
+print('%d spectra, %d energy points' % (nspectra, len(energy)))
+print('pre_edge()           %.3e sec/spectrum' % ((t1-t0)/nloop))
+print('preedge()            %.3e sec/spectrum' % ((t2-t1)/nloop))
+print('pre_edge_stack()     %.3e sec/spectrum' % ((t3-t2)/nspectra))
+print('  with make_flat     %.3e sec/spectrum' % ((t4-t3)/nspectra))
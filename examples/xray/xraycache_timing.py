@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+"""
+timing and database query counts for X-ray attenuation and scattering
+lookups as made in XRF modeling, fluorescence corrections, and
+structure factors, comparing the xraydb functions with the cached
+versions in larch.xray.
+"""
+import time
+import numpy as np
+import xraydb
+from sqlalchemy import event
+
+from larch import xray
+
+nqueries = [0]
+def count_query(*args, **kws):
+    nqueries[0] += 1
+event.listen(xraydb.get_xraydb().engine, 'before_cursor_execute', count_query)
+
+energy = np.linspace(1000, 30000, 2048)
+materials = ('Si', 'Be', 'kapton', 'air', 'water', 'SiO2', 'Fe2O3')
+elements = ('Fe', 'Cu', 'Zn', 'As', 'Pb', 'Ca', 'K', 'Mn', 'Ni', 'Se')
+qvals = np.linspace(0, 2, 500)
+
+def run(mod, nloop=3):
+    for i in range(nloop):
+        for mat in materials:
+            mod.material_mu(mat, energy, density=2.0)
+            mod.material_mu(mat, energy, density=2.0, kind='photo')
+        for elem in elements:
+            mod.mu_elam(elem, 1000*(i+10.0), kind='photo')
+            mod.xray_lines(elem, 'K')
+            mod.xray_line(elem, 'Ka')
+            mod.xray_edge(elem, 'K')
+            mod.f0(elem, qvals)
+
+print('%d energies, %d materials, %d elements' % (len(energy), len(materials),
+                                                 len(elements)))
+for label, mod in (('xraydb', xraydb), ('larch.xray', xray)):
+    for run_name in ('first', 'repeat'):
+        nqueries[0] = 0
+        t0 = time.time()
+        run(mod)
+        print('%-12s %-7s %8.3f sec  %6d queries' % (label, run_name,
+                                                    time.time()-t0, nqueries[0]))
+
+nloop = 10
+t0 = time.time()
+for i in range(nloop):
+    mu = [xraydb.mu_elam(elem, energy) for elem in elements]
+t1 = time.time()
+for i in range(nloop):
+    mu = xray.mu_elam_array(elements, energy)
+t2 = time.time()
+print('mu for %d elements: xraydb %.2e sec,  mu_elam_array %.2e sec' %
+      (len(elements), (t1-t0)/nloop, (t2-t1)/nloop))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+timing of q-peak searches of the whole AMCSD cif database for a 20-peak
+pattern, comparing the sparse q-peak index (cifDB.amcsd_by_q) with dense
+scoring of the q arrays of all structures.
+"""
+import time
+import json
+import numpy as np
+from larch.xrd.cifdb import cifDB, QPeakIndex, QMIN, QMAX
+
+def dense_scores(cifdb, peaks, qmin=QMIN, qmax=QMAX):
+    "score all structures with dense arrays, for qstep=QSTEP"
+    imin, imax = 0, len(cifdb.axis)
+    if qmax < np.max(cifdb.axis):
+        imax = abs(cifdb.axis-qmax).argmin()
+    if qmin > np.min(cifdb.axis):
+        imin = abs(cifdb.axis-qmin).argmin()
+    qaxis = cifdb.axis[imin:imax]
+    amcsd, q_amcsd = cifdb.match_qc(qmin=qmin, qmax=qmax)
+    q_amcsd = np.array(q_amcsd)
+    weights = -np.ones(len(qaxis), dtype=int)
+    for p in peaks:
+        weights[np.abs(qaxis-p).argmin()] = 1
+    scores = (weights*q_amcsd).sum(axis=1)
+    return sorted(zip(scores, amcsd), reverse=True)
+
+def timeit(func, n=20):
+    "average time per call, in seconds"
+    t0 = time.time()
+    for i in range(n):
+        func()
+    return (time.time() - t0)/n
+
+cifdb = cifDB('amcsd_cif.db')
+peaks = np.random.uniform(1.0, 6.0, 20)
+
+t0 = time.time()
+rows = cifdb.query(cifdb.ciftbl.c.amcsd_id, cifdb.ciftbl.c.qstr).all()
+qindex = QPeakIndex.from_qarrays(cifdb.axis, [(r[0], json.loads(r[1])) for r in rows])
+t_build = time.time() - t0
+t0 = time.time()
+cifdb.get_qindex()
+t_load = time.time() - t0
+
+nstruct, npeaks = len(qindex.amcsd), len(peaks)
+t_dense = timeit(lambda: dense_scores(cifdb, peaks))
+t_all   = timeit(lambda: cifdb.amcsd_by_q(peaks))
+t_top   = timeit(lambda: cifdb.amcsd_by_q(peaks, top=10))
+t_merge = timeit(lambda: cifdb.amcsd_by_q(peaks, qstep=0.05, top=10))
+
+print('%d structures (whole database), %d-peak pattern' % (nstruct, npeaks))
+print('build q-peak index from database:  %.4f sec' % t_build)
+print('get q-peak index (cached/sidecar):  %.4f sec' % t_load)
+print('search times, sec/search:')
+print('  dense scoring, all structures:    %.4f' % t_dense)
+print('  indexed, full ranking:            %.4f' % t_all)
+print('  indexed, top 10:                  %.4f' % t_top)
+print('  indexed, top 10, qstep=0.05:      %.4f' % t_merge)
+print('sub-second indexed search: %s' % (max(t_all, t_top, t_merge) < 1.0))
+print('best matches: ', [r[1] for r in cifdb.amcsd_by_q(peaks, top=5)])
@@ -35,7 +35,7 @@ from .xafs_beamlines import guess_beamline
 
 from .csvfiles import groups2csv, read_csv
 from .export_modelresult import export_modelresult
-from .mergegroups import merge_groups
+from .mergegroups import merge_groups, merge_arrays
 from .specfile_reader import (HAS_SPECFILE, spec_getscan2group,
                               spec_getmap2group, spec_getmrg2group,
                               str2rng_larch)
@@ -78,7 +78,7 @@ __exports__ = dict(increment_filename=increment_filename,
                    read_mda=read_mda,
                    read_stepscan=read_stepscan,
                    read_tiff=read_tiff,
-                   merge_groups=merge_groups,
+                   merge_groups=merge_groups, merge_arrays=merge_arrays,
                    save=save,
                    restore=restore,
                    read_xrd_hdf5=read_xrd_hdf5,
@@ -6,18 +6,41 @@
 import h5py
 import numpy
 from functools import partial
+from larch import Group
 from larch.utils import fixName
 import scipy.io.netcdf
 
-def netcdf_group(fname, _larch=None, **kws):
+def _make_group(_larch=None):
+    if _larch is not None:
+        return _larch.symtable.create_group
+    return Group
+
+def _is_eager(nbytes, max_eager_size):
+    return max_eager_size is not None and nbytes <= max_eager_size
+
+def netcdf_group(fname, lazy=False, max_eager_size=None, _larch=None, **kws):
     """open a NetCDF file and map the variables in it to larch groups
     g = netcdf_group('tmp.nc')
+
+    Arguments
+    ------
+     lazy            if True, the file is kept open (in 'nc_file') and
+                     variables are memory-mapped, so that data is read
+                     only when used [False]
+     max_eager_size  with lazy=True, variables of at most this many bytes
+                     are read into memory [None]
     """
-    finp = scipy.io.netcdf.netcdf_file(fname, mode='r')
-    group = _larch.symtable.create_group()
+    finp = scipy.io.netcdf.netcdf_file(fname, mode='r', mmap=lazy or None)
+    group = _make_group(_larch)(name=fname)
     for k, v in finp.variables.items():
-        setattr(group, k, v.data)
-    finp.close()
+        dat = v.data
+        if lazy and _is_eager(dat.nbytes, max_eager_size):
+            dat = numpy.array(dat)
+        setattr(group, k, dat)
+    if lazy:
+        group.nc_file = finp
+    else:
+        finp.close()
     return group
 
 def netcdf_file(fname, mode='r', _larch=None):
@@ -33,23 +56,163 @@ def h5file(fname, mode='r', _larch=None):
     """
     return h5py.File(fname, mode)
 
-def h5group(fname, mode='r+', _larch=None):
+def _h5_value(dat, max_eager_size=None):
+    """value to use for an HDF5 dataset: strings are read, as are
+    datasets of at most max_eager_size bytes"""
+    try:
+        if dat.dtype.type == numpy.string_:
+            if len(dat) == 1:
+                return dat[()]
+            return list(dat)
+    except (ValueError, TypeError):
+        pass
+    if _is_eager(dat.size*dat.dtype.itemsize, max_eager_size):
+        return dat[()]
+    return dat
+
+
+class H5DatasetProxy(object):
+    """proxy for an HDF5 dataset, reading only the data requested
+
+      d = H5DatasetProxy(h5file['xrmmap/mca1/counts'])
+      d[10, 20:30, :]    # reads only this hyperslab
+      d.attrs            # dict of attributes, read when asked for
+      numpy.asarray(d)   # reads all data
+    """
+    def __init__(self, dataset):
+        self._dataset = dataset
+        self.name = dataset.name
+
+    def __repr__(self):
+        return '<H5DatasetProxy %s: shape %s, type %s>' % (self.name, self.shape,
+                                                           self.dtype)
+
+    @property
+    def shape(self):
+        return self._dataset.shape
+
+    @property
+    def dtype(self):
+        return self._dataset.dtype
+
+    @property
+    def ndim(self):
+        return len(self._dataset.shape)
+
+    @property
+    def size(self):
+        return self._dataset.size
+
+    @property
+    def nbytes(self):
+        return self._dataset.size*self._dataset.dtype.itemsize
+
+    @property
+    def attrs(self):
+        return dict(self._dataset.attrs)
+
+    def __len__(self):
+        return len(self._dataset)
+
+    def __getitem__(self, key):
+        return self._dataset[key]
+
+    def __array__(self, dtype=None):
+        out = self._dataset[()]
+        if dtype is not None:
+            out = out.astype(dtype)
+        return numpy.asarray(out)
+
+    def read(self):
+        "read and return all data"
+        return self._dataset[()]
+
+
+class H5ProxyGroup(Group):
+    """larch group for an HDF5 group, with members read from the file
+    only when they are first accessed
+
+    Sub-groups are also H5ProxyGroups, and datasets are H5DatasetProxy
+    objects, or arrays for datasets of at most max_eager_size bytes.
+    As with h5group(), attributes of the group are in '_attrs', and
+    those of members in 'itemname_attrs'.
+    """
+    def __init__(self, h5obj, name=None, max_eager_size=None):
+        self.__h5obj = h5obj
+        self.__h5keys = None
+        self.__max_eager_size = max_eager_size
+        Group.__init__(self, name=name or h5obj.name)
+
+    def _h5names(self):
+        "map of member name to key for the HDF5 group"
+        if self.__h5keys is None:
+            self.__h5keys = {}
+            for key in self.__h5obj.keys():
+                self.__h5keys[fixName(key, allow_dot=False)] = key
+        return self.__h5keys
+
+    def __dir__(self):
+        names = Group.__dir__(self)
+        for name, key in self._h5names().items():
+            if name not in names:
+                names.append(name)
+        return names
+
+    def __getattr__(self, name):
+        if name.startswith('__') or name.startswith('_H5ProxyGroup__'):
+            raise AttributeError(name)
+        h5obj = self.__h5obj
+        names = self._h5names()
+        if name in names:
+            val = h5obj[names[name]]
+            if isinstance(val, h5py.Group):
+                out = H5ProxyGroup(val, name="%s/%s" % (self.__name__, name),
+                                   max_eager_size=self.__max_eager_size)
+            else:
+                out = _h5_value(val, max_eager_size=self.__max_eager_size)
+                if isinstance(out, h5py.Dataset):
+                    out = H5DatasetProxy(out)
+        elif name == '_attrs' and len(h5obj.attrs) > 0:
+            out = dict(h5obj.attrs)
+        elif name.endswith('_attrs') and name[:-6] in names:
+            attrs = h5obj[names[name[:-6]]].attrs
+            if len(attrs) < 1:
+                raise AttributeError(name)
+            out = dict(attrs)
+        else:
+            raise AttributeError("'%s' has no member '%s'" % (self.__name__, name))
+        setattr(self, name, out)
+        return out
+
+
+def h5group(fname, mode='r+', lazy=False, max_eager_size=None, _larch=None):
     """open an HDF5 file, and map to larch groups
     g = h5group('myfile.h5')
 
     Arguments
     ------
-     mode    string for file access mode ('r', 'w', etc)
-             default mode is 'r+' for read-write access.
+     mode            string for file access mode ('r', 'w', etc)
+                     default mode is 'r+' for read-write access.
+     lazy            if True, groups and datasets are mapped only when
+                     accessed, and datasets are read only when sliced [False]
+     max_eager_size  datasets of at most this many bytes are read into
+                     arrays when mapped [None: no datasets are read]
 
     Notes:
     ------
      1. The raw file handle will be held in the 'h5_file' group member.
      2. Attributes of groups and datasets are generally placed in
        'itemname_attrs'.
+     3. Without lazy, the whole file is walked when opened, and datasets
+        are h5py Datasets.  With lazy, datasets are H5DatasetProxy objects.
     """
     fh = h5py.File(fname, mode)
-    group = _larch.symtable.create_group
+    if lazy:
+        top = H5ProxyGroup(fh, name=fname, max_eager_size=max_eager_size)
+        top.h5_file = fh
+        return top
+
+    group = _make_group(_larch)
 
     def add_component(key, val, top):
         parents = [fixName(w, allow_dot=False) for w in key.split('/')]
@@ -64,15 +227,7 @@ def h5group(fname, mode='r+', _larch=None):
             if len(val.attrs) > 0:
                 getattr(top, current)._attrs = dict(val.attrs)
         else:
-            dat = fh.get(key)
-            try:
-                if dat.dtype.type == numpy.string_:
-                    if len(dat) == 1:
-                        dat = dat.value
-                    else:
-                        dat = list(dat)
-            except (ValueError, TypeError):
-                pass
+            dat = _h5_value(fh.get(key), max_eager_size=max_eager_size)
             setattr(top, current, dat)
             if len(val.attrs) > 0:
                 setattr(top, "%s_attrs" % current, dict(val.attrs))
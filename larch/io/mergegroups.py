@@ -3,12 +3,250 @@
 merge groups, interpolating if necessary
 """
 import os
+from collections import OrderedDict
 import numpy as np
+from scipy.interpolate import UnivariateSpline
 from larch import Group
-from larch.math import interp, index_of
+from larch.math import interp, interp1d, index_of
+
+# max number of interpolated values held in memory at once while merging
+MERGE_CHUNKSIZE = 2**22
+
+# max number of interpolators for distinct x arrays kept while merging
+MERGE_INTERP_CACHESIZE = 8
+
+
+class ScanInterpolator(object):
+    """interpolate many y arrays sharing one x array onto xout, as with
+    interp(x, y, xout, kind=kind), with the work that depends only on x
+    and xout done once.
+
+    For kind='linear', the interpolation stencil (neighboring indices and
+    weights) is precomputed.  For other kinds, rows are interpolated
+    together with a single spline construction per call.
+    """
+    def __init__(self, x, xout, kind='cubic'):
+        x = np.asarray(x)
+        self.order = None
+        if np.any(np.diff(x) < 0):
+            self.order = np.argsort(x)
+            x = x[self.order]
+        self.x = x
+        self.xout = np.asarray(xout)
+        self.kind = kind.lower()
+        if self.kind.startswith('lin'):
+            hi = np.clip(np.searchsorted(x, self.xout), 1, len(x)-1)
+            self.lo, self.hi = hi - 1, hi
+            self.weight = (self.xout - x[self.lo])/(x[self.hi] - x[self.lo])
+        self.below = np.where(self.xout < x[0])[0]
+        self.above = np.where(self.xout > x[-1])[0]
+
+    def __call__(self, ys):
+        """interpolate ys, shape (nrows, len(x)) to shape (nrows, len(xout))"""
+        ys = np.atleast_2d(ys)
+        if self.order is not None:
+            ys = ys[:, self.order]
+        if self.kind.startswith('lin'):
+            return ys[:, self.lo]*(1-self.weight) + ys[:, self.hi]*self.weight
+
+        x, xout = self.x, self.xout
+        out = interp1d(x, ys, xout, kind=self.kind)
+        # extrapolate as interp() does
+        ncoef = 3 if self.kind.startswith('quad') else 5
+        for span, sel in ((self.below, slice(None, ncoef)),
+                          (self.above, slice(-ncoef, None))):
+            if len(span) < 1:
+                continue
+            if self.kind.startswith('quad'):
+                coefs = np.polyfit(x[sel], ys[:, sel].T, 2)[:, :, None]
+                out[:, span] = coefs[2] + xout[span]*(coefs[1] + coefs[0]*xout[span])
+            elif self.kind.startswith('cubic'):
+                for i, y in enumerate(ys):
+                    out[i, span] = UnivariateSpline(x[sel], y[sel], s=0)(xout[span])
+        return out
+
+
+class MergeAccumulator(object):
+    """online mean and variance of scans, updated with chunks of scans
+    (the parallel form of Welford's algorithm), with scans also able to
+    be removed, and optional per-batch means for a median-of-means.
+    """
+    def __init__(self, npts, nscans=None, nbatch=None):
+        self.n = 0
+        self.mean = np.zeros(npts)
+        self.m2 = np.zeros(npts)
+        self.batches = None
+        if nbatch is not None and nscans is not None:
+            self.nscans = nscans
+            self.nbatch = max(1, min(nbatch, nscans))
+            self.batches = [MergeAccumulator(npts) for i in range(self.nbatch)]
+
+    def add(self, ys, index0=0):
+        """add chunk of scans, shape (nscans, npts), starting at scan index0"""
+        ys = np.atleast_2d(ys)
+        nb = len(ys)
+        if nb < 1:
+            return
+        mean_b = ys.mean(axis=0)
+        m2_b = ((ys - mean_b)**2).sum(axis=0)
+        n = self.n + nb
+        delta = mean_b - self.mean
+        self.mean += delta*(nb/n)
+        self.m2 += m2_b + delta**2*(self.n*nb/n)
+        self.n = n
+        if self.batches is not None:
+            ibatch = (np.arange(index0, index0+nb)*self.nbatch)//self.nscans
+            for ib in np.unique(ibatch):
+                self.batches[ib].add(ys[ibatch == ib])
+
+    def remove(self, y, index=None):
+        """remove one scan"""
+        if self.n < 2:
+            self.__init__(len(self.mean))
+            return
+        n = self.n - 1
+        mean = (self.n*self.mean - y)/n
+        self.m2 -= (y - mean)*(y - self.mean)
+        self.m2[self.m2 < 0] = 0.0
+        self.mean, self.n = mean, n
+        if self.batches is not None and index is not None:
+            self.batches[(index*self.nbatch)//self.nscans].remove(y)
+
+    def leave_one_out(self, y):
+        """mean and standard deviation of the other scans, for scan(s) y"""
+        n = self.n - 1
+        mean = (self.n*self.mean - y)/n
+        m2 = self.m2 - (y - mean)*(y - self.mean)
+        return mean, np.sqrt(np.maximum(m2, 0)/n)
+
+    def std(self, ddof=0):
+        if self.n <= ddof:
+            return np.zeros(len(self.mean))
+        return np.sqrt(self.m2/(self.n - ddof))
+
+    def stderr(self):
+        "standard error of the mean"
+        return self.std(ddof=1)/np.sqrt(max(1, self.n))
+
+    def median_of_means(self):
+        "median of batch means"
+        means = [b.mean for b in self.batches if b.n > 0]
+        return np.median(np.array(means), axis=0)
+
+
+def _merge_scans(chunks, npts, nscans, method='mean', nsigma=3.0, nbatch=8,
+                 maxiter=5):
+    """merge scans, given a function returning an iterator of
+    (index0, ychunk) with interpolated scans
+
+    Returns
+    -------
+      ymean, ystd, ystderr, nmerged, rejected
+    """
+    method = method.lower()
+    if method not in ('mean', 'sigmaclip', 'median'):
+        raise ValueError("merge method must be one of 'mean', 'sigmaclip', 'median'")
+    use_batches = nbatch if method == 'median' else None
+    acc = MergeAccumulator(npts, nscans=nscans, nbatch=use_batches)
+    for index0, ychunk in chunks():
+        acc.add(ychunk, index0=index0)
+
+    rejected = []
+    if method == 'sigmaclip':
+        # score each scan against the mean and std of all other scans,
+        # remove the outliers, and repeat until no more are found
+        for iteration in range(maxiter):
+            if acc.n < 3:
+                break
+            ref = MergeAccumulator(npts)
+            ref.n, ref.mean, ref.m2 = acc.n, acc.mean.copy(), acc.m2.copy()
+            nrejected = len(rejected)
+            for index0, ychunk in chunks():
+                mean, std = ref.leave_one_out(ychunk)
+                valid = std > 0
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    zsq = np.where(valid, ((ychunk - mean)/std)**2, 0)
+                score = np.sqrt(zsq.sum(axis=1)/np.maximum(1, valid.sum(axis=1)))
+                for i in np.where(score > nsigma)[0]:
+                    if (index0 + i) not in rejected and acc.n > 2:
+                        acc.remove(ychunk[i])
+                        rejected.append(index0 + i)
+            if len(rejected) == nrejected:
+                break
+        rejected.sort()
+
+    ymean = acc.mean
+    if method == 'median':
+        ymean = acc.median_of_means()
+    return ymean, acc.std(), acc.stderr(), acc.n, rejected
+
+
+def _nchunk(npts, chunksize=None):
+    if chunksize is None:
+        chunksize = MERGE_CHUNKSIZE
+    return max(1, int(chunksize//max(1, npts)))
+
+
+def merge_arrays(x, ys, xout=None, kind='cubic', method='mean', nsigma=3.0,
+                 nbatch=8, chunksize=None):
+    """merge (average) a 2D array of y values sharing an x array,
+    without holding interpolated copies of all the rows in memory.
+
+    Arguments
+    ---------
+     x           x array for ys
+     ys          2D array, shape (nscans, len(x)), of y values to merge
+     xout        x array for merged data [None -> x, with no interpolation]
+     kind        interpolation kind ['cubic']
+     method      one of 'mean', 'sigmaclip', 'median' ['mean'], see Notes
+     nsigma      rejection threshold for 'sigmaclip' [3]
+     nbatch      number of batches for 'median' [8]
+     chunksize   max number of values to interpolate at once [MERGE_CHUNKSIZE]
+
+    Returns
+    --------
+     group with x, y (merged data), y_std (standard deviation of the
+     scans), y_stderr (standard error of the mean), nmerged (number of
+     scans merged) and rejected (list of indices of rejected scans).
+
+    Notes
+    -----
+     For 'mean', the mean and variance are accumulated in a single pass.
+     For 'sigmaclip', another pass scores each scan by the RMS of its
+     deviation from the mean of all other scans, in units of their standard
+     deviation, and scans with a score above nsigma are rejected.  This is
+     repeated (up to 5 passes) until no more scans are rejected.
+     For 'median', scans are split into nbatch batches of consecutive scans,
+     and the median of the batch means is used.
+    """
+    x = np.asarray(x)
+    nscans = len(ys)
+    if xout is None:
+        xout = x
+        interpolate = None
+    else:
+        xout = np.asarray(xout)
+        interpolate = ScanInterpolator(x, xout, kind=kind)
+    nchunk = _nchunk(max(len(x), len(xout)), chunksize)
+
+    def chunks():
+        for i0 in range(0, nscans, nchunk):
+            ychunk = np.asarray(ys[i0:i0+nchunk], dtype=np.float64)
+            if interpolate is not None:
+                ychunk = interpolate(ychunk)
+            yield i0, ychunk
+
+    yave, ystd, ystderr, nmerged, rejected = _merge_scans(chunks, len(xout),
+                                                          nscans, method=method,
+                                                          nsigma=nsigma,
+                                                          nbatch=nbatch)
+    return Group(x=xout, y=yave, y_std=ystd, y_stderr=ystderr,
+                 nmerged=nmerged, rejected=rejected)
+
 
 def merge_groups(grouplist, master=None, xarray='energy', yarray='mu',
-                 kind='cubic', trim=True, calc_yerr=True, _larch=None):
+                 kind='cubic', trim=True, calc_yerr=True, method='mean',
+                 nsigma=3.0, nbatch=8, chunksize=None, _larch=None):
 
     """merge arrays from a list of groups.
 
@@ -21,11 +259,25 @@ def merge_groups(grouplist, master=None, xarray='energy', yarray='mu',
      kind        interpolation kind ['cubic']
      trim        whether to trim to the shortest energy range [True]
      calc_yerr   whether to use the variance in the input as yerr [True]
+     method      one of 'mean', 'sigmaclip', 'median' ['mean'], see merge_arrays()
+     nsigma      rejection threshold for 'sigmaclip' [3]
+     nbatch      number of batches for 'median' [8]
+     chunksize   max number of values to interpolate at once [MERGE_CHUNKSIZE]
 
     Returns
     --------
-     group with x-array and y-array containing merged data.
+     group with x-array and y-array containing merged data, with
+     yarray+'_std' holding the standard deviation of the input data,
+     yarray+'_stderr' holding the standard error of the mean, `nmerged`
+     the number of groups merged and `rejected` the list of indices of
+     groups rejected.
 
+    Notes
+    -----
+     groups are interpolated in chunks, with groups sharing the same x
+     array interpolated together, and merged with a running mean and
+     variance.  Interpolators for the most recently used x arrays (up to
+     MERGE_INTERP_CACHESIZE) are kept for reuse.
     """
     if master is None:
         master = grouplist[0]
@@ -33,18 +285,46 @@ def merge_groups(grouplist, master=None, xarray='energy', yarray='mu',
     xout = getattr(master, xarray)
     xmins = [min(xout)]
     xmaxs = [max(xout)]
-    yvals = []
-
     for g in grouplist:
         x = getattr(g, xarray)
-        y = getattr(g, yarray)
-        yvals.append(interp(x, y, xout, kind=kind))
         xmins.append(min(x))
         xmaxs.append(max(x))
 
-    yvals = np.array(yvals)
-    yave = yvals.mean(axis=0)
-    ystd = yvals.std(axis=0)
+    nchunk = _nchunk(len(xout), chunksize)
+    interpolators = OrderedDict()
+
+    def get_interpolator(key, x):
+        "interpolator for x onto xout, from a small LRU cache"
+        if key in interpolators:
+            interpolators.move_to_end(key)
+        else:
+            interpolators[key] = ScanInterpolator(x, xout, kind=kind)
+            while len(interpolators) > MERGE_INTERP_CACHESIZE:
+                interpolators.popitem(last=False)
+        return interpolators[key]
+
+    def chunks():
+        for i0 in range(0, len(grouplist), nchunk):
+            groups = grouplist[i0:i0+nchunk]
+            ychunk = np.zeros((len(groups), len(xout)))
+            byx = {}
+            for i, g in enumerate(groups):
+                x = np.asarray(getattr(g, xarray), dtype=np.float64)
+                key = (len(x), hash(x.tobytes()))
+                if key not in byx:
+                    byx[key] = (x, [])
+                byx[key][1].append(i)
+            for key, (x, rows) in byx.items():
+                ys = np.array([getattr(groups[i], yarray) for i in rows],
+                              dtype=np.float64)
+                ychunk[rows] = get_interpolator(key, x)(ys)
+            yield i0, ychunk
+
+    yave, ystd, ystderr, nmerged, rejected = _merge_scans(chunks, len(xout),
+                                                          len(grouplist),
+                                                          method=method,
+                                                          nsigma=nsigma,
+                                                          nbatch=nbatch)
 
     if trim:
         xmin = min(xmins)
@@ -54,9 +334,13 @@ def merge_groups(grouplist, master=None, xarray='energy', yarray='mu',
         xout = xout[ixmin:ixmax]
         yave = yave[ixmin:ixmax]
         ystd = ystd[ixmin:ixmax]
+        ystderr = ystderr[ixmin:ixmax]
 
     grp = Group()
     setattr(grp, xarray, xout)
     setattr(grp, yarray, yave)
     setattr(grp, yarray + '_std', ystd)
+    setattr(grp, yarray + '_stderr', ystderr)
+    grp.nmerged = nmerged
+    grp.rejected = rejected
     return grp
@@ -15,7 +15,8 @@ from .lineshapes import (gaussian, lorentzian, voigt, pvoigt, hypermet,
 from .fitpeak import fit_peak
 from .convolution1D import glinbroad
 from .lincombo_fitting import lincombo_fit, lincombo_fitall, groups2matrix
-from .pca import pca_train, pca_fit, nmf_train
+from .pca import (pca_train, pca_train_matrix, pca_fit, pca_fit_many,
+                  pca_statistics, nmf_train)
 from .learn_regress import pls_train, pls_predict, lasso_train, lasso_predict
 from .gridxyz import gridxyz
 from .spline import spline_rep, spline_eval
@@ -36,6 +37,9 @@ _larch_builtins = {'_math': dict(linregress=linregress, polyfit=polyfit,
                                  smooth=smooth, boxcar=boxcar,
                                  glinbroad=glinbroad, gridxyz=gridxyz,
                                  pca_train=pca_train, pca_fit=pca_fit,
+                                 pca_train_matrix=pca_train_matrix,
+                                 pca_fit_many=pca_fit_many,
+                                 pca_statistics=pca_statistics,
                                  nmf_train=nmf_train,
                                  pls_train=pls_train,
                                  pls_predict=pls_predict,
@@ -7,11 +7,12 @@ Generic discrete convolution
 Description
 -----------
 
- This is a manual (not optimized!) implementation of discrete 1D
- convolution intended for spectroscopy analysis. The difference with
- commonly used methods is the possibility to adapt the convolution
- kernel for each convolution point, e.g. change the FWHM of the
- Gaussian kernel as a function of the energy scale.
+ This is an implementation of discrete 1D convolution intended for
+ spectroscopy analysis. The difference with commonly used methods is
+ the possibility to adapt the convolution kernel for each convolution
+ point, e.g. change the FWHM of the Gaussian kernel as a function of
+ the energy scale. The kernels for all points are put in a sparse,
+ banded matrix, which is then applied to one or many spectra.
 
 Resources
 ---------
@@ -48,6 +49,7 @@ from optparse import OptionParser
 from datetime import date
 from string import Template
 import numpy as np
+from scipy import sparse
 
 from .lineshapes import gaussian, lorentzian
 
@@ -61,7 +63,7 @@ def get_ene_index(ene, cen, hwhm):
         else:
             ene_imin = max(np.where(ene < (cen-hwhm))[0])
         if ((cen+hwhm) >= max(ene)):
-            ene_imax = (len(e)-1)
+            ene_imax = (len(ene)-1)
         else:
             ene_imax = min(np.where(ene > (cen+hwhm))[0])
         return ene_imin, ene_imax
@@ -91,15 +93,8 @@ def lin_gamma(ene, fwhm=1.0, linbroad=None):
             e2 = linbroad[2]
         except:
             raise ValueError('wrong format for linbroad')
-        for en, ee in enumerate(ene):
-            if ee < e1:
-                w[en] *= fwhm
-            elif ee <= e2:
-                wlin = (fwhm + (ee - e1) * (fwhm2 - fwhm) / (e2 - e1))
-                w[en] *= wlin
-            elif ee >= e2:
-                w[en] *= fwhm2
-        return w
+        wlin = (fwhm + (ene - e1) * (fwhm2 - fwhm) / (e2 - e1))
+        return w * np.where(ene < e1, fwhm, np.where(ene <= e2, wlin, fwhm2))
 
 def atan_gamma(ene, gamma_hole, gamma_max=15., e0=0, eslope=1.):
     r"""returns arctangent-like broadening, $\Gamma(E)$
@@ -113,13 +108,76 @@ def atan_gamma(ene, gamma_hole, gamma_max=15., e0=0, eslope=1.):
         eslope = 1.
     return gamma_hole + gamma_max * ( ( np.arctan( (ene - e0) / eslope ) / np.pi ) + 0.5 )
 
-def conv(e, mu, kernel='gaussian', fwhm_e=None, efermi=None):
+def conv_matrix(e, fwhm_e, kernel='gaussian'):
+    """ sparse (banded) matrix for linear broadening with an energy-dependent
+    kernel width, as used by conv()
+
+    Parameters
+    ----------
+    e : x-axis (energy)
+    fwhm_e : array of full width half maximum in eV, same size as 'e'
+    kernel : convolution kernel, 'gaussian' or 'lorentzian'
+
+    Returns
+    -------
+    matrix, eext  where matrix is a scipy.sparse CSR matrix of shape
+    (len(e), len(eext)) and eext is the energy array extended above e[-1],
+    so that the broadened spectrum is matrix.dot(mu(eext)).
+
+    Notes
+    -----
+    For each point n, the kernel is evaluated at the energies within
+    1.5*fwhm_e[n] of e[n] (taken as an odd number of points), normalized
+    to unit sum, and applied to the points centered on n.
+    """
+    e = np.asarray(e, dtype=np.float64)
+    fwhm_e = np.asarray(fwhm_e, dtype=np.float64)
+    npts = len(e)
+    # extend upper energy border to 3*fhwm_e[-1]
+    estep = (e[-1] - e[-2])
+    eup = np.append(e, np.arange(e[-1]+estep, e[-1]+3*fwhm_e[-1], estep))
+
+    # kernel ranges, as get_ene_index()
+    hw = 1.5*fwhm_e
+    eimin = np.searchsorted(eup, e-hw, side='left') - 1
+    eimin[np.where((e-hw) <= eup.min())] = 0
+    eimax = np.searchsorted(eup, e+hw, side='right')
+    eimax[np.where((e+hw) >= eup.max())] = len(eup)-1
+    # odd range centered at the convolution point
+    lk = eimax - eimin
+    lk = np.where(lk % 2 == 0, lk+1, lk)
+
+    ### kernel ###
+    rows = np.repeat(np.arange(npts), lk)
+    first = np.repeat(np.cumsum(lk) - lk, lk)
+    mg = np.arange(len(rows)) - first
+    kx = eup[np.repeat(eimin, lk) + mg]
+    dx = (kx - e[rows]) / (fwhm_e[rows]/2.0)
+    if ('gauss' in kernel.lower()):
+        ky = np.exp(-dx**2/2.0)
+    elif ('lor' in kernel.lower()):
+        ky = 1.0/(1.0 + dx**2)
+    else:
+        raise ValueError("convolution kernel '{0}' not implemented".format(kernel))
+    ky = ky / np.bincount(rows, weights=ky, minlength=npts)[rows] # normalize
+
+    cols = rows - np.repeat(lk//2, lk) + mg
+    keep = np.where(cols >= 0)
+    rows, cols, ky = rows[keep], cols[keep], ky[keep]
+    npts_ext = max(npts, cols.max()+1)
+    eext = np.append(e, e[-1] + estep*np.arange(1, npts_ext-npts+1))
+    eext[npts:min(npts_ext, len(eup))] = eup[npts:min(npts_ext, len(eup))]
+    matrix = sparse.csr_matrix((ky, (rows, cols)), shape=(npts, npts_ext))
+    return matrix, eext
+
+def conv(e, mu, kernel='gaussian', fwhm_e=None, efermi=None, axis=-1):
     """ linear broadening
 
     Parameters
     ----------
     e : x-axis (energy)
-    mu : f(x) to convolve with g(x) kernel, mu(energy)
+    mu : f(x) to convolve with g(x) kernel, mu(energy).  This can also
+         be a 2D array of many spectra or a RIXS plane, convolved along 'axis'
     kernel : convolution kernel, g(x)
              'gaussian'
              'lorentzian'
@@ -127,52 +185,35 @@ def conv(e, mu, kernel='gaussian', fwhm_e=None, efermi=None):
             broadening. It is an array of size 'e' with constants or
             an energy-dependent values determined by a function as
             'lin_gamma()' or 'atan_gamma()'
+    efermi : energy below which mu is set to zero before broadening
+    axis : axis of mu matching 'e' [-1]
     """
-    f = np.copy(mu)
-    z = np.zeros_like(f)
+    e = np.asarray(e, dtype=np.float64)
+    if fwhm_e is None or e.shape != np.shape(fwhm_e):
+        print("Error: 'fwhm_e' does not have the same shape of 'e'")
+        return 0
+    f = np.moveaxis(np.array(mu, dtype=np.float64), axis, -1)
+    shape = f.shape
+    f = f.reshape(-1, shape[-1])
     if efermi is not None:
         #ief = index_nearest(e, efermi)
         ief = np.argmin(np.abs(e-efermi))
-        f[0:ief] *= 0
-    if e.shape != fwhm_e.shape:
-        print("Error: 'fwhm_e' does not have the same shape of 'e'")
-        return 0
+        f[:, 0:ief] *= 0
+
+    matrix, eext = conv_matrix(e, fwhm_e, kernel=kernel)
+
     # linar fit upper part of the spectrum to avoid border effects
     # polyfit => pf
-    lpf = len(e)/2.
-    cpf = np.polyfit(e[-lpf:], f[-lpf:], 1)
-    fpf = np.poly1d(cpf)
-    # extend upper energy border to 3*fhwm_e[-1]
-    estep = (e[-1] - e[-2])
-    eup = np.append(e, np.arange(e[-1]+estep, e[-1]+3*fwhm_e[-1], estep))
-    for n in range(len(f)):
-        #from now on I change e with eup
-        eimin, eimax = get_ene_index(eup, eup[n], 1.5*fwhm_e[n])
-        if ((eimin is None) or (eimax is None)):
-            if DEBUG:
-                raise IndexError('e[{0}]'.format(n))
-        if len(range(eimin, eimax)) % 2 == 0:
-            kx = eup[eimin:eimax+1] # odd range centered at the convolution point
-        else:
-            kx = eup[eimin:eimax]
-        ### kernel ###
-        hwhm = fwhm_e[n]/2.0
-        if ('gauss' in kernel.lower()):
-            ky = gaussian(kx, center=eup[n], sigma=hwhm)
-        elif ('lor' in kernel.lower()):
-            ky = lorentzian(kx, center=eup[n], sigma=hwhm)
-        else:
-            raise ValueError("convolution kernel '{0}' not implemented".format(kernel))
-        ky = ky/ky.sum() # normalize
-        zn = 0
-        lk = len(kx)
-        for mf, mg in zip( range(-(lk/2), (lk/2)+1), range(lk) ):
-            if ( ((n+mf) >= 0) and ((n+mf) < len(f)) ):
-                zn += f[n+mf] * ky[mg]
-            elif ((n+mf) >= 0):
-                zn += fpf(eup[n+mf]) * ky[mg]
-        z[n] = zn
-    return z
+    npts = len(e)
+    lpf = int(npts/2)
+    fext = np.zeros((len(f), len(eext)))
+    fext[:, :npts] = f
+    if len(eext) > npts:
+        cpf = np.polyfit(e[-lpf:], f[:, -lpf:].T, 1)
+        fext[:, npts:] = (np.outer(cpf[0], eext[npts:]) + cpf[1][:, np.newaxis])
+
+    z = matrix.dot(fext.T).T
+    return np.moveaxis(z.reshape(shape), -1, axis)
 
 def glinbroad(e, mu, fwhm_e=None, efermi=None):
     """ gaussian linear convolution in Larch """
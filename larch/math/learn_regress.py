@@ -5,9 +5,11 @@ including Partial Least Squares (PLS) and L1-Regularized Linear Modeling (Lasso)
 
 These methods are built on the methods from scikit-learn
 """
+import time
 import numpy as np
 
 try:
+    from joblib import Parallel, delayed
     from sklearn.cross_decomposition import PLSRegression, PLSCanonical, PLSSVD, CCA
     from sklearn.model_selection import KFold, RepeatedKFold
     from sklearn.linear_model import LassoLarsCV, LassoLars, LassoCV, Lasso
@@ -21,24 +23,114 @@ from .. import Group, isgroup
 from .utils import interp
 from .lincombo_fitting import get_arrays, groups2matrix
 
+def _regress_data(groups, varname, arrayname, xmin, xmax):
+    """internal use: spectra matrix and values of varname for groups"""
+    xdat, spectra = groups2matrix(groups, arrayname, xmin=xmin, xmax=xmax)
+    groupnames = []
+    ydat = []
+    for g in groups:
+        groupnames.append(getattr(g, 'filename',
+                                  getattr(g, 'groupname', repr(g))))
+        val = getattr(g, varname, None)
+        if val is None:
+            raise ValueError("group '%s' does not have attribute '%s'" % (g, varname))
+        ydat.append(val)
+    return xdat, spectra, np.array(ydat), groupnames
+
+def _cv_splits(nvals, cv_folds, cv_repeats, random_state):
+    """internal use: list of (train, test) index arrays for Cross-Validation,
+    drawn once here so that results do not depend on how folds are run"""
+    if cv_folds is None:
+        cv_folds = int(round(np.sqrt(nvals)))
+    if  cv_repeats is None:
+        cv_repeats = int(round(np.sqrt(nvals)) - 1)
+    cv = RepeatedKFold(n_splits=cv_folds, n_repeats=cv_repeats,
+                       random_state=random_state)
+    return cv_folds, cv_repeats, list(cv.split(range(nvals)))
+
+def _run_folds(func, splits, n_jobs, *args):
+    """internal use: run func(ctrain, ctest, *args) for each CV split,
+    on a pool of n_jobs workers if n_jobs is not 1, returning a
+    list of results in the order of splits"""
+    if n_jobs in (None, 1) or len(splits) < 2:
+        return [func(ctrain, ctest, *args) for ctrain, ctest in splits]
+    return Parallel(n_jobs=n_jobs)(delayed(func)(ctrain, ctest, *args)
+                                   for ctrain, ctest in splits)
+
+def _center_scale(xdat, scale=True):
+    """internal use: mean and std of columns, as used by PLSRegression"""
+    xmean = xdat.mean(axis=0)
+    xstd = np.ones(xdat.shape[1:])
+    if scale:
+        xstd = xdat.std(axis=0, ddof=1)
+        xstd[xstd == 0.0] = 1.0
+    return xmean, xstd
+
+def _pls_cvfold(ctrain, ctest, spectra, ydat, max_ncomps, scale, kws):
+    """internal use: residuals of test spectra for 1 to max_ncomps
+    PLS components, from a single fit of the training spectra
+
+    The training data is centered and scaled once, and the PLS
+    components are computed in order, so that the model for n
+    components is given by the first n components of the full fit.
+    """
+    ytrain = ydat[ctrain].reshape(-1, 1)
+    xmean, xstd = _center_scale(spectra[ctrain, :], scale=scale)
+    ymean, ystd = _center_scale(ytrain, scale=scale)
+    xtrain = (spectra[ctrain, :] - xmean)/xstd
+    xtest = (spectra[ctest, :] - xmean)/xstd
+
+    model = PLSRegression(n_components=max_ncomps, scale=False, **kws)
+    model.fit(xtrain, (ytrain - ymean)/ystd)
+    wts, loads = model.x_weights_, model.x_loadings_
+    yloads = model.y_loadings_
+
+    resid = np.zeros((max_ncomps, len(ctest)))
+    for i in range(max_ncomps):
+        n = i + 1
+        rot = np.dot(wts[:, :n], np.linalg.pinv(np.dot(loads[:, :n].T, wts[:, :n])))
+        coef = np.dot(rot, yloads[:, :n].T)
+        ypred = np.dot(xtest, coef)[:, 0]*ystd[0] + ymean[0]
+        resid[i, :] = ypred - ydat[ctest]
+    return resid
+
+def _lasso_cvfold(ctrain, ctest, spectra, ydat, alphas, use_lars, kws):
+    """internal use: residuals of test spectra for each value of alpha"""
+    creator = LassoLars if use_lars else Lasso
+    resid = np.zeros((len(alphas), len(ctest)))
+    for i, alpha in enumerate(alphas):
+        model = creator(alpha=alpha, **kws)
+        model.fit(spectra[ctrain, :], ydat[ctrain])
+        resid[i, :] = model.predict(spectra[ctest, :]) - ydat[ctest]
+    return resid
+
+def _rmse_curve(fold_resids):
+    """internal use: RMSE for each candidate from list of fold residuals"""
+    resid = np.concatenate(fold_resids, axis=1)
+    return np.sqrt((resid**2).mean(axis=1))
+
 def pls_train(groups, varname='valence', arrayname='norm', scale=True,
-              ncomps=2, cv_folds=None, cv_repeats=None, skip_cv=False,
+              ncomps=2, max_ncomps=20, cv_folds=None, cv_repeats=None,
+              skip_cv=False, n_jobs=1, random_state=None,
               xmin=-np.inf, xmax=np.inf, **kws):
 
     """use a list of data groups to train a Partial Least Squares model
 
     Arguments
     ---------
-      groups      list of groups to use as components
-      varname     name of characteristic value to model ['valence']
-      arrayname   string of array name to be fit (see Note 3) ['norm']
-      xmin        x-value for start of fit range [-inf]
-      xmax        x-value for end of fit range [+inf]
-      scale       bool to scale data [True]
-      cv_folds    None or number of Cross-Validation folds (Seee Note 4) [None]
-      cv_repeats  None or number of Cross-Validation repeats (Seee Note 4) [None]
-      skip_cv     bool to skip doing Cross-Validation [None]
-      ncomps      number of independent components  (See Note 5) [2]
+      groups       list of groups to use as components
+      varname      name of characteristic value to model ['valence']
+      arrayname    string of array name to be fit (see Note 3) ['norm']
+      xmin         x-value for start of fit range [-inf]
+      xmax         x-value for end of fit range [+inf]
+      scale        bool to scale data [True]
+      cv_folds     None or number of Cross-Validation folds (Seee Note 4) [None]
+      cv_repeats   None or number of Cross-Validation repeats (Seee Note 4) [None]
+      skip_cv      bool to skip doing Cross-Validation [None]
+      ncomps       number of independent components  (See Note 5) [2]
+      max_ncomps   max number of components to search when ncomps is None [20]
+      n_jobs       number of parallel workers for Cross-Validation (See Note 6) [1]
+      random_state None or int seed for Cross-Validation folds [None]
 
     Returns
     -------
@@ -55,44 +147,44 @@ def pls_train(groups, varname='valence', arrayname='norm', scale=True,
             will be used (rounded).
      5.  The optimal number of components may be best found from PCA. If set to None,
          a search will be done for ncomps that gives the lowest RMSE_CV.
+         Each Cross-Validation fold is fit once, giving RMSE_CV for all
+         numbers of components up to ncomps (or max_ncomps), stored as
+         `ncomps_cv` and `rmse_cv_curve` in the output.
+     6.  With n_jobs other than 1, Cross-Validation folds are run on a pool
+         of workers (-1 to use all processors).  The folds are drawn before
+         they are run, so results do not depend on n_jobs. Set random_state
+         for repeatable folds.
     """
     if not HAS_SKLEARN:
         raise ImportError("scikit-learn not installed")
 
-    xdat, spectra = groups2matrix(groups, arrayname, xmin=xmin, xmax=xmax)
-    groupnames = []
-    ydat = []
-    for g in groups:
-        groupnames.append(getattr(g, 'filename',
-                                  getattr(g, 'groupname', repr(g))))
-        val = getattr(g, varname, None)
-        if val is None:
-            raise Value("group '%s' does not have attribute '%s'" % (g, varname))
-        ydat.append(val)
-    ydat = np.array(ydat)
-
+    xdat, spectra, ydat, groupnames = _regress_data(groups, varname,
+                                                    arrayname, xmin, xmax)
     nvals = len(groups)
 
-    kws['scale'] = scale
-    kws['n_components'] = ncomps
-
-    model = PLSRegression(**kws)
-
-    rmse_cv = None
+    rmse_cv = rmse_cv_curve = ncomps_cv = None
+    cv_time = 0.0
     if not skip_cv:
-        if cv_folds is None:
-            cv_folds = int(round(np.sqrt(nvals)))
-        if  cv_repeats is None:
-            cv_repeats = int(round(np.sqrt(nvals)) - 1)
-
-        resid = []
-        cv = RepeatedKFold(n_splits=cv_folds, n_repeats=cv_repeats)
-        for ctrain, ctest in cv.split(range(nvals)):
-            model.fit(spectra[ctrain, :], ydat[ctrain])
-            ypred = model.predict(spectra[ctest, :])[:, 0]
-            resid.extend((ypred - ydat[ctest]).tolist())
-        resid = np.array(resid)
-        rmse_cv = np.sqrt( (resid**2).mean() )
+        t0 = time.time()
+        cv_folds, cv_repeats, splits = _cv_splits(nvals, cv_folds,
+                                                  cv_repeats, random_state)
+        nmax = ncomps
+        if ncomps is None:
+            ntrain = min([len(ctrain) for ctrain, ctest in splits])
+            nmax = min(max_ncomps, ntrain-1, spectra.shape[1])
+        resids = _run_folds(_pls_cvfold, splits, n_jobs, spectra, ydat,
+                            nmax, scale, kws)
+        rmse_cv_curve = _rmse_curve(resids)
+        ncomps_cv = np.arange(1, nmax+1)
+        if ncomps is None:
+            ncomps = ncomps_cv[np.argmin(rmse_cv_curve)]
+        rmse_cv = rmse_cv_curve[ncomps-1]
+        cv_time = time.time() - t0
+    elif ncomps is None:
+        raise ValueError("pls_train needs ncomps when skipping Cross-Validation")
+
+    kws['scale'] = scale
+    kws['n_components'] = int(ncomps)
 
     # final fit without cross-validation
     model = PLSRegression(**kws)
@@ -105,31 +197,34 @@ def pls_train(groups, varname='valence', arrayname='norm', scale=True,
     return Group(x=xdat, spectra=spectra, ydat=ydat, ypred=ypred,
                  coefs=model.x_weights_, loadings=model.x_loadings_,
                  cv_folds=cv_folds, cv_repeats=cv_repeats, rmse_cv=rmse_cv,
+                 ncomps=int(ncomps), ncomps_cv=ncomps_cv,
+                 rmse_cv_curve=rmse_cv_curve, cv_time=cv_time,
                  rmse=rmse, model=model, varname=varname,
                  arrayname=arrayname, scale=scale, groupnames=groupnames,
                  keywords=kws)
 
 
-
 def lasso_train(groups, varname='valence', arrayname='norm', alpha=None,
                 use_lars=True, fit_intercept=True, normalize=True,
-                cv_folds=None, cv_repeats=None, skip_cv=False,
-                xmin=-np.inf, xmax=np.inf, **kws):
+                cv_folds=None, cv_repeats=None, skip_cv=False, n_jobs=1,
+                random_state=None, xmin=-np.inf, xmax=np.inf, **kws):
 
     """use a list of data groups to train a Lasso/LassoLars model
 
     Arguments
     ---------
-      groups      list of groups to use as components
-      varname     name of characteristic value to model ['valence']
-      arrayname   string of array name to be fit (see Note 3) ['norm']
-      xmin        x-value for start of fit range [-inf]
-      xmax        x-value for end of fit range [+inf]
-      alpha       alpha parameter for LassoLars (See Note 5) [None]
-      use_lars    bool to use LassoLars instead of Lasso [True]
-      cv_folds    None or number of Cross-Validation folds (Seee Note 4) [None]
-      cv_repeats  None or number of Cross-Validation repeats (Seee Note 4) [None]
-      skip_cv     bool to skip doing Cross-Validation [None]
+      groups       list of groups to use as components
+      varname      name of characteristic value to model ['valence']
+      arrayname    string of array name to be fit (see Note 3) ['norm']
+      xmin         x-value for start of fit range [-inf]
+      xmax         x-value for end of fit range [+inf]
+      alpha        alpha parameter for LassoLars (See Note 5) [None]
+      use_lars     bool to use LassoLars instead of Lasso [True]
+      cv_folds     None or number of Cross-Validation folds (Seee Note 4) [None]
+      cv_repeats   None or number of Cross-Validation repeats (Seee Note 4) [None]
+      skip_cv      bool to skip doing Cross-Validation [None]
+      n_jobs       number of parallel workers for Cross-Validation (See Note 6) [1]
+      random_state None or int seed for Cross-Validation folds [None]
 
     Returns
     -------
@@ -144,58 +239,59 @@ def lasso_train(groups, varname='valence', arrayname='norm', alpha=None,
             (rounded to integer).  if cv_repeats is None, sqrt(len(groups))-1
             will be used (rounded).
      5.  alpha is the regularization parameter. if alpha is None it will
-         be set using LassoLarsSCV
+         be set using LassoLarsSCV.  If alpha is a list of values, the one
+         giving the lowest RMSE_CV will be used, with RMSE_CV for all values
+         stored as `alphas` and `rmse_cv_curve` in the output.  A list of
+         values cannot be used with skip_cv=True.
+     6.  With n_jobs other than 1, Cross-Validation folds are run on a pool
+         of workers (-1 to use all processors).  The folds are drawn before
+         they are run, so results do not depend on n_jobs. Set random_state
+         for repeatable folds.
     """
     if not HAS_SKLEARN:
         raise ImportError("scikit-learn not installed")
-    xdat, spectra = groups2matrix(groups, arrayname, xmin=xmin, xmax=xmax)
-    groupnames = []
-    ydat = []
-    for g in groups:
-        groupnames.append(getattr(g, 'filename',
-                                  getattr(g, 'groupname', repr(g))))
-        val = getattr(g, varname, None)
-        if val is None:
-            raise Value("group '%s' does not have attribute '%s'" % (g, varname))
-        ydat.append(val)
-    ydat = np.array(ydat)
-
+    xdat, spectra, ydat, groupnames = _regress_data(groups, varname,
+                                                    arrayname, xmin, xmax)
     nvals = len(groups)
 
     kws.update(dict(fit_intercept=fit_intercept, normalize=normalize))
     creator = LassoLars if use_lars else Lasso
-    model = None
 
-    rmse_cv = None
-    if not skip_cv:
-        if cv_folds is None:
-            cv_folds = int(round(np.sqrt(nvals)))
-        if  cv_repeats is None:
-            cv_repeats = int(round(np.sqrt(nvals)) - 1)
+    alphas = None
+    if isinstance(alpha, (list, tuple, np.ndarray)):
+        alphas = np.asarray(alpha, dtype=float)
+        alpha = alphas[0]
 
-        cv = RepeatedKFold(n_splits=cv_folds, n_repeats=cv_repeats)
+    rmse_cv = rmse_cv_curve = None
+    cv_time = 0.0
+    if not skip_cv:
+        t0 = time.time()
+        cv_folds, cv_repeats, splits = _cv_splits(nvals, cv_folds,
+                                                  cv_repeats, random_state)
         if alpha is None:
-            lcvmod = LassoLarsCV(cv=cv, max_n_alphas=1e7,
-                                 max_iter=1e7, eps=1.e-12, **kws)
+            lcvmod = LassoLarsCV(cv=splits, max_n_alphas=int(1e7),
+                                 n_jobs=n_jobs, max_iter=int(1e7),
+                                 eps=1.e-12, **kws)
             lcvmod.fit(spectra, ydat)
             alpha = lcvmod.alpha_
-
-        model = creator(alpha=alpha, **kws)
-        resid = []
-        for ctrain, ctest in cv.split(range(nvals)):
-            model.fit(spectra[ctrain, :], ydat[ctrain])
-            ypred = model.predict(spectra[ctest, :])
-            resid.extend((ypred - ydat[ctest]).tolist())
-        resid = np.array(resid)
-        rmse_cv = np.sqrt( (resid**2).mean() )
+        if alphas is None:
+            alphas = np.array([alpha])
+
+        resids = _run_folds(_lasso_cvfold, splits, n_jobs, spectra, ydat,
+                            alphas, use_lars, kws)
+        rmse_cv_curve = _rmse_curve(resids)
+        alpha = alphas[np.argmin(rmse_cv_curve)]
+        rmse_cv = rmse_cv_curve.min()
+        cv_time = time.time() - t0
+    elif alphas is not None and len(alphas) > 1:
+        raise ValueError("lasso_train needs a single alpha when skipping Cross-Validation")
 
     if alpha is None:
         cvmod = creator(**kws)
         cvmod.fit(spectra, ydat)
         alpha = cvmod.alpha_
 
-    if model is None:
-        model = creator(alpha=alpha, **kws)
+    model = creator(alpha=alpha, **kws)
 
     # final fit without cross-validation
     out = model.fit(spectra, ydat)
@@ -207,7 +303,8 @@ def lasso_train(groups, varname='valence', arrayname='norm', alpha=None,
     return Group(x=xdat, spectra=spectra, ydat=ydat, ypred=ypred,
                  alpha=alpha, active=model.active_, coefs=model.coef_,
                  cv_folds=cv_folds, cv_repeats=cv_repeats,
-                 rmse_cv=rmse_cv, rmse=rmse, model=model, varname=varname,
+                 rmse_cv=rmse_cv, alphas=alphas, rmse_cv_curve=rmse_cv_curve,
+                 cv_time=cv_time, rmse=rmse, model=model, varname=varname,
                  arrayname=arrayname, fit_intercept=fit_intercept,
                  normalize=normalize, groupnames=groupnames, keywords=kws)
 
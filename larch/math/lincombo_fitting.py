@@ -7,9 +7,11 @@ import sys
 import time
 import json
 import copy
+import heapq
 
 from itertools import combinations
 from collections import OrderedDict
+from multiprocessing import Pool
 from glob import glob
 
 import numpy as np
@@ -146,8 +148,11 @@ def lincombo_fit(group, components, weights=None, minvals=None,
         params.add('c%i' % i, value=weights[i], min=minvals[i], max=maxvals[i])
 
     if sum_to_one:
-        expr = ['1'] + ['c%i' % i for i in range(ncomps-1)]
-        params['c%i' % (ncomps-1)].expr = '-'.join(expr)
+        # the weight set by the constraint is clipped to its bounds, which
+        # would break the sum, so use the largest starting weight for it
+        idep = int(np.argmax(weights))
+        expr = ['1'] + ['c%i' % i for i in range(ncomps) if i != idep]
+        params['c%i' % idep].expr = '-'.join(expr)
 
     expr = ['c%i' % i for i in range(ncomps)]
     params.add('total', expr='+'.join(expr))
@@ -173,9 +178,141 @@ def lincombo_fit(group, components, weights=None, minvals=None,
                  params=params, weights=weights, weights_lstsq=weights_lstsq,
                  xdata=xdat, ydata=ydat, yfit=yfit, ycomps=fcomps)
 
+def _lincombo_screen(gram, aty, yy, subsets, minvals, maxvals, sum_to_one,
+                     prune=False):
+    """solve the linear least-squares problem for many subsets of the
+    components at once, using the Gram matrix of the components
+
+    Arguments
+    ---------
+      gram        Gram matrix (ncomps, ncomps) of components: A^T A
+      aty         array (ncomps,) of A^T y
+      yy          y^T y
+      subsets     int array (nsubsets, nx) of component indices
+      minvals     array (ncomps,) of min weights
+      maxvals     array (ncomps,) of max weights
+      sum_to_one  bool, whether to force weights to sum to 1.0
+      prune       bool, whether to skip subsets with weights out of bounds
+
+    Returns
+    -------
+      weights (nsubsets, nx), chi-square (nsubsets,), and a bool
+      array (nsubsets,) of whether the linear solution is within bounds
+
+    Notes
+    -----
+      with sum_to_one, the weights are found from the KKT system
+          [G  1] [w]   [b]
+          [1  0] [u] = [1]
+      for each subset, otherwise from G w = b.  Subsets with weights
+      out of bounds are solved with _lincombo_bounded() unless pruned.
+    """
+    nsub, nx = subsets.shape
+    gsub = gram[subsets[:, :, None], subsets[:, None, :]]
+    bsub = aty[subsets]
+    if sum_to_one:
+        kkt = np.zeros((nsub, nx+1, nx+1))
+        kkt[:, :nx, :nx] = gsub
+        kkt[:, :nx, nx] = kkt[:, nx, :nx] = 1.0
+        rhs = np.ones((nsub, nx+1))
+        rhs[:, :nx] = bsub
+    else:
+        kkt, rhs = gsub, bsub
+    try:
+        sol = np.linalg.solve(kkt, rhs[:, :, None])[:, :, 0]
+    except np.linalg.LinAlgError:
+        sol = np.einsum('ijk,ik->ij', np.linalg.pinv(kkt), rhs)
+    weights = sol[:, :nx]
+    chisqr = (np.einsum('ij,ijk,ik->i', weights, gsub, weights)
+              - 2*(weights*bsub).sum(axis=1) + yy)
+    chisqr = np.maximum(chisqr, 0)
+    inbounds = np.all((weights >= minvals[subsets]) &
+                      (weights <= maxvals[subsets]), axis=1)
+    if not prune:
+        for i in np.where(~inbounds)[0]:
+            weights[i], chisqr[i] = _lincombo_bounded(gram, aty, yy, subsets[i],
+                                                      minvals, maxvals, sum_to_one)
+    return weights, chisqr, inbounds
+
+def _lincombo_bounded(gram, aty, yy, subset, minvals, maxvals, sum_to_one,
+                      maxiter=200):
+    """solve the linear least-squares problem for one subset of the
+    components with bounds on the weights, returning weights and chi-square
+
+    This uses a primal active-set method on the Gram matrix, with weights
+    at bounds held fixed, and the equality constraint if sum_to_one.
+    """
+    nx = len(subset)
+    gsub = gram[np.ix_(subset, subset)]
+    bsub = aty[subset]
+    lo, hi = minvals[subset], maxvals[subset]
+
+    # feasible starting point
+    w = np.clip(np.ones(nx)/nx, lo, hi)
+    if sum_to_one:
+        delta = 1.0 - w.sum()
+        room = (hi - w) if delta > 0 else (w - lo)
+        if room.sum() < abs(delta):
+            return w, np.inf
+        w = w + np.sign(delta)*room*abs(delta)/room.sum()
+    atlo, athi = (w <= lo), (w >= hi)
+
+    for i in range(maxiter):
+        fixed = atlo | athi
+        free = np.where(~fixed)[0]
+        grad = np.dot(gsub, w) - bsub
+        # step on free weights, holding the sum if needed
+        nfree = len(free)
+        step = np.zeros(nx)
+        mu = 0.0
+        if nfree > 0:
+            neq = 1 if sum_to_one else 0
+            kkt = np.zeros((nfree+neq, nfree+neq))
+            kkt[:nfree, :nfree] = gsub[np.ix_(free, free)]
+            rhs = np.zeros(nfree+neq)
+            rhs[:nfree] = -grad[free]
+            if sum_to_one:
+                kkt[:nfree, nfree] = kkt[nfree, :nfree] = 1.0
+            sol = np.linalg.lstsq(kkt, rhs, rcond=None)[0]
+            step[free] = sol[:nfree]
+            if sum_to_one:
+                mu = sol[nfree]
+        elif sum_to_one:
+            mu = -grad.mean()
+
+        if np.sqrt((step**2).sum()) < 1.e-12*(1 + np.sqrt((w**2).sum())):
+            # check multipliers of weights held at bounds
+            lam = np.where(atlo, grad + mu, np.where(athi, -grad - mu, 0))
+            if not np.any(fixed) or lam[fixed].min() >= -1.e-14*(1+abs(grad).max()):
+                break
+            release = np.where(fixed)[0][np.argmin(lam[fixed])]
+            atlo[release] = athi[release] = False
+            continue
+
+        # take step, stopping at the first bound reached
+        alpha, block = 1.0, None
+        for j in free:
+            if step[j] < 0 and w[j] + step[j] < lo[j]:
+                frac = (lo[j] - w[j])/step[j]
+                if frac < alpha:
+                    alpha, block = frac, (j, True)
+            elif step[j] > 0 and w[j] + step[j] > hi[j]:
+                frac = (hi[j] - w[j])/step[j]
+                if frac < alpha:
+                    alpha, block = frac, (j, False)
+        w = w + alpha*step
+        if block is not None:
+            j, lower = block
+            w[j] = lo[j] if lower else hi[j]
+            atlo[j], athi[j] = lower, not lower
+
+    chisqr = np.dot(w, np.dot(gsub, w)) - 2*np.dot(w, bsub) + yy
+    return w, max(chisqr, 0)
+
 def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
                     arrayname='norm', xmin=-np.inf, xmax=np.inf,
-                    max_ncomps=None, sum_to_one=True):
+                    max_ncomps=None, sum_to_one=True, nbest=None,
+                    prune=False, nproc=1):
     """perform linear combination fittings for a group with all combinations
     of 2 or more of the components given
 
@@ -191,6 +328,12 @@ def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
       xmax        x-value for end of fit range [+inf]
       sum_to_one  bool, whether to force weights to sum to 1.0 [True]
       max_ncomps  int or None: max number of components to use [None -> all]
+      nbest       int or None: number of best combinations to return
+                  (see Note 3) [None -> all]
+      prune       bool, whether to skip combinations with weights outside
+                  of the bounds (see Note 3) [False]
+      nproc       number of processes for screening combinations [1]
+
     Returns
     -------
      list of groups with resulting weights and fit statistics,
@@ -201,6 +344,19 @@ def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
      1.  The names of Group members for the components must match those of the
          group to be fitted.
      2.  arrayname can be one of `norm` or `dmude`
+     3.  All combinations are first solved as linear least-squares problems
+         from the Gram matrix of the components, and ranked by reduced
+         chi-square.  Combinations with weights outside the bounds are
+         solved as bounded least-squares problems, or skipped if prune
+         is True:  with bounds of [0, 1], such a combination is a smaller
+         combination with a weight at 0.  Combinations are then fit with
+         lincombo_fit() in this order, starting from these weights, to
+         give uncertainties.  With nbest set, fitting stops once the
+         nbest-th best fit has a lower reduced chi-square than that of the
+         next combination from the linear solutions, which is the best
+         that combination can give.  Without nbest, all combinations are
+         fit with lincombo_fit(), so nbest must be set for lincombo_fitall
+         to be faster than fitting every combination.
     """
 
     ncomps = len(components)
@@ -223,17 +379,56 @@ def lincombo_fitall(group, components, weights=None, minvals=None, maxvals=None,
         max_ncomps = ncomps
     elif max_ncomps > 0:
         max_ncomps = min(max_ncomps, ncomps)
-    all = []
+
+    # rank all combinations from the linear least-squares solutions
+    allgroups = [group]
+    allgroups.extend(components)
+    xdat, yall = groups2matrix(allgroups, yname=arrayname,
+                               xname='energy', xmin=xmin, xmax=xmax)
+    ydat, ycomps = yall[0, :], yall[1:, :]
+    gram = np.dot(ycomps, ycomps.T)
+    aty = np.dot(ycomps, ydat)
+    yy = np.dot(ydat, ydat)
+    lo = np.array([-np.inf if v is None else v for v in minvals], dtype=float)
+    hi = np.array([np.inf if v is None else v for v in maxvals], dtype=float)
+
+    tasks = []
     for nx in range(int(max_ncomps), 1, -1):
-        for comps in combinations(components, nx):
-            labs = [get_label(c) for c in comps]
-            _wts = [1.0/nx for lab in labs]
-            _min = [_save[lab][1] for lab in labs]
-            _max = [_save[lab][2] for lab in labs]
-
-            o = lincombo_fit(group, comps, weights=_wts, arrayname=arrayname,
-                             minvals=_min, maxvals=_max, xmin=xmin, xmax=xmax,
-                             sum_to_one=sum_to_one)
-            all.append(o)
+        subsets = np.array(list(combinations(range(ncomps), nx)))
+        for chunk in np.array_split(subsets, max(1, min(nproc, len(subsets)))):
+            tasks.append((gram, aty, yy, chunk, lo, hi, sum_to_one, prune))
+    if nproc > 1:
+        with Pool(nproc) as pool:
+            screened = pool.starmap(_lincombo_screen, tasks)
+    else:
+        screened = [_lincombo_screen(*task) for task in tasks]
+
+    ranked = []
+    for task, (wts, chisqr, inbounds) in zip(tasks, screened):
+        subsets = task[3]
+        nvarys = subsets.shape[1] - 1 if sum_to_one else subsets.shape[1]
+        for subset, chi2, ok, wt in zip(subsets, chisqr, inbounds, wts):
+            if ok or not prune:
+                ranked.append((chi2/(len(ydat) - nvarys), tuple(subset),
+                               tuple(wt)))
+    ranked.sort()
+
+    all = []
+    for redchi, subset, _wts in ranked:
+        # stop when the nbest-th fit is better than the best possible
+        # result for the combinations not yet fit, fitting near-ties
+        if (nbest is not None and len(all) >= nbest and
+            heapq.nsmallest(nbest, [o.redchi for o in all])[-1] <
+            redchi*(1 - 1.e-6)):
+            break
+        comps = [components[i] for i in subset]
+        labs = [get_label(c) for c in comps]
+        _min = [_save[lab][1] for lab in labs]
+        _max = [_save[lab][2] for lab in labs]
+
+        o = lincombo_fit(group, comps, weights=_wts, arrayname=arrayname,
+                         minvals=_min, maxvals=_max, xmin=xmin, xmax=xmax,
+                         sum_to_one=sum_to_one)
+        all.append(o)
     # sort outputs by reduced chi-square
-    return sorted(all, key=lambda x: x.redchi)
+    return sorted(all, key=lambda x: x.redchi)[:nbest]
@@ -26,6 +26,9 @@ from lmfit import minimize, Parameters
 
 from .lincombo_fitting import get_arrays, get_label, groups2matrix
 
+# max number of values read at once for incremental PCA training
+PCA_CHUNKSIZE = 2**22
+
 
 def nmf_train(groups, arrayname='norm', xmin=-np.inf, xmax=np.inf,
               solver='cd', beta_loss=2):
@@ -114,7 +117,8 @@ def pca_athena(groups, arrayname='norm', subtract_mean=True,
     evec = np.dot(data, var)[:, iorder]
     return evec, evals
 
-def pca_train(groups, arrayname='norm', xmin=-np.inf, xmax=np.inf):
+def pca_train(groups, arrayname='norm', xmin=-np.inf, xmax=np.inf,
+              method='eigh', ncomps=None):
     """use a list of data groups to train a Principal Component Analysis
 
     Arguments
@@ -123,6 +127,9 @@ def pca_train(groups, arrayname='norm', xmin=-np.inf, xmax=np.inf):
       arrayname   string of array name to be fit (see Note 2) ['norm']
       xmin        x-value for start of fit range [-inf]
       xmax        x-value for end of fit range [+inf]
+      method      one of 'eigh', 'randomized', 'incremental' ['eigh'],
+                  see pca_train_matrix()
+      ncomps      number of components for 'randomized' [None]
 
     Returns
     -------
@@ -136,33 +143,136 @@ def pca_train(groups, arrayname='norm', xmin=-np.inf, xmax=np.inf):
     """
     xdat, ydat = groups2matrix(groups, arrayname, xmin=xmin, xmax=xmax)
     labels = [get_label(g) for g  in groups]
-    narr, nfreq = ydat.shape
+    out = pca_train_matrix(xdat, ydat, method=method, ncomps=ncomps,
+                           labels=labels, arrayname=arrayname)
+    out.xmin, out.xmax = xmin, xmax
+    return out
 
-    ymean = ydat.mean(axis=0)
-    ynorm = ydat - ymean
+def pca_train_matrix(xdat, ydat, method='eigh', ncomps=None, labels=None,
+                     arrayname='norm', chunksize=None, random_state=None):
+    """train a Principal Component Analysis from a 2D array of spectra
 
-    # normalize data to be centered at 0 with unit standard deviation
-    ynorm = (ynorm.T - ynorm.mean(axis=1)) / ynorm.std(axis=1)
-    eigval, eigvec_ = np.linalg.eigh(np.dot(ynorm.T, ynorm) / narr)
-    eigvec = (np.dot(ynorm, -eigvec_)/narr).T
-    eigvec, eigval = eigvec[::-1, :], eigval[::-1]
+    Arguments
+    ---------
+      xdat          1D x array, shape (nfreq,)
+      ydat          2D array of spectra, shape (nspectra, nfreq), which
+                    may be an array-like object such as an HDF5 dataset
+                    for method='incremental'
+      method        one of 'eigh', 'randomized', 'incremental' ['eigh']
+      ncomps        number of components for 'randomized' [None -> 20]
+      labels        list of labels for spectra [None]
+      arrayname     name of array, for pca_fit ['norm']
+      chunksize     max number of values to read at once for 'incremental'
+                    [PCA_CHUNKSIZE]
+      random_state  seed or numpy RandomState for 'randomized' [None]
 
-    variances = eigval/eigval.sum()
+    Returns
+    -------
+      group with trained PCA model, to be used with pca_fit
 
-    # calculate IND statistic
-    ind = None
-    for r in range(narr-1):
-        nr = narr - r - 1
-        indval = np.sqrt(nfreq*eigval[r:].sum()/nr)/nr**2
-        if ind is None:
-            ind = [indval]
-        ind.append(indval)
-    ind = np.array(ind)
+    Notes
+    -----
+      each spectrum, after subtracting the mean spectrum, is normalized to
+      zero mean and unit standard deviation. Components are found from
+        'eigh'         eigenvectors of the (nspectra, nspectra) covariance
+        'randomized'   a randomized truncated SVD, finding the first ncomps
+                       components of the normalized data matrix
+        'incremental'  eigenvectors of the (nfreq, nfreq) covariance, summed
+                       over chunks of spectra, so that the whole data set is
+                       never in memory.
+      The eigenvalues and IND statistic are found for all components with
+      'eigh', and for those found for the other methods.
+    """
+    method = method.lower()
+    if method not in ('eigh', 'randomized', 'incremental'):
+        raise ValueError("pca method must be one of 'eigh', 'randomized', 'incremental'")
+    narr, nfreq = ydat.shape
+    if labels is None:
+        labels = ['spectrum%d' % (i+1) for i in range(narr)]
 
+    total = None
+    if method == 'incremental':
+        ymean, eigval, eigvec = _pca_incremental(ydat, chunksize=chunksize)
+        total = eigval.sum()
+    else:
+        ydat = np.asarray(ydat)
+        ymean = ydat.mean(axis=0)
+        ynorm = ydat - ymean
+        # normalize data to be centered at 0 with unit standard deviation
+        ynorm = (ynorm.T - ynorm.mean(axis=1)) / ynorm.std(axis=1)
+        if method == 'eigh':
+            eigval, eigvec_ = np.linalg.eigh(np.dot(ynorm.T, ynorm) / narr)
+            eigvec = (np.dot(ynorm, -eigvec_)/narr).T
+            eigvec, eigval = eigvec[::-1, :], eigval[::-1]
+        else:
+            if ncomps is None:
+                ncomps = 20
+            ncomps = min(ncomps, narr, nfreq)
+            umat, sval = _randomized_svd(ynorm, ncomps, random_state=random_state)
+            eigval = sval**2/narr
+            eigvec = -(umat*sval).T/narr
+            total = (ynorm**2).sum()/narr
+
+    if total is None:
+        total = eigval.sum()
+    variances = eigval/total
+    ind = _pca_ind(eigval, narr, nfreq, total=total)
     nsig = np.argmin(ind)
     return Group(x=xdat, arrayname=arrayname, labels=labels, ydat=ydat,
-                 xmin=xmin, xmax=xmax, mean=ymean, components=eigvec,
-                 eigenvalues=eigval, variances=variances, ind=ind, nsig=nsig)
+                 xmin=xdat[0], xmax=xdat[-1], mean=ymean, components=eigvec,
+                 eigenvalues=eigval, variances=variances, ind=ind, nsig=nsig,
+                 method=method)
+
+def _pca_ind(eigval, narr, nfreq, total=None):
+    """IND statistic from eigenvalues, as found by pca_train, for as many
+    components as eigenvalues are given, using `total` as the sum of
+    all eigenvalues"""
+    nind = min(len(eigval), narr-1)
+    tail = np.cumsum(eigval[::-1])[::-1][:nind]
+    if total is not None:
+        tail = tail + max(0, total - eigval.sum())
+    nr = narr - np.arange(nind) - 1
+    ind = np.sqrt(nfreq*tail/nr)/nr**2
+    return np.concatenate((ind[:1], ind))
+
+def _randomized_svd(amat, ncomps, noversample=10, niter=4, random_state=None):
+    """first ncomps left singular vectors and singular values of amat,
+    with the randomized range finder of Halko, Martinsson, and Tropp"""
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    nrow, ncol = amat.shape
+    nsamp = min(ncomps + noversample, nrow, ncol)
+    qmat = np.dot(amat, random_state.normal(size=(ncol, nsamp)))
+    qmat, _ = np.linalg.qr(qmat)
+    for i in range(niter):
+        qmat, _ = np.linalg.qr(np.dot(amat.T, qmat))
+        qmat, _ = np.linalg.qr(np.dot(amat, qmat))
+    umat, sval, _ = np.linalg.svd(np.dot(qmat.T, amat), full_matrices=False)
+    return np.dot(qmat, umat)[:, :ncomps], sval[:ncomps]
+
+def _pca_incremental(ydat, chunksize=None):
+    """mean spectrum, eigenvalues and components from a (nspectra, nfreq)
+    array, reading chunks of spectra and summing the (nfreq, nfreq)
+    covariance of the normalized spectra"""
+    narr, nfreq = ydat.shape
+    if chunksize is None:
+        chunksize = PCA_CHUNKSIZE
+    nchunk = max(1, int(chunksize//nfreq))
+    ymean = np.zeros(nfreq)
+    for i0 in range(0, narr, nchunk):
+        ymean += np.asarray(ydat[i0:i0+nchunk], dtype=np.float64).sum(axis=0)
+    ymean /= narr
+    cov = np.zeros((nfreq, nfreq))
+    for i0 in range(0, narr, nchunk):
+        ynorm = np.asarray(ydat[i0:i0+nchunk], dtype=np.float64) - ymean
+        ynorm = ((ynorm.T - ynorm.mean(axis=1)) / ynorm.std(axis=1)).T
+        cov += np.dot(ynorm.T, ynorm)
+    eigval, umat = np.linalg.eigh(cov/narr)
+    eigval, umat = eigval[::-1], umat[:, ::-1]
+    ncomps = min(narr, nfreq)
+    eigval = np.maximum(eigval[:ncomps], 0)
+    eigvec = -(umat[:, :ncomps]*np.sqrt(eigval*narr)).T/narr
+    return ymean, eigval, eigvec
 
 def pca_statistics(pca_model):
     """return PCA arrays of statistics IND and F
@@ -174,21 +284,24 @@ def pca_statistics(pca_model):
       IND(r) =  sqrt( eigv[r:].sum() / (p*(n-r))) / (n-r)**2
 
       F1R(r) = eigv[r] / (p+1-r)*(n+1-r) / sum_i=r^n-1 (eigv[i] / ((p+1-i)*(n+1-i)))
+
+    eigenvalues not found in the model are taken as 0.
     """
     p, n = pca_model.ydat.shape
-    eigv = pca_model.eigenvalues
-    ind, f1r = [], []
-    for r in range(n-1):
-        nr = n-r-1
-        ind.append( np.sqrt(eigv[r:].sum()/ (p*nr))/nr**2)
-        f1sum = 0
-        for i in range(r, n):
-            f1sum += eigv[i]/((p+1-i)*(n+1-i))
-        f1sum = max(1.e-10, f1sum)
-        f1r.append(eigv[r] / (max(1, (p+1-r)*(n-r+1)) * f1sum))
-
-    pca_model.ind = np.array(ind)
-    pca_model.f1r = np.array(f1r)
+    eigv = np.zeros(max(n, len(pca_model.eigenvalues)))
+    eigv[:len(pca_model.eigenvalues)] = pca_model.eigenvalues
+    tail = np.cumsum(eigv[::-1])[::-1][:n-1]
+    eigv = eigv[:n]
+    r = np.arange(n)
+    nr = n - r[:-1] - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f1terms = np.where(eigv == 0, 0, eigv/((p+1-r)*(n+1-r)))
+        f1sum = np.cumsum(f1terms[::-1])[::-1][:-1]
+        ind = np.sqrt(tail/(p*nr))/nr**2
+        f1r = eigv[:-1] / (np.maximum(1, (p+1-r[:-1])*(n-r[:-1]+1)) *
+                           np.maximum(1.e-10, f1sum))
+    pca_model.ind = ind
+    pca_model.f1r = f1r
 
     return pca_model.ind, pca_model.f1r
 
@@ -258,3 +371,81 @@ def pca_fit(group, pca_model, ncomps=None, rescale=True):
                              pca_model=pca_model, chi_square=chi2[0],
                              data_scale=scale, weights=weights)
     return
+
+
+def pca_fit_many(groups, pca_model, ncomps=None, rescale=True):
+    """
+    fit many spectra to a PCA training model from pca_train(), solving
+    for the scale and component weights of all spectra at once.
+
+    Arguments
+    ---------
+      groups      list of groups with data to fit, or 2D array of
+                  spectra on the x array of the model, shape (nspectra, nx)
+      pca_model   PCA model as found from pca_train()
+      ncomps      number of components to included
+      rescale     whether to allow data to be renormalized (True)
+
+    Returns
+    -------
+      group with arrays for all spectra:
+          x          x or energy value from model
+          ydat       input data interpolated onto `x`, and scaled
+          yfit       linear least-squares fit using model components
+          weights    weights for PCA components, shape (nspectra, ncomps)
+          chi_square goodness-of-fit measure
+          data_scale scale for data
+
+      For a list of groups, each group will also have a `pca_result`
+      subgroup, as from pca_fit().
+
+    Notes
+    -----
+      the scale s and weights w minimizing |s*y - mean - comps*w|**2 are
+      found in closed form: with P the projection orthogonal to the
+      components, s = (P*y).(P*mean) / (P*y).(P*y), limited to s >= 0.
+    """
+    if isinstance(groups, np.ndarray):
+        ydat = np.atleast_2d(np.array(groups, dtype=np.float64))
+        groups = None
+    else:
+        ydat = []
+        for group in groups:
+            xdat, y = get_arrays(group, pca_model.arrayname)
+            if xdat is None or y is None:
+                raise ValueError("cannot get arrays for arrayname='%s'" %
+                                 pca_model.arrayname)
+            ydat.append(interp(xdat, y, pca_model.x, kind='cubic'))
+        ydat = np.array(ydat)
+
+    if ncomps is None:
+        ncomps=len(pca_model.components)
+    comps = pca_model.components[:ncomps].transpose()
+    mean = pca_model.mean
+
+    # projection onto components, from an orthonormal basis
+    qmat, rmat = np.linalg.qr(comps)
+    def project(arr):
+        return np.dot(np.dot(arr, qmat), qmat.T)
+
+    scale = np.ones(len(ydat))
+    if rescale:
+        yperp = ydat - project(ydat)
+        mperp = mean - project(mean)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = (yperp*mperp).sum(axis=1) / (yperp*yperp).sum(axis=1)
+        scale[~np.isfinite(scale)] = 1.0
+        scale = np.maximum(scale, 0)
+        ydat = ydat*scale[:, None]
+
+    weights = np.linalg.lstsq(comps, (ydat - mean).T, rcond=None)[0].T
+    yfit = np.dot(weights, comps.T) + mean
+    chi2 = ((ydat - yfit)**2).sum(axis=1)
+
+    if groups is not None:
+        for i, group in enumerate(groups):
+            group.pca_result = Group(x=pca_model.x, ydat=ydat[i], yfit=yfit[i],
+                                     pca_model=pca_model, chi_square=chi2[i],
+                                     data_scale=scale[i], weights=weights[i])
+    return Group(x=pca_model.x, ydat=ydat, yfit=yfit, weights=weights,
+                 chi_square=chi2, data_scale=scale, pca_model=pca_model)
@@ -48,14 +48,35 @@ def reshape_sinogram(A,x=[],omega=[]):
            A = A.reshape(1,A.shape[0],A.shape[1])
 
     if len(A.shape) == 3:
-        if len(x) == A.shape[0]:
-             A = np.einsum('kij->ijk', A)
-        if len(x) == A.shape[1]:
-             A = np.einsum('ikj->ijk', A)
+        for subscripts in sinogram_axes(A.shape, x, omega)[0]:
+             A = np.einsum(subscripts, A)
     sinogram_order = len(omega) == A.shape[1]
 
     return A,sinogram_order
 
+def sinogram_axes(shape, x=[], omega=[]):
+
+    ## == INPUTS ==
+    ## shape          :    shape of 3-d array passed to reshape_sinogram()
+    ## x              :    x array for checking shape of A
+    ## omega          :    omega array for checking shape of A
+    ##
+    ## == RETURNS ==
+    ## subscripts     :  list of np.einsum() subscripts used by reshape_sinogram()
+    ## sinogram_order :  flag/argument for tomopy reconstruction (shape dependent)
+
+    if len(x) == len(omega) or len(x) < 1 or len(omega) < 1:
+        return [], False
+    shape = tuple(shape)
+    subscripts = []
+    if len(x) == shape[0]:
+        subscripts.append('kij->ijk')
+        shape = (shape[1], shape[2], shape[0])
+    if len(x) == shape[1]:
+        subscripts.append('ikj->ijk')
+        shape = (shape[0], shape[2], shape[1])
+    return subscripts, len(omega) == shape[1]
+
 def trim_sinogram(sino,x,omega,pixel_trim=None):
 
     if pixel_trim is None: pixel_trim = PIXEL_TRIM
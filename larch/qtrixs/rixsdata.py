@@ -4,8 +4,12 @@
 RIXS data object
 ================
 """
+import hashlib
 import numpy as np
-from scipy.interpolate import griddata
+from scipy.spatial import Delaunay
+from scipy.interpolate import (LinearNDInterpolator, NearestNDInterpolator,
+                               CloughTocher2DInterpolator,
+                               RegularGridInterpolator)
 from silx.io.dictdump import (dicttoh5, h5todict)
 
 from larch.math.gridxyz import gridxyz
@@ -18,6 +22,118 @@ def _tostr(arr):
     return arr.tostring().decode()
 
 
+def _digest(*arrays):
+    """md5 digest of the shapes and contents of arrays"""
+    md5 = hashlib.md5()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        md5.update(str((arr.shape, arr.dtype.str)).encode())
+        md5.update(arr.tobytes())
+    return md5.hexdigest()
+
+
+def _grid_axis(arr, step):
+    """Regular axis spanning arr with a given step, as in gridxyz()"""
+    return np.linspace(arr.min(), arr.max(), num=int((arr.max()-arr.min())/step))
+
+
+def rectilinear_grid(x, y, z):
+    """Check if scattered (x, y, z) data lie on a complete rectilinear grid,
+    as for scans at fixed emitted energy sharing the same incident energy
+    array (e.g. `get_rixs_13ide(..., interp_ene_in=True)`)
+
+    Returns
+    -------
+    None, or (xgrid, ygrid, zz) with zz.shape = (len(ygrid), len(xgrid))
+    """
+    xgrid, ix = np.unique(x, return_inverse=True)
+    ygrid, iy = np.unique(y, return_inverse=True)
+    nx, ny = len(xgrid), len(ygrid)
+    if nx < 2 or ny < 2 or nx*ny != len(z):
+        return None
+    if len(np.unique(iy*nx + ix)) != len(z):
+        return None
+    zz = np.zeros((ny, nx), dtype=np.asarray(z).dtype)
+    zz[iy, ix] = z
+    return xgrid, ygrid, zz
+
+
+class RixsInterpolator(object):
+    """Interpolator of a scattered RIXS plane, built once and evaluated
+    many times
+
+    The triangulation (or KD-tree for 'nearest') is computed on the first
+    call for each plane and then reused, giving the same values as
+    `scipy.interpolate.griddata`.  With `rectilinear=True` and data on a
+    complete (ene_in, ene_out) grid, a `RegularGridInterpolator` on the
+    scan grid is used instead (for 'linear' and 'nearest' methods), the
+    energy transfer plane being evaluated at ene_out = ene_in - ene_et.
+
+    Parameters
+    ----------
+    x, y, z : 1D arrays, incoming energy, emitted energy, intensity
+    rectilinear : bool, use the scan grid when possible [False]
+    """
+
+    def __init__(self, x, y, z, rectilinear=False):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.z = np.asarray(z)
+        self._points = {'xy': None, 'et': None}
+        self._tri = {}
+        self._interp = {}
+        self.grid = None
+        if rectilinear:
+            self.grid = rectilinear_grid(self.x, self.y, self.z)
+
+    def points(self, plane):
+        """(npts, 2) array of points for plane 'xy' or 'et'"""
+        if self._points[plane] is None:
+            _y = self.y if plane == 'xy' else self.x - self.y
+            self._points[plane] = np.column_stack((self.x, _y))
+        return self._points[plane]
+
+    def triangulation(self, plane):
+        """Delaunay triangulation of plane 'xy' or 'et' (cached)"""
+        if plane not in self._tri:
+            self._tri[plane] = Delaunay(self.points(plane))
+        return self._tri[plane]
+
+    def get_interpolator(self, plane='xy', method='nearest', fill_value=np.nan):
+        """cached interpolating function f(xi, yi) for a plane"""
+        key = (plane, method, fill_value)
+        if key in self._interp:
+            return self._interp[key]
+        if self.grid is not None and method in ('linear', 'nearest'):
+            xgrid, ygrid, zz = self.grid
+            _rgi = RegularGridInterpolator((ygrid, xgrid), zz, method=method,
+                                           bounds_error=False,
+                                           fill_value=fill_value)
+            def _interp(xi, yi):
+                xi, yi = np.broadcast_arrays(xi, yi)
+                if plane == 'et':
+                    yi = xi - yi
+                return _rgi(np.stack((yi, xi), axis=-1))
+        elif method == 'nearest':
+            _interp = NearestNDInterpolator(self.points(plane), self.z)
+        elif method == 'linear':
+            _interp = LinearNDInterpolator(self.triangulation(plane), self.z,
+                                           fill_value=fill_value)
+        elif method == 'cubic':
+            _interp = CloughTocher2DInterpolator(self.triangulation(plane),
+                                                 self.z, fill_value=fill_value)
+        else:
+            raise ValueError("Unknown interpolation method: {0}".format(method))
+        self._interp[key] = _interp
+        return _interp
+
+    def __call__(self, xi, yi, plane='xy', method='nearest', fill_value=np.nan):
+        """interpolate at points (xi, yi), yi being the emitted energy for
+        plane='xy' and the energy transfer for plane='et'"""
+        return self.get_interpolator(plane=plane, method=method,
+                                     fill_value=fill_value)(xi, yi)
+
+
 class RixsData(object):
     """RIXS plane object"""
 
@@ -34,6 +150,8 @@ class RixsData(object):
 
     grid_method = 'nearest'
     grid_lib = 'scipy'
+    #: use the scan grid for data on a complete (ene_in, ene_out) grid
+    grid_rectilinear = False
 
     _plotter = None
 
@@ -128,11 +246,12 @@ class RixsData(object):
             _etcrop = np.linspace(_etmin, _etmax, num=_netpts)
             _ycrop = np.linspace(y1, y2, num=_nypts)
 
-        _xx, _yy = np.meshgrid(_xcrop, _ycrop)
-        _exx, _et = np.meshgrid(_xcrop, _etcrop)
+        _interp = self.get_interpolator()
         _logger.info("Gridding data...")
-        _zzcrop = griddata((self._x, self._y), self._z, (_xx, _yy), method=_method)
-        _ezzcrop = griddata((self._x, self._x-self._y), self._z, (_exx, _et), method=_method)
+        _zzcrop = _interp(_xcrop[None, :], _ycrop[:, None],
+                          plane='xy', method=_method)
+        _ezzcrop = _interp(_xcrop[None, :], _etcrop[:, None],
+                           plane='et', method=_method)
 
         self.ene_in_crop = _xcrop
         self.ene_out_crop = _ycrop
@@ -140,26 +259,94 @@ class RixsData(object):
         self.rixs_map_crop = _zzcrop
         self.rixs_et_map_crop = _ezzcrop
 
+    def get_interpolator(self):
+        """Interpolator of the (_x, _y, _z) columns, rebuilt only when
+        the contents of these arrays or `grid_rectilinear` change"""
+        _key = (_digest(self._x, self._y, self._z),
+                bool(self.grid_rectilinear))
+        if getattr(self, '_interp_key', None) != _key:
+            self._interpolator = RixsInterpolator(self._x, self._y, self._z,
+                                                  rectilinear=self.grid_rectilinear)
+            self._interp_key = _key
+        return self._interpolator
+
     def grid_rixs_from_col(self):
         """Grid RIXS map from XYZ"""
         _lib = self.grid_lib or 'scipy'
         _method = self.grid_method or 'nearest'
         _xystep = self.ene_grid or 0.1
-        self.ene_in, self.ene_out, self.rixs_map = gridxyz(self._x,
-                                                           self._y,
-                                                           self._z,
-                                                           xystep=_xystep,
-                                                           lib=_lib,
-                                                           method=_method)
         self._et = self._x - self._y
-        _, self.ene_et, self.rixs_et_map = gridxyz(self._x, self._et, self._z,
-                                                   xystep=_xystep,
-                                                   lib=_lib,
-                                                   method=_method)
+        if 'matplotlib' in _lib.lower():
+            self.ene_in, self.ene_out, self.rixs_map = gridxyz(self._x,
+                                                               self._y,
+                                                               self._z,
+                                                               xystep=_xystep,
+                                                               lib=_lib,
+                                                               method=_method)
+            _, self.ene_et, self.rixs_et_map = gridxyz(self._x, self._et, self._z,
+                                                       xystep=_xystep,
+                                                       lib=_lib,
+                                                       method=_method)
+            return
+        _interp = self.get_interpolator()
+        self.ene_in = _grid_axis(self._x, _xystep)
+        self.ene_out = _grid_axis(self._y, _xystep)
+        self.ene_et = _grid_axis(self._et, _xystep)
+        _logger.info("Gridding data with {0}/{1}...".format(_lib, _method))
+        self.rixs_map = _interp(self.ene_in[None, :], self.ene_out[:, None],
+                                plane='xy', method=_method, fill_value=0)
+        self.rixs_et_map = _interp(self.ene_in[None, :], self.ene_et[:, None],
+                                   plane='et', method=_method, fill_value=0)
+
+    def get_cuts(self, kind, values, ene=None):
+        """Line cuts through the RIXS plane, interpolated from the XYZ
+        columns in a single call for all values
+
+        Parameters
+        ----------
+        kind : str
+            'CIE' : constant incoming energy, intensity vs emitted energy
+            'CEE' : constant emitted energy, intensity vs incoming energy
+            'CET' : constant energy transfer, intensity vs incoming energy
+        values : float or 1D array
+            energies of the cuts
+        ene : 1D array or None
+            energies along the cuts [None -> ene_out for 'CIE', ene_in
+            otherwise]
+
+        Returns
+        -------
+        ene, cuts : 1D array, and array of shape (len(values), len(ene)),
+                    or (len(ene),) for a scalar value
+        """
+        kind = kind.upper()
+        if kind not in ('CIE', 'CEE', 'CET'):
+            raise ValueError("Unknown cut '{0}': use 'CIE', 'CEE' or 'CET'".format(kind))
+        if ene is None:
+            ene = self.ene_out if kind == 'CIE' else self.ene_in
+        ene = np.asarray(ene)
+        _vals = np.atleast_1d(values)
+        _method = self.grid_method or 'nearest'
+        _interp = self.get_interpolator()
+        if kind == 'CIE':
+            cuts = _interp(_vals[:, None], ene[None, :], plane='xy',
+                           method=_method)
+        elif kind == 'CEE':
+            cuts = _interp(ene[None, :], _vals[:, None], plane='xy',
+                           method=_method)
+        else:
+            cuts = _interp(ene[None, :], _vals[:, None], plane='et',
+                           method=_method)
+        if np.ndim(values) == 0:
+            cuts = cuts[0]
+        return ene, cuts
 
     def norm(self):
         """Simple map normalization to max-min"""
         self.rixs_map_norm = self.rixs_map/(np.nanmax(self.rixs_map)-np.nanmin(self.rixs_map))
+        if self.rixs_map_crop is not None:
+            _crop = self.rixs_map_crop
+            self.rixs_map_crop_norm = _crop/(np.nanmax(_crop)-np.nanmin(_crop))
 
 
 if __name__ == '__main__':
@@ -1137,6 +1137,7 @@ class MapAreaPanel(scrolled.ScrolledPanel):
         if erase:
             xrmmap = self.owner.current_file.xrmmap
             del xrmmap['areas/%s' % aname]
+            self.owner.current_file.clear_area_cache(aname)
 
             self.set_area_choices(xrmmap)
 
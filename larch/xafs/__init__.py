@@ -25,25 +25,27 @@ from scipy import constants
 
 from .xafsutils import KTOE, ETOK, set_xafsGroup, etok, ktoe, guess_energy_units
 from .xafsft import xftf, xftr, xftf_fast, xftr_fast, ftwindow, xftf_prep
-from .pre_edge import pre_edge, preedge, find_e0, pre_edge_baseline, prepeaks_setup
+from .pre_edge import (pre_edge, preedge, find_e0, pre_edge_baseline,
+                       prepeaks_setup, pre_edge_stack)
 from .feffdat import FeffDatFile, FeffPathGroup, feffpath, path2chi, ff2chi
 from .feffit import (FeffitDataSet, TransformGroup, feffit,
                      feffit_dataset, feffit_transform, feffit_report)
 
 from .autobk import autobk
 from .mback import mback, mback_norm
-from .diffkk import diffkk, diffKKGroup
-from .fluo import fluo_corr
+from .diffkk import diffkk, diffKKGroup, diffkk_batch
+from .fluo import fluo_corr, fluo_corr_stack
 
-from .feffrunner import FeffRunner, feffrunner, feff6l, feff8l, find_exe
+from .feffrunner import (FeffRunner, feffrunner, feff6l, feff8l, find_exe,
+                         FeffJobQueue, feff_jobqueue)
 from .feff8lpath import feff8_xafs
 
 
 
-from .cauchy_wavelet import cauchy_wavelet
+from .cauchy_wavelet import cauchy_wavelet, cauchy_wavelet_stack
 from .deconvolve import xas_convolve, xas_deconvolve
-from .estimate_noise import estimate_noise
-from .rebin_xafs import rebin_xafs, sort_xafs
+from .estimate_noise import estimate_noise, estimate_noise_stack
+from .rebin_xafs import rebin_xafs, rebin_xafs_stack, sort_xafs
 from .sigma2_models import sigma2_eins, sigma2_debye, sigma2_correldebye
 
 
@@ -113,24 +115,30 @@ def _larch_init(_larch):
     _larch.symtable.set_symbol('_xafs._feff_executable', feff6_exe)
 
 
-_larch_groups = (diffKKGroup, FeffRunner, FeffDatFile, FeffPathGroup,
-                 TransformGroup, FeffitDataSet)
+_larch_groups = (diffKKGroup, FeffRunner, FeffJobQueue, FeffDatFile,
+                 FeffPathGroup, TransformGroup, FeffitDataSet)
 
 _larch_builtins = {'_xafs': dict(autobk=autobk, etok=etok, ktoe=ktoe,
                                  guess_energy_units=guess_energy_units,
-                                 diffkk=diffkk, xftf=xftf, xftr=xftr,
+                                 diffkk=diffkk, diffkk_batch=diffkk_batch,
+                                 xftf=xftf, xftr=xftr,
                                  xftf_prep=xftf_prep, xftf_fast=xftf_fast,
                                  xftr_fast=xftr_fast, ftwindow=ftwindow,
                                  find_e0=find_e0, pre_edge=pre_edge,
+                                 pre_edge_stack=pre_edge_stack,
                                  prepeaks_setup=prepeaks_setup,
                                  pre_edge_baseline=pre_edge_baseline,
                                  mback=mback, mback_norm=mback_norm,
                                  cauchy_wavelet=cauchy_wavelet,
+                                 cauchy_wavelet_stack=cauchy_wavelet_stack,
                                  xas_deconvolve=xas_deconvolve,
                                  xas_convolve=xas_convolve,
                                  fluo_corr=fluo_corr,
+                                 fluo_corr_stack=fluo_corr_stack,
                                  estimate_noise=estimate_noise,
+                                 estimate_noise_stack=estimate_noise_stack,
                                  rebin_xafs=rebin_xafs,
+                                 rebin_xafs_stack=rebin_xafs_stack,
                                  sort_xafs=sort_xafs,
                                  sigma2_eins=sigma2_eins,
                                  sigma2_debye=sigma2_debye, feffit=feffit,
@@ -138,6 +146,7 @@ _larch_builtins = {'_xafs': dict(autobk=autobk, etok=etok, ktoe=ktoe,
                                  feffit_transform=feffit_transform,
                                  feffit_report=feffit_report,
                                  feffrunner=feffrunner, feff6l=feff6l,
+                                 feff_jobqueue=feff_jobqueue,
                                  feff8l=feff8l, feffpath= feffpath,
                                  path2chi=path2chi, ff2chi=ff2chi,
                                  feff8_xafs=feff8_xafs)}
@@ -27,9 +27,13 @@ from larch import Make_CallArgs, parse_group_args
 from larch.math import complex_phase
 from .xafsutils import set_xafsGroup
 
+# memory (in bytes) for intermediate arrays of one chunk of spectra and R rows
+MAXMEM = 2**22
+
 @Make_CallArgs(["k" ,"chi"])
 def cauchy_wavelet(k, chi=None, group=None, kweight=0, rmax_out=10,
-                   nfft=2048, _larch=None):
+                   nfft=2048, rmin=None, rstep=None, dtype='complex128',
+                   _larch=None):
     """
     Cauchy Wavelet Transform for XAFS, following work of Munoz, Argoul, and Farges
 
@@ -41,6 +45,10 @@ def cauchy_wavelet(k, chi=None, group=None, kweight=0, rmax_out=10,
       rmax_out: highest R for output data (10 Ang)
       kweight:  exponent for weighting spectra by k**kweight
       nfft:     value to use for N_fft (2048).
+      rmin:     lowest R for output data [None, use all R]
+      rstep:    R step for output data [None, use default R grid]
+      dtype:    data type of output wavelet, 'complex128' (default)
+                or 'complex64' to use half the memory.
 
       Returns:
     ---------
@@ -58,58 +66,98 @@ def cauchy_wavelet(k, chi=None, group=None, kweight=0, rmax_out=10,
     Supports First Argument Group convention (with group
     member names 'k' and 'chi')
 
+    The shape of the wavelet depends only on rmax_out and the k step, so
+    that setting rmin or rstep only selects which R values are calculated.
     """
     k, chi, group = parse_group_args(k, members=('k', 'chi'),
                                      defaults=(chi,), group=group,
                                      fcn_name='cauchy_wavelet')
 
+    r, out = cauchy_wavelet_stack(k, [chi], kweight=kweight, rmax_out=rmax_out,
+                                  nfft=nfft, rmin=rmin, rstep=rstep,
+                                  dtype=dtype)
+    out = out[0]
+    group = set_xafsGroup(group, _larch=_larch)
+    group.r  =  r
+    group.wcauchy =  out
+    group.wcauchy_mag =  np.sqrt(out.real**2 + out.imag**2)
+    group.wcauchy_re =  out.real
+    group.wcauchy_im =  out.imag
+
+def cauchy_wavelet_stack(k, chis, kweight=0, rmax_out=10, nfft=2048,
+                         rmin=None, rstep=None, dtype='complex128'):
+    """
+    Cauchy Wavelet Transform for many XAFS spectra on the same k grid
+
+    Parameters:
+    -----------
+      k:        1-d array of photo-electron wavenumber in Ang^-1
+      chis:     2-d array of chi, shape (nspectra, len(k))
+      kweight:  exponent for weighting spectra by k**kweight
+      rmax_out: highest R for output data (10 Ang)
+      nfft:     value to use for N_fft (2048).
+      rmin:     lowest R for output data [None, use all R]
+      rstep:    R step for output data [None, use default R grid]
+      dtype:    data type of output wavelet, 'complex128' (default)
+                or 'complex64' to use half the memory.
+
+      Returns:
+    ---------
+      r, wcauchy  with wcauchy of shape (nspectra, len(r), len(k))
+
+    See Also:
+    ---------
+      cauchy_wavelet
+    """
+    k = np.asarray(k)
+    chis = np.atleast_2d(chis)
+    nspec = chis.shape[0]
+
     kstep = np.round(1000.*(k[1]-k[0]))/1000.0
-    rstep = (np.pi/2048)/kstep
-    rmin = 1.e-7
     rmax = rmax_out
-    nrpts = int(np.round((rmax-rmin)/rstep))
+    nrpts = int(np.round((rmax-1.e-7)/((np.pi/2048)/kstep)))
     nkout = len(k)
-    if kweight != 0:
-        chi = chi * k**kweight
 
     # extend EXAFS to 1024 data points...
     NFT = int(nfft/2)
-    if len(k) < NFT:
-        knew = np.arange(NFT) * kstep
-        xnew = np.zeros(NFT) * kstep
-        xnew[:len(k)] = chi
-    else:
-        knew = k[:NFT]
-        xnew = chi[:NFT]
+    nkft = min(len(k), NFT)
+    kwt = k[:nkft]**kweight
 
     # FT parameters
     freq = (1.0/kstep)*np.arange(nfft)/(2*nfft)
     omega = 2*np.pi*freq
 
-    # simple FT calculation
-    tff = np.fft.fft(xnew, n= 2*nfft)
-
-    # scale parameter
-    r  = np.linspace(0, rmax, nrpts)
-    r[0] = 1.e-19
+    # R values: the default grid sets the order (nrpts) of the wavelet
+    r = np.linspace(0, rmax, nrpts)
+    if rstep is not None:
+        r0 = 0 if rmin is None else rmin
+        r = r0 + rstep*np.arange(int(np.round((rmax-r0)/rstep)) + 1)
+    elif rmin is not None:
+        r = r[np.where(r >= rmin)]
+    r[np.where(r==0)] = 1.e-19
     a  = nrpts/(2*r)
 
     # Characteristic values for Cauchy wavelet:
     cauchy_sum = np.log(2*np.pi) - np.log(1.0+np.arange(nrpts)).sum()
 
-    # Main calculation:
-    out = np.zeros(nkout*nrpts,
-                   dtype='complex128').reshape(nrpts, nkout)
-    for i in range(nrpts):
-        aom = a[i]*omega
-        aom[np.where(aom==0)] = 1.e-19
-        filt = cauchy_sum + nrpts*np.log(aom) - aom
-        tmp  = np.conj(np.exp(filt))*tff[:nfft]
-        out[i, :] = np.fft.ifft(tmp, 2*nfft)[:nkout]
+    # Main calculation, for chunks of spectra and of R rows, so that
+    # the intermediate arrays, (spectra, R rows, 2*nfft), fit in MAXMEM
+    out = np.zeros((nspec, len(r), nkout), dtype=dtype)
+    rowsize = 2*nfft*16
+    nspec_chunk = max(1, min(nspec, int(MAXMEM / rowsize)))
+    nr_chunk = max(1, int(MAXMEM / (nspec_chunk*rowsize)))
+    for j0 in range(0, nspec, nspec_chunk):
+        j1 = min(nspec, j0+nspec_chunk)
+        xnew = np.zeros((j1-j0, NFT))
+        xnew[:, :nkft] = chis[j0:j1, :nkft] * kwt
 
-    group = set_xafsGroup(group, _larch=_larch)
-    group.r  =  r
-    group.wcauchy =  out
-    group.wcauchy_mag =  np.sqrt(out.real**2 + out.imag**2)
-    group.wcauchy_re =  out.real
-    group.wcauchy_im =  out.imag
+        # simple FT calculation
+        tff = np.fft.fft(xnew, n=2*nfft, axis=1)[:, :nfft]
+        for i0 in range(0, len(r), nr_chunk):
+            i1 = min(len(r), i0+nr_chunk)
+            aom = a[i0:i1, np.newaxis]*omega[np.newaxis, :]
+            aom[np.where(aom==0)] = 1.e-19
+            filt = np.exp(cauchy_sum + nrpts*np.log(aom) - aom)
+            tmp = filt[np.newaxis, :, :] * tff[:, np.newaxis, :]
+            out[j0:j1, i0:i1, :] = np.fft.ifft(tmp, 2*nfft, axis=2)[:, :, :nkout]
+    return r, out
@@ -2,6 +2,7 @@
 import time
 import numpy as np
 from scipy.special import erfc
+from scipy.signal import fftconvolve
 
 from larch import Group
 from larch.math import interp
@@ -77,7 +78,7 @@ def kkmclf_sca(e, finp):
     fout = [0.0]*npts
     if npts >= 2:
         factor = FOPI * (e[npts-1] - e[0]) / (npts - 1)
-        nptsk = npts / 2
+        nptsk = npts // 2
         for i in range(npts):
             fout[i] = 0.0
             ei2 = e[i]*e[i]
@@ -112,7 +113,7 @@ def kkmclr_sca(e, finp):
     fout = [0.0]*npts
 
     factor = -FOPI * (e[npts-1] - e[0]) / (npts - 1)
-    nptsk  = npts / 2
+    nptsk  = npts // 2
     for i in range(npts):
         fout[i] = 0.0
         ei2 = e[i]*e[i]
@@ -161,7 +162,7 @@ def kkmclf(e, finp):
         de2  = e[j]**2 - ei2[i]
         fout[i] = sum(finp[j]/de2)
 
-    fout = fout * factor
+    fout = fout * factor * e
     return fout
 
 
@@ -199,6 +200,115 @@ def kkmclr(e, finp):
     return fout
 
 
+###
+###  These are FFT forms of the MacLaurin series algorithm.  Using
+###      1/(e_j^2 - e_i^2) = [1/(e_j - e_i) + 1/(e_j + e_i)] / (2 e_j)
+###                        = [1/(e_j - e_i) - 1/(e_j + e_i)] / (2 e_i)
+###  on an even grid, the sums over points of opposite parity become a
+###  convolution (e_j - e_i) and a correlation (e_j + e_i) with kernels
+###  that are zero for points of the same parity, done with FFTs in
+###  O(N log N).  The results are the same as for the forms above.
+###  These also work for a 2D array of many spectra on the same grid.
+###
+
+def _kkmcl_sums(e, finp):
+    """
+    sums over points j of opposite parity to i of finp[j]/(e[j]-e[i]) and
+    of finp[j]/(e[j]+e[i]), for all points i, using FFT convolutions
+
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts]
+      finp   array [npts] or [nspectra, npts]
+
+    returns:
+      diff_sum, plus_sum, each with shape [nspectra, npts]
+    """
+    npts = len(e)
+    finp = np.atleast_2d(finp)
+    if npts != finp.shape[-1]:
+        raise ValueError("Input arrays not of same length for diff KK transform")
+    if npts < 2:
+        raise ValueError("Array too short for diff KK transform")
+
+    de = (e[-1] - e[0]) / (npts-1)
+
+    ## kernel for e_j - e_i, indexed by i-j, zero for even i-j
+    m = np.arange(-(npts-1), npts)
+    odd = (np.mod(m, 2) == 1)
+    kdiff = np.zeros(len(m))
+    kdiff[odd] = -1.0/(m[odd]*de)
+
+    ## kernel for e_j + e_i, indexed by i+j, zero for even i+j
+    n = np.arange(2*npts-1)
+    odd = (np.mod(n, 2) == 1)
+    kplus = np.zeros(len(n))
+    kplus[odd] = 1.0/(2*e[0] + n[odd]*de)
+
+    diff_sum = fftconvolve(finp, kdiff[np.newaxis, :])[:, npts-1:2*npts-1]
+    plus_sum = fftconvolve(finp[:, ::-1], kplus[np.newaxis, :])[:, npts-1:2*npts-1]
+    return diff_sum, plus_sum
+
+def kkmclf_fft(e, finp):
+    """
+    forward (f'->f'') kk transform, using maclaurin series algorithm with FFTs
+
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts] (in)
+      finp   f' array [npts] or [nspectra, npts] for many spectra (in)
+      fout   f'' array, same shape as finp (out)
+    """
+    finp = np.asarray(finp, dtype=np.float64)
+    npts = len(e)
+    factor = FOPI * (e[-1] - e[0]) / (npts-1)
+    diff_sum, plus_sum = _kkmcl_sums(e, finp)
+    fout = 0.5 * factor * (diff_sum - plus_sum)
+    return fout.reshape(finp.shape)
+
+def kkmclr_fft(e, finp):
+    """
+    reverse (f''->f') kk transform, using maclaurin series algorithm with FFTs
+
+    arguments:
+      e      energy array *must be on an even grid with an even number of points* [npts] (in)
+      finp   f'' array [npts] or [nspectra, npts] for many spectra (in)
+      fout   f' array, same shape as finp (out)
+    """
+    finp = np.asarray(finp, dtype=np.float64)
+    npts = len(e)
+    factor = -FOPI * (e[-1] - e[0]) / (npts-1)
+    diff_sum, plus_sum = _kkmcl_sums(e, finp)
+    fout = 0.5 * factor * (diff_sum + plus_sum)
+    return fout.reshape(finp.shape)
+
+def diffkk_batch(energy, fpp, how='fft'):
+    """
+    reverse (f''->f') kk transform for many spectra on a shared energy grid
+
+    arguments:
+      energy  energy array [npts]
+      fpp     f'' arrays [nspectra, npts]
+      how     'fft' (default) or 'vector'
+
+    returns:
+      f' arrays [nspectra, npts]
+
+    notes:
+      spectra are interpolated to an even grid with an even number of points
+      (about 1 eV), as for diffKKGroup.kk(), and the results interpolated
+      back to the input energy grid.
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    fpp = np.atleast_2d(fpp)
+    npts = int(energy[-1] - energy[0]) + (int(energy[-1] - energy[0])%2)
+    grid = np.linspace(energy[0], energy[-1], npts)
+    gfpp = np.array([interp(energy, f, grid, fill_value=0.0) for f in fpp])
+    if how.lower().startswith('fft'):
+        gfp = kkmclr_fft(grid, gfpp)
+    else:
+        gfp = np.array([kkmclr(grid, f) for f in gfpp])
+    return np.array([interp(grid, f, energy, fill_value=0.0) for f in gfp])
+
+
 class diffKKGroup(Group):
     """
     A Larch Group for generating f'(E) and f"(E) from a XAS measurement of mu(E).
@@ -218,7 +328,7 @@ class diffKKGroup(Group):
 
 
 # e0=None, z=None, edge=None, order=3, form='mback', whiteline=False, how=None
-    def kk(self, energy=None, mu=None, z=None, edge='K', how='scalar', mback_kws=None):
+    def kk(self, energy=None, mu=None, z=None, edge='K', how='vector', mback_kws=None):
         """
         Convert mu(E) data into f'(E) and f"(E).  f"(E) is made by
         matching mu(E) to the tabulated values of the imaginary part
@@ -232,6 +342,7 @@ class diffKKGroup(Group):
             z:          Z number of absorber
             edge:       absorption edge, usually 'K' or 'L3'
             mback_kws:  arguments for the mback algorithm
+            how:        KK algorithm, one of 'vector' (default), 'fft', or 'scalar'
 
           Returns
             self.f1, self.f2:  CL values over on the input energy grid
@@ -263,7 +374,7 @@ class diffKKGroup(Group):
         if self.mback_kws is not None:
             mb_kws.update(self.mback_kws)
 
-        start = time.clock()
+        start = time.time()
 
         mback(self.energy, self.mu, group=self, **mb_kws)
 
@@ -273,8 +384,11 @@ class diffKKGroup(Group):
         fpp = interp(self.energy, self.f2-self.fpp, self.grid, fill_value=0.0)
 
         ## do difference KK
-        if repr(how).startswith('sca'):
+        how = str(how).lower()
+        if how.startswith('sca'):
             fp = kkmclr_sca(self.grid, fpp)
+        elif how.startswith('fft'):
+            fp = kkmclr_fft(self.grid, fpp)
         else:
             fp = kkmclr(self.grid, fpp)
 
@@ -284,7 +398,7 @@ class diffKKGroup(Group):
         ## clean up group
         #for att in ('normalization_function', 'weight', 'grid'):
         #    if hasattr(self, att): delattr(self, att)
-        finish = time.clock()
+        finish = time.time()
         self.time_elapsed = float(finish-start)
 
 def diffkk(energy=None, mu=None, z=None, edge='K', mback_kws=None, **kws):
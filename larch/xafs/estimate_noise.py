@@ -2,13 +2,17 @@
 """
   Estimate Noise in an EXAFS spectrum
 """
+import numpy as np
 from numpy import pi, sqrt, where
 
 from larch import parse_group_args, Group, isgroup
 
 from larch.math import index_of, realimag
 from .xafsutils import set_xafsGroup
-from .xafsft import xftf, xftr
+from .xafsft import xftf, xftr, ftwindow, sqrtpi
+
+# max number of values (spectra*nfft) to transform at one time
+STACK_CHUNKSIZE = 2**22
 
 def estimate_noise(k, chi=None, group=None, rmin=15.0, rmax=30.0,
                    kweight=1, kmin=0, kmax=20, dk=4, dk2=None, kstep=0.05,
@@ -67,7 +71,7 @@ def estimate_noise(k, chi=None, group=None, rmin=15.0, rmax=30.0,
     rmax_out = min(10*pi, rmax+2)
 
     xftf(k, chi, kmin=kmin, kmax=kmax, rmax_out=rmax_out,
-         kweight=kweight, dk=dk, dk2=dk2, kwindow=kwindow,
+         kweight=kweight, dk=dk, dk2=dk2, window=kwindow,
          nfft=nfft, kstep=kstep, group=tmpgroup, _larch=_larch)
 
     chir  = tmpgroup.chir
@@ -104,3 +108,113 @@ def estimate_noise(k, chi=None, group=None, rmin=15.0, rmax=30.0,
     group.epsilon_k = eps_k
     group.epsilon_r = eps_r
     group.kmax_suggest = kmax_suggest
+
+def _interp_rows(xnew, x, y):
+    "np.interp() for each row of a 2-d array y, sharing x and xnew"
+    i = np.clip(np.searchsorted(x, xnew, side='right') - 1, 0, len(x)-2)
+    frac = np.clip((xnew - x[i])/(x[i+1] - x[i]), 0, 1)
+    return y[:, i]*(1-frac) + y[:, i+1]*frac
+
+def estimate_noise_stack(k, chi, rmin=15.0, rmax=30.0, kweight=1, kmin=0,
+                         kmax=20, dk=4, dk2=None, kstep=0.05,
+                         kwindow='kaiser', nfft=2048):
+    """
+    estimate noise levels and highest k above the noise level for many
+    EXAFS spectra, as with estimate_noise() for each spectrum, but with
+    the Fourier transforms for all spectra done together.
+
+    Parameters:
+    -----------
+      k:        1-d array of photo-electron wavenumber in Ang^-1, or list
+                of 1-d arrays, one for each spectrum
+      chi:      2-d array of chi, shape (nspectra, len(k)), or list of
+                1-d arrays, one for each spectrum, which can have
+                different lengths.
+      other parameters are as for estimate_noise().
+
+    Returns:
+    ---------
+      group with arrays (one value per spectrum):
+        epsilon_k     estimated noise in chi(k)
+        epsilon_r     estimated noise in chi(R)
+        kmax_suggest  highest estimated k value where |chi(k)| > epsilon_k
+
+    Notes:
+    -------
+     1. spectra of different lengths are put on a common uniform k grid,
+        with zeros past the end of each spectrum, so that one window and
+        one transform length is used for all spectra.
+     2. if chi(q) is never below epsilon_k, kmax_suggest is the highest
+        q value of the reverse transform.
+    """
+    if dk2 is None:
+        dk2 = dk
+    if isinstance(chi, (list, tuple)):
+        if isinstance(k, np.ndarray) and k.ndim == 1:
+            k = [k[:len(c)] for c in chi]
+        if len(k) != len(chi):
+            raise ValueError("estimate_noise_stack: need one k array for each chi")
+        kmaxs = np.array([max(kx) for kx in k])
+    else:
+        k = np.asarray(k, dtype=np.float64)
+        chi = np.atleast_2d(chi)
+        if chi.shape[1] != len(k):
+            raise ValueError("estimate_noise_stack: chi must have shape (nspectra, len(k))")
+        kmaxs = max(k)*np.ones(len(chi))
+    nspec = len(chi)
+    nchis = np.array([len(c) for c in chi])
+
+    # common uniform k grid and window, as in xftf_prep()
+    npts = (1.01 + kmaxs/kstep).astype(int)
+    k_ = kstep*np.arange(int(1.01 + max(kmaxs.max(), kmax+dk2)/kstep))
+    win = ftwindow(k_, xmin=kmin, xmax=kmax, dx=dk, dx2=dk2, window=kwindow)
+    win = win[:npts.max()]
+    k_ = k_[:npts.max()]
+    kwin = win*k_**kweight
+    inside = np.arange(len(k_))[np.newaxis, :] < npts[:, np.newaxis]
+
+    # average window value, over the first len(chi) points, as estimate_noise()
+    kwin_ave = np.cumsum(win)[np.minimum(npts, nchis)-1]*kstep/(kmax-kmin)
+
+    # high R region
+    rstep = pi/(kstep*nfft)
+    irmax_out = int(min(nfft/2, 1.01 + min(10*pi, rmax+2)/rstep))
+    irmin = int(0.01 + rmin/rstep)
+    irmax = int(min(irmax_out, 1.01 + rmax/rstep))
+
+    # reverse transform window and q grid, as in xftr()
+    r_ = rstep*np.arange(nfft)
+    rwin = ftwindow(r_, xmin=0.5, xmax=9.5, dx=1.0, window='parzen')[:irmax_out]
+    qstep = pi/(rstep*nfft)
+    q = np.linspace(0, 30.0, int(1.05 + 30.0/qstep))
+    iq0 = index_of(q, (kmax+kmin)/2.0)
+    qweight = q[iq0:]**kweight
+
+    w = 2 * kweight + 1
+    scale = sqrt((2*pi*w)/(kstep*(kmax**w - kmin**w)))
+
+    eps_r = np.zeros(nspec)
+    kmax_suggest = np.zeros(nspec)
+    nchunk = max(1, STACK_CHUNKSIZE // nfft)
+    for i0 in range(0, nspec, nchunk):
+        i1 = min(nspec, i0+nchunk)
+        if isinstance(chi, np.ndarray):
+            chi_ = _interp_rows(k_, k, chi[i0:i1])
+        else:
+            chi_ = np.array([np.interp(k_, kx, cx) for kx, cx
+                             in zip(k[i0:i1], chi[i0:i1])])
+        chi_ *= kwin*inside[i0:i1]
+        chir = (kstep/sqrtpi)*np.fft.rfft(chi_, nfft, axis=1)[:, :irmax_out]
+
+        highr = chir[:, irmin:irmax]
+        eps_r[i0:i1] = sqrt((highr.real**2 + highr.imag**2).sum(axis=1) /
+                            (2*highr.shape[1])) / kwin_ave[i0:i1]
+
+        chiq = (2*sqrtpi/qstep)*np.fft.ifft(chir*rwin, nfft, axis=1)
+        tst = np.abs(chiq[:, iq0:len(q)]) / qweight
+        below = tst < (scale*eps_r[i0:i1])[:, np.newaxis]
+        iq = np.where(below.any(axis=1), below.argmax(axis=1), len(q)-1-iq0)
+        kmax_suggest[i0:i1] = q[iq0 + iq]
+
+    return Group(epsilon_k=scale*eps_r, epsilon_r=eps_r,
+                 kmax_suggest=kmax_suggest)
@@ -6,11 +6,19 @@ from shutil import copy, move
 import subprocess
 import time
 import re
+import shutil
+import hashlib
+import tempfile
 from optparse import OptionParser
 from subprocess import Popen, PIPE
+from multiprocessing.pool import ThreadPool
 
 from larch import Group, isNamedClass
 from larch.utils import isotime, bytes2str, uname, bindir
+from larch.site_config import usr_larchdir
+
+# default folder for cached results of FeffJobQueue
+FEFF_CACHEDIR = join(usr_larchdir, 'feffcache')
 
 def find_exe(exename):
     if uname == 'win' and not exename.endswith('.exe'):
@@ -19,6 +27,15 @@ def find_exe(exename):
     if os.path.exists(exefile) and os.access(exefile, os.X_OK):
         return exefile
 
+def feff_write(msg, _larch=None):
+    "write a message from a running Feff to the larch writer or stdout"
+    msg = bytes2str(msg)
+    msg = " : {:s}\n".format(msg.strip().rstrip())
+    if _larch is not None:
+        _larch.writer.write(msg)
+    else:
+        sys.stdout.write(msg)
+
 class FeffRunner(Group):
     """
     A Larch plugin for managing calls to the feff85exafs stand-alone executables.
@@ -163,12 +180,7 @@ class FeffRunner(Group):
         header = "\n======== running Feff module %s ========\n" % exe
 
         def write(msg):
-            msg = bytes2str(msg)
-            msg = " : {:s}\n".format(msg.strip().rstrip())
-            if self._larch is not None:
-                self._larch.writer.write(msg)
-            else:
-                sys.stdout.write(msg)
+            feff_write(msg, _larch=self._larch)
 
         if self.verbose:
             write(header)
@@ -221,6 +233,225 @@ def feffrunner(folder=None, feffinp=None, verbose=True, _larch=None, **kws):
     return FeffRunner(folder=folder, feffinp=feffinp, verbose=verbose,
                       _larch=_larch, **kws)
 
+def normalize_feffinp(text):
+    """normalize text of a feff.inp file, removing comments, blank lines,
+    and extra whitespace, so that equivalent inputs have the same hash"""
+    out = []
+    for line in text.replace('\r', '\n').split('\n'):
+        words = line.split()
+        if len(words) > 0 and words[0].upper() != 'TITLE':
+            words = line.split('*', 1)[0].split()
+        if len(words) == 0:
+            continue
+        out.append(' '.join(words))
+    return '\n'.join(out) + '\n'
+
+def feffinp_hash(text, exe='feff6l'):
+    "hash of normalized feff.inp text and feff executable name"
+    key = '%s\n%s' % (exe, normalize_feffinp(text))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class FeffJobQueue(Group):
+    """
+    Run many Feff calculations, concurrently and with cached results.
+
+    Each feff.inp text is hashed (after normalize_feffinp()), and the output
+    files of a calculation are kept in a folder named by that hash in the
+    cache folder.  Jobs found in the cache are not run again.  The others
+    are run in temporary folders, with up to `nproc` Feff processes at once.
+
+        queue = FeffJobQueue(exe='feff6l', nproc=4)
+        for text in feffinp_texts:
+            queue.add(text)
+        for job in queue.run():
+            print(job.label, job.status, job.folder, job.feffdat)
+
+    Attributes:
+        cachedir -- folder for cached results [FEFF_CACHEDIR]
+        exe      -- feff executable: 'feff6l' or 'feff8l' (all modules)
+        nproc    -- maximum number of Feff processes to run at once
+        verbose  -- write Feff output messages if True
+        jobs     -- list of job Groups, with label, key, feffinp, folder,
+                    status ('queued', 'cached', 'done', or 'failed') and
+                    feffdat (list of feffNNNN.dat files)
+    """
+    def __init__(self, cachedir=None, exe='feff6l', nproc=None, verbose=True,
+                 _larch=None, **kws):
+        kwargs = dict(name='Feff job queue')
+        kwargs.update(kws)
+        Group.__init__(self, **kwargs)
+        self._larch = _larch
+        if cachedir is None:
+            cachedir = FEFF_CACHEDIR
+        if nproc is None:
+            nproc = min(4, os.cpu_count() or 1)
+        self.cachedir = abspath(cachedir)
+        self.exe = exe
+        self.nproc = max(1, int(nproc))
+        self.verbose = verbose
+        self.jobs = []
+
+    def __repr__(self):
+        return '<Feff job queue: %d jobs, %s>' % (len(self.jobs), self.cachedir)
+
+    def write(self, msg):
+        feff_write(msg, _larch=self._larch)
+
+    def add(self, feffinp, label=None):
+        """add a job, given feff.inp text or the name of a feff.inp file,
+        returning the job Group"""
+        text = feffinp
+        if '\n' not in feffinp and isfile(feffinp):
+            if label is None:
+                label = feffinp
+            with open(feffinp, 'r') as fh:
+                text = fh.read()
+        if label is None:
+            label = 'job%4.4d' % (len(self.jobs)+1)
+        key = feffinp_hash(text, exe=self.exe)
+        job = Group(label=label, key=key, feffinp=text, status='queued',
+                    folder=join(self.cachedir, key), feffdat=[])
+        self.jobs.append(job)
+        return job
+
+    def _programs(self):
+        "list of executables to run for one calculation"
+        if self.exe in (None, 'feff8l'):
+            exes = ["feff8l_%s" % mod for mod in FeffRunner.Feff8l_modules]
+        else:
+            exes = [self.exe]
+        programs = []
+        for exe in exes:
+            program = find_exe(exe)
+            if program is None and exe == 'feff6l' and self._larch is not None:
+                try:
+                    program = self._larch.symtable.get_symbol('_xafs._feff_executable')
+                except (NameError, AttributeError):
+                    program = None
+            if program is None or not os.access(program, os.X_OK):
+                raise Exception("'%s' executable cannot be found" % exe)
+            programs.append(program)
+        return programs
+
+    def _load_cached(self, job):
+        "set job.feffdat from cache folder, returning whether it is found"
+        feffdat = sorted(glob.glob(join(job.folder, 'feff[0-9][0-9][0-9][0-9].dat')))
+        if len(feffdat) > 0:
+            job.feffdat = feffdat
+        return len(feffdat) > 0
+
+    def _run_job(self, job, programs):
+        """run one job in a temporary folder, and move results to the cache.
+        A job with any program exiting with non-zero status is 'failed',
+        and nothing is cached for it."""
+        tmpdir = tempfile.mkdtemp(prefix='feffjob_')
+        try:
+            with open(join(tmpdir, 'feff.inp'), 'w') as fh:
+                fh.write(job.feffinp)
+            with open(join(tmpdir, 'feffrun.log'), 'w') as log:
+                for program in programs:
+                    header = "======== %s: running %s ========" % (job.label,
+                                                                   basename(program))
+                    log.write(header + '\n')
+                    if self.verbose:
+                        self.write(header)
+                    proc = Popen(program, cwd=tmpdir, shell=False,
+                                 stdout=PIPE, stderr=subprocess.STDOUT)
+                    for line in proc.stdout:
+                        line = bytes2str(line)
+                        log.write(line)
+                        if self.verbose:
+                            self.write("%s: %s" % (job.label, line))
+                    proc.wait()
+                    if proc.returncode != 0:
+                        if self.verbose:
+                            self.write("%s: %s exited with status %d" %
+                                       (job.label, basename(program), proc.returncode))
+                        job.status = 'failed'
+                        return job
+            if len(glob.glob(join(tmpdir, 'feff[0-9][0-9][0-9][0-9].dat'))) < 1:
+                job.status = 'failed'
+                return job
+            # copy to a staging folder in the cache, then rename,
+            # so that partial results are never seen in the cache
+            stage = tempfile.mkdtemp(prefix='.%s_' % job.key[:16],
+                                     dir=self.cachedir)
+            for fname in os.listdir(tmpdir):
+                if isfile(join(tmpdir, fname)):
+                    copy(join(tmpdir, fname), stage)
+            try:
+                os.rename(stage, job.folder)
+            except OSError:  # already cached by another process
+                shutil.rmtree(stage, ignore_errors=True)
+            job.status = 'done' if self._load_cached(job) else 'failed'
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        return job
+
+    def run(self):
+        """run all queued jobs not found in the cache, returning list of jobs"""
+        if not isdir(self.cachedir):
+            os.makedirs(self.cachedir)
+        torun = {}
+        for job in self.jobs:
+            if job.status in ('cached', 'done'):
+                continue
+            if self._load_cached(job):
+                job.status = 'cached'
+            elif job.key not in torun:
+                torun[job.key] = job
+        ncached = len([j for j in self.jobs if j.status == 'cached'])
+        if self.verbose:
+            self.write("Feff job queue: %d jobs, %d cached, %d to run" %
+                       (len(self.jobs), ncached, len(torun)))
+        if len(torun) > 0:
+            programs = self._programs()
+            nproc = min(self.nproc, len(torun))
+            if nproc == 1:
+                for job in torun.values():
+                    self._run_job(job, programs)
+            else:
+                pool = ThreadPool(nproc)
+                try:
+                    pool.map(lambda job: self._run_job(job, programs),
+                             list(torun.values()))
+                finally:
+                    pool.close()
+                    pool.join()
+        # duplicate inputs share the results of the job that was run
+        for job in self.jobs:
+            if job.status == 'queued':
+                job.status = torun[job.key].status
+                self._load_cached(job)
+        return self.jobs
+
+
+def feff_jobqueue(feffinps=None, cachedir=None, exe='feff6l', nproc=None,
+                  verbose=True, _larch=None, **kws):
+    """
+    make a FeffJobQueue for running many Feff calculations, concurrently
+    and with results cached by the hash of the feff.inp text.
+
+    Arguments:
+    ----------
+      feffinps (list or None): feff.inp texts or file names to add [None]
+      cachedir (str or None): folder for cached results [None -> FEFF_CACHEDIR]
+      exe (str): feff executable, 'feff6l' or 'feff8l' ['feff6l']
+      nproc (int or None): max number of Feff processes to run at once
+      verbose (bool): whether to print out Feff messages [True]
+
+    Returns:
+    --------
+      instance of FeffJobQueue: use its run() method to run the jobs.
+    """
+    queue = FeffJobQueue(cachedir=cachedir, exe=exe, nproc=nproc,
+                         verbose=verbose, _larch=_larch, **kws)
+    if feffinps is not None:
+        for feffinp in feffinps:
+            queue.add(feffinp)
+    return queue
+
 def feff6l(feffinp='feff.inp', folder='.', verbose=True, _larch=None, **kws):
     """
     run a Feff6l calculation for a feff.inp file in a folder
@@ -1,9 +1,40 @@
 import numpy as np
 
-from xraydb import xray_line, xray_edge, material_mu
-from larch import  parse_group_args
+from larch import  Group, parse_group_args
+from larch.xray import xray_line, xray_edge, material_mu
 from .xafsutils import set_xafsGroup
-from .pre_edge import preedge
+from .pre_edge import preedge, pre_edge_stack
+
+def _fluo_alpha(formula, elem, edge='K', anginp=45, angout=45):
+    """alpha for the FLUO correction, from mu(E) of the sample at the
+    fluorescence energy and just below and above the edge.  anginp and
+    angout can be arrays, giving an array of alpha values"""
+    ang_corr = (np.sin(np.maximum(1.e-7, np.deg2rad(anginp))) /
+                np.sin(np.maximum(1.e-7, np.deg2rad(angout))))
+
+    # find edge energies and fluorescence line energy
+    e_edge  = xray_edge(elem, edge).energy
+    e_fluor = xray_line(elem, edge).energy
+
+    # calculate mu(E) for fluorescence energy, above, below edge
+    muvals = material_mu(formula, np.array([e_fluor, e_edge-10.0,
+                                            e_edge+10.0]), density=1)
+    return (muvals[0]*ang_corr + muvals[1])/(muvals[2] - muvals[1])
+
+def _fluo_preopts(group=None, **pre_kws):
+    "pre-edge options for the FLUO correction"
+    pre_opts = {'e0': None, 'nnorm': 1, 'nvict': 0,
+                'pre1': None, 'pre2': -30,
+                'norm1': 100, 'norm2': None}
+    if hasattr(group, 'pre_edge_details'):
+        uopts = getattr(group.pre_edge_details, 'call_args', {})
+        for attr in pre_opts:
+            if attr in uopts:
+                pre_opts[attr] = uopts[attr]
+    pre_opts.update(pre_kws)
+    pre_opts['step'] = None
+    pre_opts['nvict'] = 0
+    return pre_opts
 
 def fluo_corr(energy, mu, formula, elem, group=None, edge='K', anginp=45,
               angout=45, _larch=None, **pre_kws):
@@ -37,35 +68,12 @@ def fluo_corr(energy, mu, formula, elem, group=None, edge='K', anginp=45,
     energy, mu, group = parse_group_args(energy, members=('energy', 'mu'),
                                          defaults=(mu,), group=group,
                                          fcn_name='fluo_corr')
-    # gather pre-edge options
-    pre_opts = {'e0': None, 'nnorm': 1, 'nvict': 0,
-                'pre1': None, 'pre2': -30,
-                'norm1': 100, 'norm2': None}
-    if hasattr(group, 'pre_edge_details'):
-        uopts = getattr(group.pre_edge_details, 'call_args', {})
-        for attr in pre_opts:
-            if attr in uopts:
-                pre_opts[attr] = uopts[attr]
-    pre_opts.update(pre_kws)
-    pre_opts['step'] = None
-    pre_opts['nvict'] = 0
+    pre_opts = _fluo_preopts(group=group, **pre_kws)
 
     # generate normalized mu for correction
-    preinp   = preedge(energy, mu, **pre_opts)
-
-    ang_corr = (np.sin(max(1.e-7, np.deg2rad(anginp))) /
-                np.sin(max(1.e-7, np.deg2rad(angout))))
-
-    # find edge energies and fluorescence line energy
-    e_edge  = xray_edge(elem, edge).energy
-    e_fluor = xray_line(elem, edge).energy
-
-    # calculate mu(E) for fluorescence energy, above, below edge
-
-    muvals = material_mu(formula, np.array([e_fluor, e_edge-10.0,
-                                            e_edge+10.0]), density=1)
-
-    alpha   = (muvals[0]*ang_corr + muvals[1])/(muvals[2] - muvals[1])
+    preinp  = preedge(energy, mu, **pre_opts)
+    alpha   = _fluo_alpha(formula, elem, edge=edge, anginp=anginp,
+                          angout=angout)
     mu_corr = mu*alpha/(alpha + 1 - preinp['norm'])
     preout  = preedge(energy, mu_corr, **pre_opts)
     if group is not None:
@@ -73,3 +81,46 @@ def fluo_corr(energy, mu, formula, elem, group=None, edge='K', anginp=45,
             group = set_xafsGroup(group, _larch=_larch)
         group.mu_corr = mu_corr
         group.norm_corr = preout['norm']
+
+def fluo_corr_stack(energy, mu, formula, elem, edge='K', anginp=45,
+                    angout=45, **pre_kws):
+    """correct over-absorption (self-absorption) for many fluorescence
+    XAFS spectra on the same energy grid, such as the pixels of a XANES
+    map or scans of a time series, using the FLUO alogrithm of D. Haskel.
+
+    This follows fluo_corr() for each spectrum, but with the sample
+    attenuation found once and all spectra normalized with pre_edge_stack().
+
+    Arguments
+    ---------
+      energy    1-d array of energies
+      mu        2-d array of uncorrected fluorescence mu, shape
+                (nspectra, len(energy))
+      formula   string for sample stoichiometry
+      elem      atomic symbol or Z of absorbing element
+      edge      name of edge ('K', 'L3', ...) [default 'K']
+      anginp    input angle in degrees, single value or array with
+                a value for each spectrum [default 45]
+      angout    output angle in degrees, single value or array with
+                a value for each spectrum [default 45]
+
+    Additional keywords will be passed to pre_edge_stack(), which will be
+    used to ensure consistent normalization.
+
+    Returns
+    --------
+       group with 2-d arrays `mu_corr` and `norm_corr` (normalized
+       `mu_corr`), and `alpha`, with a value for each spectrum.
+    """
+    mu = np.atleast_2d(mu)
+    nspec = mu.shape[0]
+    pre_opts = _fluo_preopts(**pre_kws)
+    pre_opts['make_flat'] = False  # only norm is used
+    preinp = pre_edge_stack(energy, mu, **pre_opts)
+
+    alpha = np.ones(nspec)*_fluo_alpha(formula, elem, edge=edge,
+                                       anginp=anginp, angout=angout)
+    alpha = alpha[:, np.newaxis]
+    mu_corr = mu*alpha/(alpha + 1 - preinp.norm)
+    preout = pre_edge_stack(energy, mu_corr, **pre_opts)
+    return Group(mu_corr=mu_corr, norm_corr=preout.norm, alpha=alpha[:, 0])
@@ -5,14 +5,14 @@
 import numpy as np
 from scipy.special import erfc
 
-from xraydb import (xray_edge, xray_line, xray_lines,
-                    f1_chantler, f2_chantler, guess_edge,
+from xraydb import (f1_chantler, f2_chantler, guess_edge,
                     atomic_number, atomic_symbol)
 from lmfit import Parameter, Parameters, minimize
 
 from larch import Group, isgroup, parse_group_args
 
 from larch.math import index_of, index_nearest, remove_dups, remove_nans2
+from larch.xray import xray_edge, xray_line, xray_lines
 
 from .xafsutils import set_xafsGroup
 from .pre_edge import find_e0, preedge
@@ -7,6 +7,7 @@ import numpy as np
 from scipy import polyfit
 from scipy.signal import find_peaks_cwt
 from scipy.integrate import simps
+from scipy.special import comb
 
 from lmfit import Parameters, Minimizer
 from lmfit.models import (LorentzianModel, GaussianModel,
@@ -31,6 +32,9 @@ from .xafsutils import set_xafsGroup
 MODNAME = '_xafs'
 MAX_NNORM = 5
 
+# number of array elements (spectra x energy points) per chunk for pre_edge_stack
+STACK_CHUNKSIZE = 2**22
+
 def find_e0(energy, mu=None, group=None, _larch=None):
     """calculate E0 given mu(energy)
 
@@ -356,6 +360,251 @@ def pre_edge(energy, mu=None, group=None, e0=None, step=None, nnorm=None,
     return
 
 
+def _index_of_stack(array, values):
+    "index_of() for an array of values, for monotonically increasing array"
+    return np.maximum(0, np.searchsorted(array, values, side='right') - 1)
+
+def _index_nearest_stack(array, values):
+    "index_nearest() for an array of values, for monotonically increasing array"
+    i = np.clip(np.searchsorted(array, values, side='left'), 1, len(array)-1)
+    use_lower = np.abs(values - array[i-1]) <= np.abs(array[i] - values)
+    return np.where(use_lower, i-1, i)
+
+def _finde0_stack(energy, mu):
+    "_finde0() for each row of a 2D array mu"
+    npts = len(energy)
+    dmu = np.gradient(mu, axis=1)/np.gradient(energy)
+    dmu[np.where(~np.isfinite(dmu))] = -1.0
+    nmin = max(3, int(npts*0.05))
+    maxdmu = dmu[:, nmin:-nmin].max(axis=1)
+
+    high = dmu > (maxdmu*0.1)[:, np.newaxis]
+    ok = np.zeros(dmu.shape, dtype=bool)
+    ok[:, 1:-1] = high[:, 1:-1] & high[:, :-2] & high[:, 2:]
+    ok[:, :nmin] = False
+    ok[:, npts-nmin+1:] = False
+    dmu[~ok] = -np.inf
+    idmu_max = dmu.argmax(axis=1)
+    idmu_max[np.where(dmu.max(axis=1) <= 0)] = 0
+    return energy[idmu_max]
+
+def _polyfit_stack(vander, y, mask, ncoefs):
+    """least-squares fit of each row of y to the first ncoefs columns of
+    vander, using only points where mask is True.  Returns coefficients,
+    with zeros for unused columns"""
+    nrows, nc = len(y), vander.shape[1]
+    active = (np.arange(nc)[np.newaxis, :] < ncoefs[:, np.newaxis])
+    mask = mask*1.0
+    vv = (vander[:, :, np.newaxis] * vander[:, np.newaxis, :]).reshape(-1, nc*nc)
+    gram = np.dot(mask, vv).reshape(nrows, nc, nc)
+    gram *= active[:, :, np.newaxis] * active[:, np.newaxis, :]
+    gram[:, np.arange(nc), np.arange(nc)] += ~active
+    rhs = np.dot(mask*y, vander) * active
+    try:
+        return np.linalg.solve(gram, rhs[:, :, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        coefs = np.zeros((nrows, nc))
+        for i in range(nrows):
+            use = np.where(mask[i] > 0)[0]
+            nci = int(ncoefs[i])
+            coefs[i, :nci] = np.linalg.lstsq(vander[use, :nci], y[i, use],
+                                             rcond=None)[0]
+        return coefs
+
+def _unscale_coefs(coefs, center, scale):
+    """convert polynomial coefficients (increasing powers) for
+    x = (energy-center)/scale to coefficients for energy"""
+    nc = coefs.shape[1]
+    trans = np.zeros((nc, nc))
+    for k in range(nc):
+        for m in range(k+1):
+            trans[k, m] = comb(k, m) * (-center)**(k-m) / scale**k
+    return np.dot(coefs, trans)
+
+def pre_edge_stack(energy, mu, e0=None, step=None, nnorm=None, nvict=0,
+                   pre1=None, pre2=None, norm1=None, norm2=None,
+                   make_flat=True):
+    """pre edge subtraction, normalization for many XAFS spectra
+    on the same energy grid.
+
+    This follows pre_edge() for each spectrum, but with E0 found and the
+    pre-edge and post-edge polynomials fit for all spectra at once.
+
+    Arguments
+    ----------
+    energy:  1-d array of x-ray energies, in eV
+    mu:      2-d array of mu(E), shape (nspectra, len(energy))
+    e0:      edge energy, in eV, either a single value or array of values.
+             If None, it will be determined for each spectrum.
+    step:    edge jump, either a single value or array of values.
+             If None, it will be determined for each spectrum.
+    pre1:    low E range (relative to E0) for pre-edge fit
+    pre2:    high E range (relative to E0) for pre-edge fit
+    nvict:   energy exponent to use for pre-edg fit.
+    norm1:   low E range (relative to E0) for post-edge fit
+    norm2:   high E range (relative to E0) for post-edge fit
+    nnorm:   degree of polynomial for post-edge normalization curve.
+    make_flat: boolean (Default True) to calculate flattened output.
+
+    Returns
+    -------
+      group with arrays (one value or row per spectrum):
+        e0          energy origin
+        edge_step   edge step
+        norm        normalized mu(E)
+        flat        flattened, normalized mu(E) (if make_flat is True)
+        pre_slope, pre_offset   pre-edge line coefficients
+        norm_coefs  post-edge polynomial coefficients, in increasing powers
+        pre1, pre2, norm1, norm2, nnorm   fit ranges and polynomial degree
+
+    Notes
+    -----
+     see pre_edge() for details of the default values for pre1, pre2,
+     norm1, norm2, and nnorm, which are found separately for each spectrum.
+    """
+    energy = remove_dups(np.asarray(energy, dtype=np.float64).squeeze())
+    mu = np.atleast_2d(mu)
+    nspec, npts = mu.shape
+    if npts != len(energy):
+        raise ValueError("pre_edge_stack: mu must have shape (nspectra, len(energy))")
+
+    args = dict(pre1=pre1, pre2=pre2, norm1=norm1, norm2=norm2, nnorm=nnorm)
+    out = {'e0': np.zeros(nspec), 'edge_step': np.zeros(nspec),
+           'norm': np.zeros(mu.shape),
+           'pre_slope': np.zeros(nspec), 'pre_offset': np.zeros(nspec),
+           'norm_coefs': np.zeros((nspec, MAX_NNORM+1))}
+    for attr in args:
+        out[attr] = np.zeros(nspec)
+    out['nnorm'] = out['nnorm'].astype(int)
+    if make_flat:
+        out['flat'] = np.zeros(mu.shape)
+
+    def as_rows(val, dtype=np.float64):
+        if val is None:
+            return None
+        return np.ones(nspec, dtype=dtype)*val
+
+    e0s, steps = as_rows(e0), as_rows(step)
+    args = {k: as_rows(v) for k, v in args.items()}
+
+    center = (energy.max() + energy.min())/2.0
+    scale  = max(1.e-12, (energy.max() - energy.min())/2.0)
+    vander = ((energy-center)/scale)[:, np.newaxis]**np.arange(MAX_NNORM+1)
+    evict = energy**nvict
+    index = np.arange(npts)[np.newaxis, :]
+
+    nchunk = max(1, STACK_CHUNKSIZE // npts)
+    for i0 in range(0, nspec, nchunk):
+        i1 = min(nspec, i0+nchunk)
+        rows = slice(i0, i1)
+        xmu = mu[rows]
+        nrows = i1 - i0
+        finite = np.isfinite(xmu)
+
+        # e0
+        if e0s is None:
+            xe0 = _finde0_stack(energy, xmu)
+        else:
+            xe0 = e0s[rows]
+            bad = (xe0 < energy[1]) | (xe0 > energy[-2]) | ~np.isfinite(xe0)
+            if bad.any():
+                xe0 = np.where(bad, _finde0_stack(energy, xmu), xe0)
+        ie0 = _index_nearest_stack(energy, xe0)
+        xe0 = energy[ie0]
+
+        # fit ranges
+        xpre1 = args['pre1']
+        if xpre1 is None:
+            xpre1 = np.where(ie0 > 20, 5.0*np.round((energy[1] - xe0)/5.0),
+                             2.0*np.round((energy[1] - xe0)/2.0))
+        else:
+            xpre1 = xpre1[rows]
+        xpre1 = np.maximum(xpre1, energy.min() - xe0)
+        xpre2 = args['pre2']
+        if xpre2 is None:
+            xpre2 = 5.0*np.round(xpre1/15.0)
+        else:
+            xpre2 = xpre2[rows]
+        xpre1, xpre2 = np.minimum(xpre1, xpre2), np.maximum(xpre1, xpre2)
+
+        xnorm2 = args['norm2']
+        if xnorm2 is None:
+            xnorm2 = 5.0*np.round((energy.max() - xe0)/5.0)
+        else:
+            xnorm2 = xnorm2[rows]
+        xnorm2 = np.where(xnorm2 < 0, energy.max() - xe0 - xnorm2, xnorm2)
+        xnorm2 = np.minimum(xnorm2, energy.max() - xe0)
+        xnorm1 = args['norm1']
+        if xnorm1 is None:
+            xnorm1 = 5.0*np.round(xnorm2/15.0)
+        else:
+            xnorm1 = xnorm1[rows]
+        xnorm1, xnorm2 = np.minimum(xnorm1, xnorm2), np.maximum(xnorm1, xnorm2)
+
+        xnnorm = args['nnorm']
+        if xnnorm is None:
+            xnnorm = np.where(xnorm2-xnorm1 < 350, 1, 2)
+            xnnorm = np.where(xnorm2-xnorm1 < 50, 0, xnnorm)
+        else:
+            xnnorm = xnnorm[rows]
+        xnnorm = np.clip(xnnorm, 0, MAX_NNORM).astype(int)
+
+        # pre-edge line
+        p1 = _index_of_stack(energy, xpre1+xe0)
+        p2 = _index_nearest_stack(energy, xpre2+xe0)
+        p2 = np.where(p2-p1 < 2, np.minimum(npts, p1+2), p2)
+        omu = xmu*evict
+        mask = (index >= p1[:, np.newaxis]) & (index < p2[:, np.newaxis])
+        mask &= finite
+        precoefs = _polyfit_stack(vander[:, :2], np.where(mask, omu, 0), mask,
+                                  2*np.ones(nrows, dtype=int))
+        pre_edge = np.dot(precoefs, vander[:, :2].T) / evict
+
+        # post-edge polynomial
+        p1 = _index_of_stack(energy, xnorm1+xe0)
+        p2 = _index_nearest_stack(energy, xnorm2+xe0)
+        p2 = np.where(p2-p1 < 2, np.minimum(npts, p1+2), p2)
+        mask = (index >= p1[:, np.newaxis]) & (index < p2[:, np.newaxis])
+        presub = xmu - pre_edge
+        coefs = _polyfit_stack(vander, np.where(mask, presub, 0), mask,
+                               xnnorm+1)
+        post_poly = np.dot(coefs, vander.T)
+
+        if steps is None:
+            xstep = post_poly[np.arange(nrows), ie0]
+        else:
+            xstep = steps[rows]
+        xstep = np.abs(xstep)
+        norm = presub / xstep[:, np.newaxis]
+
+        if make_flat:
+            flat = 1.0*norm
+            doflat = (p2-p1 > 4)
+            if doflat.any():
+                fmask = mask & np.isfinite(norm) & doflat[:, np.newaxis]
+                fcoefs = _polyfit_stack(vander[:, :3], np.where(fmask, norm, 0),
+                                        fmask, np.minimum(xnnorm+1, 3))
+                fdiff = np.dot(fcoefs, vander[:, :3].T)
+                fdiff -= fdiff[np.arange(nrows), ie0][:, np.newaxis]
+                fdiff[np.where(index < ie0[:, np.newaxis])] = 0
+                fdiff[np.where(~doflat)] = 0
+                flat = norm - fdiff
+            out['flat'][rows] = flat
+
+        precoefs = _unscale_coefs(precoefs, center, scale)
+        out['e0'][rows] = xe0
+        out['edge_step'][rows] = xstep
+        out['norm'][rows] = norm
+        out['pre_slope'][rows] = precoefs[:, 1]
+        out['pre_offset'][rows] = precoefs[:, 0]
+        out['norm_coefs'][rows] = _unscale_coefs(coefs, center, scale)
+        out['pre1'][rows], out['pre2'][rows] = xpre1, xpre2
+        out['norm1'][rows], out['norm2'][rows] = xnorm1, xnorm2
+        out['nnorm'][rows] = xnnorm
+
+    return Group(**out)
+
+
 @Make_CallArgs(["energy", "norm"])
 def prepeaks_setup(energy, norm=None, group=None, emin=None, emax=None,
                    elo=None, ehi=None, _larch=None):
@@ -1,7 +1,7 @@
 import numpy as np
 
 from larch import Group, Make_CallArgs, parse_group_args
-from larch.math import index_of, interp1d, remove_dups
+from larch.math import index_of, remove_dups
 from .xafsutils import ktoe, etok
 
 @Make_CallArgs(["energy", "mu"])
@@ -114,6 +114,57 @@ def rebin_xafs(energy, mu=None, group=None, e0=None, pre1=None, pre2=-30,
     if exafs2 is None:
         exafs2 = max(energy) - e0
 
+    en = _rebin_energy_grid(energy, e0, pre1, pre2, pre_step, xanes_step,
+                            exafs1, exafs2, exafs_kstep)
+    mu_out, err_out = _rebin_segments(energy, mu, en, method=method)
+
+    newname = group.__name__ + '_rebinned'
+    group.rebinned = Group(energy=en, mu=mu_out, delta_mu=err_out, e0=e0,
+                           __name__=newname)
+    return
+
+
+def rebin_xafs_stack(energy, mu, e0, pre1=None, pre2=-30, pre_step=2,
+                     xanes_step=None, exafs1=15, exafs2=None, exafs_kstep=0.05,
+                     method='centroid'):
+    """rebin a stack of XAFS spectra sharing one energy array to a
+    'standard 3 region XAFS scan', as rebin_xafs()
+
+    Arguments
+    ---------
+    energy       input energy array, shape (npts,)
+    mu           input mu array, shape (nspectra, npts)
+    e0           energy reference -- all energy values are relative to this
+
+    other arguments are as for rebin_xafs()
+
+    Returns
+    -------
+      group with attributes
+        energy    new energy array, shape (nbins,)
+        mu        rebinned mu, shape (nspectra, nbins)
+        delta_mu  standard deviation of mu in each bin, shape (nspectra, nbins)
+        e0        e0
+    """
+    energy = np.asarray(energy, dtype=np.float64)
+    mu = np.asarray(mu, dtype=np.float64)
+    if mu.ndim == 1:
+        mu = mu.reshape(1, -1)
+    if mu.shape[-1] != len(energy):
+        raise ValueError("rebin_xafs_stack: mu must have shape (nspectra, len(energy))")
+    if pre1 is None:
+        pre1 = pre_step*int((min(energy) - e0)/pre_step)
+    if exafs2 is None:
+        exafs2 = max(energy) - e0
+    en = _rebin_energy_grid(energy, e0, pre1, pre2, pre_step, xanes_step,
+                            exafs1, exafs2, exafs_kstep)
+    mu_out, err_out = _rebin_segments(energy, mu, en, method=method)
+    return Group(energy=en, mu=mu_out, delta_mu=err_out, e0=e0)
+
+
+def _rebin_energy_grid(energy, e0, pre1, pre2, pre_step, xanes_step,
+                       exafs1, exafs2, exafs_kstep):
+    """new energy array from the 3 segments (pre, xanes, exafs)"""
     # determine xanes step size:
     #  find mean of energy difference, ignoring first/last 1% of energies
     npts = len(energy)
@@ -125,7 +176,6 @@ def rebin_xafs(energy, mu=None, group=None, e0=None, pre1=None, pre2=-30,
     else:
         xanes_step = max(xanes_step, xanes_step_def)
 
-    # create new energy array from the 3 segments (pre, xanes, exafs)
     en = []
     for start, stop, step, isk in ((pre1, pre2, pre_step, False),
                                    (pre2, exafs1, xanes_step, False),
@@ -137,35 +187,68 @@ def rebin_xafs(energy, mu=None, group=None, e0=None, pre1=None, pre2=-30,
         if isk:
             reg = ktoe(reg)
         en.extend(e0 + reg)
+    return np.array(en)
 
-    # find the segment boundaries of the old energy array
-    bounds = [index_of(energy, e) for e in en]
-    mu_out = []
-    err_out = []
-    j0 = 0
-    for i in range(len(en)):
-        if i == len(en) - 1:
-            j1 = len(energy) - 1
-        else:
-            j1 = int((bounds[i] + bounds[i+1] + 1)/2.0)
-        # if not enough points in segment, do interpolation
-        if (j1 - j0) < 3:
-            jx = j1 + 1
-            if (jx - j0) < 2:
-                jx += 1
-            val = interp1d(energy[j0:jx], mu[j0:jx], en[i])
-            err = mu[j0:j1].std()
-        else:
-            if method.startswith('box'):
-                val =  mu[j0:j1].mean()
-            else:
-                val = (mu[j0:j1]*energy[j0:j1]).mean()/energy[j0:j1].mean()
-        mu_out.append(val)
-        err_out.append(mu[j0:j1].std())
-        j0 = j1
 
-    newname = group.__name__ + '_rebinned'
-    group.rebinned = Group(energy=np.array(en), mu=np.array(mu_out),
-                           delta_mu=np.array(err_out), e0=e0,
-                           __name__=newname)
-    return
+def _rebin_segments(energy, mu, en, method='centroid'):
+    """rebin mu (1D or 2D, with energy along the last axis) onto energies en
+
+    Each input energy is assigned to one segment, with boundaries halfway
+    between the indices of the input energies at or below the new
+    energies. Sums over segments use np.add.reduceat.  Segments with fewer
+    than 3 points use linear interpolation of the neighboring points.
+
+    Returns
+    -------
+      mu_out, err_out with shape mu.shape[:-1] + (len(en),)
+    """
+    energy = np.asarray(energy)
+    mu = np.asarray(mu)
+    npts, nbins = len(energy), len(en)
+
+    # indices at or below the new energies, and segment boundaries
+    if np.all(np.diff(energy) >= 0):
+        bounds = np.searchsorted(energy, en, side='right') - 1
+        bounds[bounds < 0] = 0
+    else:
+        bounds = np.array([index_of(energy, e) for e in en])
+    j1 = np.empty(nbins, dtype=int)
+    j1[:-1] = (bounds[:-1] + bounds[1:] + 1)//2
+    j1[-1] = npts - 1
+    j0 = np.zeros(nbins, dtype=int)
+    j0[1:] = j1[:-1]
+    nseg = j1 - j0
+
+    # sums over segments: a final index at npts-1 closes the last segment,
+    # and empty segments give wrong sums, but always use interpolation
+    starts = np.append(j0, npts-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mu_sum = np.add.reduceat(mu, starts, axis=-1)[..., :-1]
+        mean = mu_sum/nseg
+        if method.startswith('box'):
+            mu_out = mean
+        else:
+            mue_sum = np.add.reduceat(mu*energy, starts, axis=-1)[..., :-1]
+            e_sum = np.add.reduceat(energy, starts)[:-1]
+            mu_out = mue_sum/e_sum
+        dev = mu[..., :npts-1] - np.repeat(mean, nseg, axis=-1)
+        var = np.add.reduceat(dev*dev, np.minimum(j0, npts-2), axis=-1)/nseg
+    err_out = np.sqrt(var)
+    err_out[..., nseg == 0] = np.nan
+
+    # linear interpolation for sparse segments, as scipy interp1d
+    # over the segment, extended to at least 2 points
+    sparse = np.where(nseg < 3)[0]
+    if len(sparse) > 0:
+        s0 = j0[sparse]
+        s1 = j1[sparse] + 1
+        s1[(s1 - s0) < 2] += 1
+        s1 = np.minimum(s1, npts)
+        esp = en[sparse]
+        hi = np.clip(np.searchsorted(energy, esp), s0+1, s1-1)
+        lo = hi - 1
+        slope = (mu[..., hi] - mu[..., lo])/(energy[hi] - energy[lo])
+        val = slope*(esp - energy[lo]) + mu[..., lo]
+        val[..., (esp < energy[s0]) | (esp > energy[s1-1])] = np.nan
+        mu_out[..., sparse] = val
+    return mu_out, err_out
@@ -14,27 +14,33 @@ chemparse       parse a Chemical formula to compositiondictionary.
 atomic_mass     return atomic mass for an element
 f0              Thomson X-ray scattering factor
 f1f2_cl         Anomalous scattering factors from Cromer-Libermann
+f1f2_cl_batch   f1f2_cl for a list of elements and array of energies
 mu_elam         X-ray attenuation coefficients from Elam etal
+mu_elam_array   mu_elam for a list of elements and array of energies
 mu_chantler     X-ray attenuation coefficients from Chantler
 xray_edges      X-ray absorption edges for an element
 xray_lines      X-ray emission lines for an element
 """
 
-from xraydb import (XrayDB, atomic_mass, atomic_number, atomic_symbol,
-                    atomic_density, xray_line, xray_lines, xray_edge,
-                    xray_edges, ck_probability, f0, f0_ions, mu_elam,
-                    mu_chantler, f1_chantler, f2_chantler, core_width,
-                    chantler_energies, guess_edge, get_xraydb,
-                    xray_delta_beta, coherent_cross_section_elam,
-                    incoherent_cross_section_elam, fluor_yield, chemparse)
+from xraydb import (XrayDB, atomic_number, atomic_symbol, atomic_density,
+                    ck_probability, f0_ions, mu_chantler, f1_chantler,
+                    f2_chantler, core_width, chantler_energies, guess_edge,
+                    get_xraydb, xray_delta_beta, coherent_cross_section_elam,
+                    incoherent_cross_section_elam, fluor_yield)
 
 from xraydb.xray import XrayLine
-from xraydb.materials import (get_material, add_material, material_mu,
-                              material_mu_components, _read_materials_db)
+from xraydb.materials import get_material, _read_materials_db
+
+# cached versions of xraydb functions, for repeated calls
+from .xraycache import (XrayCache, get_xraycache, clear_xraycache,
+                        mu_elam, mu_elam_array, material_mu,
+                        material_mu_components, add_material, f0,
+                        atomic_mass, chemparse, xray_edges, xray_edge,
+                        xray_lines, xray_line)
 material_add = add_material
 material_get = get_material
 
-from .cromer_liberman import f1f2 as f1f2_cl
+from .cromer_liberman import f1f2 as f1f2_cl, f1f2_batch as f1f2_cl_batch
 from .background import XrayBackground
 
 _larch_builtins = {'_xray': dict(chemparse=chemparse,
@@ -45,6 +51,7 @@ _larch_builtins = {'_xray': dict(chemparse=chemparse,
                                  material_mu=material_mu,
                                  material_mu_components=material_mu_components,
                                  f1f2_cl=f1f2_cl,
+                                 f1f2_cl_batch=f1f2_cl_batch,
                                  f0=f0,
                                  f0_ions=f0_ions,
                                  chantler_energies=chantler_energies,
@@ -53,6 +60,8 @@ _larch_builtins = {'_xray': dict(chemparse=chemparse,
                                  f2_chantler=f2_chantler,
                                  mu_chantler=mu_chantler,
                                  mu_elam=mu_elam,
+                                 mu_elam_array=mu_elam_array,
+                                 clear_xraycache=clear_xraycache,
                                  coherent_xsec=coherent_cross_section_elam,
                                  incoherent_xsec=incoherent_cross_section_elam,
                                  atomic_number=atomic_number,
@@ -1,7 +1,8 @@
 import os
 import ctypes
+from functools import lru_cache
 import numpy as np
-from scipy.signal import convolve
+from scipy.fftpack import next_fast_len
 
 import larch
 from larch.larchlib import get_dll
@@ -10,6 +11,132 @@ from larch.math import as_ndarray
 from xraydb import core_width, atomic_number
 
 CLLIB = None
+CL_MAXZ = 92
+
+def _cl_f1f2(z, energies):
+    """raw f1, f2 from the Cromer-Liberman library for an array of energies"""
+    global CLLIB
+    if CLLIB is None:
+        CLLIB = get_dll('cldata')
+
+    en = np.array(energies, dtype=np.float64)
+    npts = len(en)
+    f1 = np.zeros(npts, dtype=np.float64)
+    f2 = np.zeros(npts, dtype=np.float64)
+    p_dbl = ctypes.POINTER(ctypes.c_double)
+    CLLIB.f1f2(ctypes.pointer(ctypes.c_int(int(z))),
+               ctypes.pointer(ctypes.c_int(npts)),
+               en.ctypes.data_as(p_dbl), f1.ctypes.data_as(p_dbl),
+               f2.ctypes.data_as(p_dbl))
+    return f1, f2
+
+@lru_cache(maxsize=256)
+def _cl_f1f2_grid(z, emin, emax, npts):
+    """raw f1, f2 on an extended energy grid, cached for each Z and grid"""
+    f1, f2 = _cl_f1f2(z, np.linspace(emin, emax, npts))
+    f1.flags.writeable = f2.flags.writeable = False
+    return f1, f2
+
+@lru_cache(maxsize=64)
+def _core_width(z, edge):
+    return core_width(element=z, edge=edge)
+
+def _extended_grid(energies, width):
+    """extended energy grid (emin, emax, npts) and energy step
+    for convolving with a Lorentzian of width"""
+    e_extra = int(width*80.0)
+    estep = (energies[1:] - energies[:-1]).min()
+    emin = min(energies) - e_extra
+    emax = max(energies) + e_extra
+    npts = int(1 + abs(emax-emin+estep*0.02)/abs(estep))
+    return emin, emax, npts, estep
+
+@lru_cache(maxsize=64)
+def _lorentzian_kernel(width, estep, nfft):
+    """sum and FFT (of length nfft) of Lorentzian kernel for width and estep"""
+    nk = int(int(width*80.0) / estep)
+    sig = width/2.0
+    lor = (1./(1 + ((np.arange(2*nk+1)-nk*1.0)/sig)**2))/(np.pi*sig)
+    return lor.sum(), np.fft.rfft(lor, nfft)
+
+def _convolve_lorentzian(ydat, width, estep):
+    """convolve rows of ydat with a normalized Lorentzian, using FFTs,
+    returning the central part (same length as the rows)"""
+    ydat = np.atleast_2d(ydat)
+    npts = ydat.shape[1]
+    nk = int(int(width*80.0) / estep)
+    nfft = next_fast_len(npts + 2*nk)
+    scale, kernel = _lorentzian_kernel(width, estep, nfft)
+    out = np.fft.irfft(np.fft.rfft(ydat, nfft, axis=1)*kernel, nfft, axis=1)
+    return out[:, nk:nk+npts]/scale
+
+def _as_list(value, nvals):
+    if isinstance(value, (list, tuple, np.ndarray)):
+        if len(value) != nvals:
+            raise ValueError('need one value for each Z')
+        return list(value)
+    return [value]*nvals
+
+def f1f2_batch(zvals, energies, width=None, edge=None):
+    """Return anomalous scattering factors f1, f2 from Cromer-Liberman
+    for many elements and one array of energies
+
+    Parameters
+    ----------
+    zvals:     list of atomic numbers or symbols of elements
+    energies:  array of x-ray energies (in eV)
+    width:     width used to convolve values with lorentzian profile,
+               either one value or a list with a value for each element.
+    edge:      x-ray edge ('K', 'L3', etc) used to lookup energy
+               width for convolution, either one edge or a list with
+               an edge for each element.
+
+    Returns:
+    ---------
+    f1, f2:    anomalous scattering factors, each with shape
+               (len(zvals), len(energies))
+
+    Notes:
+    ------
+    The extended energy grid, the values from Cromer-Liberman on that
+    grid for each element, and the FFT of the convolution kernel are
+    cached, so that repeated calls with the same energies and widths
+    do not recalculate these.
+    """
+    en = as_ndarray(energies)
+    nz = len(zvals)
+    widths = _as_list(width, nz)
+    edges = _as_list(edge, nz)
+    f1 = np.zeros((nz, len(en)))
+    f2 = np.zeros((nz, len(en)))
+
+    groups = {}
+    for i, (z, wid, edge) in enumerate(zip(zvals, widths, edges)):
+        if not isinstance(z, int):
+            z = atomic_number(z)
+        if z is None or z > CL_MAXZ:
+            raise ValueError('Cromer-Liberman data not available for Z=%s' % repr(zvals[i]))
+        if wid is None and edge is not None:
+            natwid = _core_width(z, edge)
+            if natwid not in (None, []):
+                wid = natwid
+        if wid is None:
+            f1[i], f2[i] = _cl_f1f2(z, en)
+        else:
+            groups.setdefault(wid, []).append((i, z))
+
+    # convolve all elements with the same width together
+    for wid, members in groups.items():
+        emin, emax, npts, estep = _extended_grid(en, wid)
+        egrid = np.linspace(emin, emax, npts)
+        raw = []
+        for i, z in members:
+            raw.extend(_cl_f1f2_grid(z, emin, emax, npts))
+        conv = _convolve_lorentzian(np.array(raw), wid, estep)
+        for j, (i, z) in enumerate(members):
+            f1[i] = np.interp(en, egrid, conv[2*j])
+            f2[i] = np.interp(en, egrid, conv[2*j+1])
+    return f1, f2
 
 def f1f2(z, energies, width=None, edge=None):
     """Return anomalous scattering factors f1, f2 from Cromer-Liberman
@@ -29,58 +156,21 @@ def f1f2(z, energies, width=None, edge=None):
     ---------
     f1, f2:    anomalous scattering factors
 
+    See Also:
+    ---------
+    f1f2_batch, for many elements at once
     """
-    global CLLIB
-    if CLLIB is None:
-        CLLIB = get_dll('cldata')
-
-    en = as_ndarray(energies)
-
     if not isinstance(z, int):
         z  = atomic_number(z)
         if z is None:
             return None
 
-    if z > 92:
+    if z > CL_MAXZ:
         print( 'Cromer-Liberman data not available for Z>92')
         return
 
-    if edge is not None or width is not None:
-        natwid = core_width(element=z, edge=edge)
-        if width is None and natwid not in (None, []):
-            width = natwid
-
-    if width is not None: # will convolve!
-        e_extra = int(width*80.0)
-        estep = (en[1:] - en[:-1]).min()
-        emin = min(en) - e_extra
-        emax = max(en) + e_extra
-
-        npts = 1 + abs(emax-emin+estep*0.02)/abs(estep)
-        en   = np.linspace(emin, emax, npts)
-        nk   = int(e_extra / estep)
-        sig  = width/2.0
-        lor  = (1./(1 + ((np.arange(2*nk+1)-nk*1.0)/sig)**2))/(np.pi*sig)
-        scale = lor.sum()
-
-    # create ctypes pointers for the C function
-    npts   = len(en)
-    p_z    = ctypes.pointer(ctypes.c_int(int(z)))
-    p_npts = ctypes.pointer(ctypes.c_int(npts))
-    p_en   = (npts*ctypes.c_double)()
-    p_f1   = (npts*ctypes.c_double)()
-    p_f2   = (npts*ctypes.c_double)()
-
-    for i in range(npts):
-        p_en[i] = en[i]
-
-    nout = CLLIB.f1f2(p_z, p_npts, p_en, p_f1, p_f2)
-    f1 = np.array([i for i in p_f1[:]])
-    f2 = np.array([i for i in p_f2[:]])
-    if width is not None: # do the convolution
-        f1 = np.interp(energies, en, convolve(f1, lor)[nk:-nk])/scale
-        f2 = np.interp(energies, en, convolve(f2, lor)[nk:-nk])/scale
-    return (f1, f2)
+    f1, f2 = f1f2_batch([z], energies, width=width, edge=edge)
+    return (f1[0], f2[0])
 
 if __name__ == '__main__':
     en = np.linspace(8000, 9200, 51)
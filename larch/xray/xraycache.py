@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+"""
+Cached access to X-ray data from xraydb
+
+The functions here give the same results as the xraydb functions of
+the same name, but hold the tables for each element in numpy arrays
+after they are first used, so that repeated calls (as from loops over
+elements, energies, or materials) do not query the database again.
+
+  mu_elam         X-ray attenuation coefficients from Elam etal
+  mu_elam_array   mu_elam for many elements and energies at once
+  material_mu     X-ray attenuation length for a material
+  f0              Thomson X-ray scattering factor
+  xray_lines      X-ray emission lines for an element
+  xray_edges      X-ray absorption edges for an element
+
+Formula parsing and material lookups are memoized with lru_cache.
+Use clear_xraycache() if the database or materials list changes.
+"""
+import json
+from functools import lru_cache
+import numpy as np
+
+from xraydb import get_xraydb, get_materials
+from xraydb import add_material as _add_material
+from xraydb import chemparse as _chemparse
+from xraydb.xray import XrayLine
+from xraydb.utils import elam_spline
+from xraydb.xraydb import ElementData
+
+ELAM_KINDS = ('photo', 'coh', 'incoh')
+
+class XrayCache(object):
+    """numpy arrays of xraydb tables, read from the database on first use
+
+    `nqueries` counts the database queries made by the cache.
+    """
+    def __init__(self, xdb=None):
+        self.xdb = get_xraydb() if xdb is None else xdb
+        self.nqueries = 0
+        self.clear()
+
+    def clear(self):
+        self.elements = None
+        self.elam = {}
+        self.waasmaier = None
+
+    def _query(self, table, **filters):
+        tab = self.xdb.tables[table]
+        query = self.xdb.query(tab)
+        for key, val in filters.items():
+            query = query.filter(getattr(tab.c, key) == val)
+        self.nqueries += 1
+        return query.all()
+
+    def element(self, element):
+        "ElementData for an element, from atomic number or symbol"
+        if self.elements is None:
+            self.elements = {}
+            for row in self._query('elements'):
+                dat = ElementData(int(row.atomic_number), row.element.title(),
+                                  row.molar_mass, row.density)
+                self.elements[dat.Z] = self.elements[dat.symbol] = dat
+        if not isinstance(element, int):
+            element = element.title()
+        if element not in self.elements:
+            raise ValueError("unknown element '%s'" % repr(element))
+        return self.elements[element]
+
+    def elam_tables(self, element):
+        """Elam tables for an element: a dict with keys of 'photo', 'coh',
+        and 'incoh', each with (log_energy, log_value, spline) arrays"""
+        sym = self.element(element).symbol
+        if sym not in self.elam:
+            row = self._query('photoabsorption', element=sym)[0]
+            lne = np.array(json.loads(row.log_energy))
+            out = {'photo': (lne, np.array(json.loads(row.log_photoabsorption)),
+                             np.array(json.loads(row.log_photoabsorption_spline)))}
+            row = self._query('scattering', element=sym)[0]
+            lne = np.array(json.loads(row.log_energy))
+            for kind, col in (('coh', 'coherent'), ('incoh', 'incoherent')):
+                out[kind] = (lne,
+                             np.array(json.loads(getattr(row, 'log_%s_scatter' % col))),
+                             np.array(json.loads(getattr(row, 'log_%s_scatter_spline' % col))))
+            self.elam[sym] = out
+        return self.elam[sym]
+
+    def f0_coefs(self, ion):
+        "(offset, scales, exponents) for f0 of an ion"
+        if self.waasmaier is None:
+            self.waasmaier = {}
+            for row in self._query('Waasmaier'):
+                coefs = (row.offset, np.array(json.loads(row.scale)),
+                         np.array(json.loads(row.exponents)))
+                self.waasmaier[row.ion] = coefs
+                if int(row.atomic_number) not in self.waasmaier:
+                    self.waasmaier[int(row.atomic_number)] = coefs
+        if not isinstance(ion, int):
+            ion = ion.title()
+        if ion not in self.waasmaier:
+            raise ValueError('No ion {:s} from Waasmaier table'.format(repr(ion)))
+        return self.waasmaier[ion]
+
+_xraycache = None
+
+def get_xraycache():
+    """return the XrayCache instance, creating it if needed"""
+    global _xraycache
+    if _xraycache is None:
+        _xraycache = XrayCache()
+    return _xraycache
+
+def clear_xraycache():
+    """clear cached X-ray tables, parsed formulas, and materials"""
+    if _xraycache is not None:
+        _xraycache.clear()
+    for func in (_xray_edges, _xray_lines, _chemparse_cached, _find_material):
+        func.cache_clear()
+
+def _elam_kinds(kind):
+    kind = kind.lower()
+    if kind.startswith('tot'):
+        return ELAM_KINDS
+    for name in ELAM_KINDS:
+        if kind.startswith(name):
+            return (name,)
+    raise ValueError('unknown cross section kind=%s' % kind)
+
+def mu_elam_array(elements, energy, kind='total'):
+    """X-ray attenuation coefficients (in cm^2/gr) from Elam etal for
+    a list of elements and an array of energies
+
+    Args:
+        elements (list):  atomic numbers or symbols for elements
+        energy (float or ndarray): energies in eV
+        kind (str): one of 'photo', 'coh', 'incoh', or 'total' ['total']
+
+    Returns:
+        2-d array of shape (len(elements), len(energy))
+
+    Notes:
+        the log-log spline interpolation is done for all elements at once.
+    """
+    cache = get_xraycache()
+    tables = [cache.elam_tables(elem) for elem in elements]
+    energy = np.atleast_1d(np.asarray(energy, dtype=float))
+    out = np.zeros((len(tables), len(energy)))
+    for kind in _elam_kinds(kind):
+        ktabs = [tab[kind] for tab in tables]
+        emin = np.array([10*int(0.102*np.exp(tab[0][0])) for tab in ktabs])
+        x = np.log(np.maximum(energy[None, :], emin[:, None]))
+        # a few tables are not sorted in energy: use xraydb's interpolation
+        sort = np.array([np.all(np.diff(tab[0]) >= 0) for tab in ktabs])
+        for i in np.where(~sort)[0]:
+            out[i] += np.exp(elam_spline(*ktabs[i], x[i]))
+        if np.any(sort):
+            out[sort] += np.exp(_elam_splines([t for t, s in zip(ktabs, sort) if s],
+                                              x[sort]))
+    return out
+
+def _elam_splines(tables, x):
+    """interpolate Elam tables (log_energy, log_value, spline) for several
+    elements at once, as for xraydb.utils.elam_spline(), with x of shape
+    (len(tables), npts).  The tables are stacked and offset in log(energy)
+    so that a single sorted search finds all intervals."""
+    npts = np.array([len(tab[0]) for tab in tables])
+    start = np.concatenate(([0], np.cumsum(npts)[:-1]))[:, None]
+    stop = start + npts[:, None] - 1
+    offset = 100.0*np.arange(len(tables))[:, None]
+    xin = np.concatenate([tab[0] for tab in tables]) + offset.repeat(npts)
+    yin = np.concatenate([tab[1] for tab in tables])
+    yspl = np.concatenate([tab[2] for tab in tables])
+
+    xmin = np.array([tab[0].min() for tab in tables])[:, None]
+    xmax = np.array([tab[0].max() for tab in tables])[:, None]
+    x = np.clip(x, xmin, xmax) + offset
+    lo = np.clip(np.searchsorted(xin, x, side='left') - 1, start, stop)
+    hi = np.clip(np.searchsorted(xin, x, side='right'), start, stop)
+    diff = xin[hi] - xin[lo]
+    a = (xin[hi] - x) / diff
+    b = (x - xin[lo]) / diff
+    return (a*yin[lo] + b*yin[hi] +
+            (diff*diff/6) * ((a*a - 1)*a*yspl[lo] + (b*b - 1)*b*yspl[hi]))
+
+def mu_elam(element, energy, kind='total'):
+    """X-ray attenuation coefficient (in cm^2/gr) for an element from
+    Elam etal, as for xraydb.mu_elam()
+
+    Args:
+        element (int, str):  atomic number or symbol for element
+        energy (float or ndarray): energies in eV
+        kind (str): one of 'photo', 'coh', 'incoh', or 'total' ['total']
+    """
+    out = mu_elam_array([element], energy, kind=kind)[0]
+    if len(out) == 1:
+        return out[0]
+    return out
+
+@lru_cache(maxsize=1024)
+def _chemparse_cached(formula):
+    return _chemparse(formula)
+
+def chemparse(formula):
+    """parse a chemical formula to a dictionary of elemental abundances,
+    as for xraydb.chemparse()"""
+    return dict(_chemparse_cached(formula))
+
+def atomic_mass(element):
+    "atomic mass for an element, from atomic number or symbol"
+    return get_xraycache().element(element).mass
+
+@lru_cache(maxsize=512)
+def _find_material(name):
+    """formula and density (or None) for a material name or formula,
+    following xraydb.material_mu()"""
+    materials = get_materials()
+    mater = materials.get(name.lower(), None)
+    if mater is None:
+        for val in materials.values():
+            if name.lower() == val[0].lower():
+                mater = val
+                break
+    if mater is None:
+        return name, None
+    return mater.formula, mater.density
+
+def add_material(name, formula, density, categories=None):
+    """add a material to the users local material database,
+    as for xraydb.add_material()"""
+    _add_material(name, formula, density, categories=categories)
+    _find_material.cache_clear()
+
+def material_mu(name, energy, density=None, kind='total'):
+    """X-ray attenuation length (in 1/cm) for a material by name or formula,
+    as for xraydb.material_mu()
+
+    Args:
+        name (str): chemical formula or name of material from materials list.
+        energy (float or ndarray):   energy or array of energies in eV
+        density (None or float):  material density (gr/cm^3).
+        kind (str): 'photo' or 'total' for whether to return the
+                    photo-absorption or total cross-section ['total']
+    """
+    formula, _density = _find_material(name)
+    if density is None:
+        density = _density
+    if density is None:
+        raise Warning('material_mu(): must give density for unknown materials')
+    comps = _chemparse_cached(formula)
+    elems = list(comps.keys())
+    mass = np.array([comps[el]*atomic_mass(el) for el in elems])
+    mu = density*np.dot(mass, mu_elam_array(elems, energy, kind=kind))/mass.sum()
+    if len(mu) == 1:
+        return mu[0]
+    return mu
+
+def material_mu_components(name, energy, density=None, kind='total'):
+    """absorption coefficient (in 1/cm) for each element of a material,
+    as for xraydb.material_mu_components()"""
+    mater = get_materials().get(name.lower(), None)
+    if mater is None:
+        formula = name
+        if density is None:
+            raise Warning('material_mu(): must give density for unknown materials')
+    else:
+        formula, density = mater.formula, mater.density
+    comps = _chemparse_cached(formula)
+    elems = list(comps.keys())
+    mus = mu_elam_array(elems, energy, kind=kind)
+    out = {'mass': 0.0, 'density': density, 'elements': []}
+    for atom, mu in zip(elems, mus):
+        mass = atomic_mass(atom)
+        out['mass'] += comps[atom]*mass
+        out[atom] = (comps[atom], mass, mu[0] if len(mu) == 1 else mu)
+        out['elements'].append(atom)
+    return out
+
+def f0(ion, q):
+    """elastic X-ray scattering factor, f0(q), for an ion,
+    as for xraydb.f0()
+
+    Args:
+       ion (int or str):  atomic number, atomic symbol or ionic symbol of scatterer
+       q  (float, ndarray):  Q value(s)  for scattering
+    """
+    offset, scale, expon = get_xraycache().f0_coefs(ion)
+    q = np.atleast_1d(np.asarray(q, dtype=float))
+    return offset + np.dot(np.exp(-np.multiply.outer(q*q, expon)), scale)
+
+@lru_cache(maxsize=1024)
+def _xray_edges(element):
+    return get_xraycache().xdb.xray_edges(element)
+
+@lru_cache(maxsize=1024)
+def _xray_lines(element, initial_level=None, excitation_energy=None):
+    return get_xraycache().xdb.xray_lines(element, initial_level=initial_level,
+                                          excitation_energy=excitation_energy)
+
+def xray_edges(element):
+    """dictionary of X-ray absorption edges for an element,
+    as for xraydb.xray_edges()"""
+    return dict(_xray_edges(element))
+
+def xray_edge(element, edge, energy_only=False):
+    """X-ray absorption edge for an element, as for xraydb.xray_edge()"""
+    out = _xray_edges(element).get(edge.title(), None)
+    if energy_only and out is not None:
+        out = out[0]
+    return out
+
+def xray_lines(element, initial_level=None, excitation_energy=None):
+    """dictionary of X-ray emission lines for an element,
+    as for xraydb.xray_lines()"""
+    return dict(_xray_lines(element, initial_level=initial_level,
+                            excitation_energy=excitation_energy))
+
+def xray_line(element, line):
+    """X-ray emission line for an element, or the weighted average
+    for a family of lines ('Ka', 'Kb', 'La', 'Lb', 'Lg'),
+    as for xraydb.xray_line()"""
+    lines = _xray_lines(element)
+    family = line.lower()
+    if family == 'k': family = 'ka'
+    if family == 'l': family = 'la'
+    if family in ('ka', 'kb', 'la', 'lb', 'lg'):
+        scale = 1.e-99
+        value = 0.0
+        linit, lfinal =  None, None
+        for key, val in lines.items():
+            if key.lower().startswith(family):
+                value += val[0]*val[1]
+                scale += val[1]
+                if linit is None:
+                    linit = val[2]
+                if lfinal is None:
+                    lfinal = val[3][0]
+        return XrayLine(value/scale, scale, linit, lfinal)
+    return lines.get(line.title(), None)
@@ -10,14 +10,16 @@ from .xrd_fitting import (peakfinder, peaklocater, peakfitter, peakfilter,
 
 from .xrd_pyFAI import (integrate_xrd, integrate_xrd_row, read_lambda,
                         calc_cake, save1D, return_ai, twth_from_xy,
-                        q_from_xy, eta_from_xy)
+                        q_from_xy, eta_from_xy, integrate_xrd_stack,
+                        get_integrator, clear_integrator_cache)
 
 from .xrd_tools import (d_from_q, d_from_twth, twth_from_d, twth_from_q,
                         E_from_lambda, lambda_from_E, q_from_d,
                         q_from_twth, qv_from_hkl, d_from_hkl,
                         unit_cell_volume, generate_hkl)
 
-from .xrd_cif import (SPACEGROUPS, create_cif, check_elemsym, SPGRP_SYMM)
+from .xrd_cif import (SPACEGROUPS, create_cif, check_elemsym, SPGRP_SYMM,
+                      calc_pattern_batch)
 
 from .cifdb import (get_cifdb, cifDB, cif_match, read_cif, SearchCIFdb,
                     match_database, CATEGORIES, QSTEP, QMIN, QMAX, QAXIS)
@@ -53,6 +55,7 @@ _larch_builtins = {'_xrd':  {'d_from_q': d_from_q,
                              'generate_hkl': generate_hkl,
                              'xrd_background': xrd_background,
                              'integrate_xrd': integrate_xrd,
+                             'integrate_xrd_stack': integrate_xrd_stack,
                              'cif_match': cif_match,
                              'get_cifdb': get_cifdb,
                              'read_cif': read_cif,
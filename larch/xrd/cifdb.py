@@ -4,8 +4,10 @@ build American Mineralogist Crystal Structure Databse (amcsd)
 '''
 
 import os
+import heapq
 import requests
 import numpy as np
+from scipy import sparse
 from itertools import groupby
 from distutils.version import StrictVersion
 
@@ -80,6 +82,7 @@ QSTEP = 0.01
 QAXIS = np.arange(QMIN, QMAX+QSTEP, QSTEP)
 
 ENERGY = 19000 ## units eV
+QINDEX_SUFFIX = '.qidx.npz'
 _cifdb = None
 
 def get_cifdb(dbname='amcsd_cif.db', _larch=None):
@@ -126,6 +129,159 @@ def iscifDB(dbname):
     return result
 
 
+def _qbin_matrix(nbins, ibins):
+    "CSR matrix (nbins, len(ibins)) with ones at the q bins listed for each column"
+    ncols = len(ibins)
+    rows = np.zeros(0, dtype=np.int64)
+    cols = np.zeros(0, dtype=np.int64)
+    if ncols > 0:
+        rows = np.concatenate(ibins).astype(np.int64)
+        cols = np.repeat(np.arange(ncols), [len(ib) for ib in ibins])
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                             shape=(nbins, ncols))
+
+class QPeakIndex(object):
+    '''
+    sparse inverted index of q-peaks: for each q-bin of the q axis,
+    the structures (amcsd_id) that have a peak in that bin.
+
+    matrix is a CSR matrix of shape (nbins, nstructures), with
+    columns ordered as in amcsd.  Structures added with add() are kept
+    as pending columns, and appended to matrix together when the index
+    is next used.
+    '''
+    def __init__(self, axis, amcsd=None, matrix=None, signature=None):
+        self.axis = np.asarray(axis, dtype=np.float64)
+        if amcsd is None:
+            amcsd = []
+        self._amcsd = np.asarray(amcsd, dtype=np.int64)
+        if matrix is None:
+            matrix = sparse.csr_matrix((len(self.axis), len(self._amcsd)),
+                                       dtype=np.int8)
+        self._matrix = sparse.csr_matrix(matrix, dtype=np.int8)
+        self._pending = {}
+        self.signature = signature
+
+    @property
+    def matrix(self):
+        self._flush()
+        return self._matrix
+
+    @property
+    def amcsd(self):
+        self._flush()
+        return self._amcsd
+
+    @classmethod
+    def from_qarrays(cls, axis, rows, signature=None):
+        '''build index from (amcsd_id, q array) pairs, where each q array
+        is 1 for bins with a peak and 0 otherwise, as in ciftbl.qstr'''
+        amcsd, ibins = [], []
+        for amcsd_id, qarr in rows:
+            amcsd.append(amcsd_id)
+            ibins.append(np.where(np.asarray(qarr) == 1)[0])
+        return cls(axis, amcsd=amcsd, matrix=_qbin_matrix(len(axis), ibins),
+                   signature=signature)
+
+    @classmethod
+    def read(cls, filename):
+        "read index from .npz file"
+        dat = np.load(filename)
+        matrix = sparse.csr_matrix((dat['data'], dat['indices'], dat['indptr']),
+                                   shape=tuple(dat['shape']))
+        return cls(dat['axis'], amcsd=dat['amcsd'], matrix=matrix,
+                   signature=tuple(dat['signature']))
+
+    def save(self, filename):
+        "save index to .npz file"
+        sig = self.signature if self.signature is not None else (0, 0)
+        matrix = self.matrix
+        with open(filename, 'wb') as fh:
+            np.savez(fh, axis=self.axis, amcsd=self.amcsd,
+                     data=matrix.data, indices=matrix.indices,
+                     indptr=matrix.indptr, shape=np.array(matrix.shape),
+                     signature=np.array(sig))
+
+    def add(self, amcsd_id, qarr):
+        "add or replace the q array for one structure"
+        self._pending[int(amcsd_id)] = np.where(np.asarray(qarr) == 1)[0]
+
+    def _flush(self):
+        "append pending columns to the matrix"
+        if len(self._pending) < 1:
+            return
+        ids = np.array(list(self._pending.keys()), dtype=np.int64)
+        matrix, amcsd = self._matrix, self._amcsd
+        keep = np.where(~np.in1d(amcsd, ids))[0]
+        if len(keep) < len(amcsd):
+            matrix, amcsd = matrix[:, keep], amcsd[keep]
+        cols = _qbin_matrix(len(self.axis), list(self._pending.values()))
+        self._matrix = sparse.hstack((matrix, cols), format='csr')
+        self._amcsd = np.concatenate((amcsd, ids))
+        self._pending = {}
+
+    def search(self, peaks, qmin=QMIN, qmax=QMAX, qstep=QSTEP, ids=None,
+               top=None):
+        '''score structures against a list of measured q peaks
+
+        Arguments:
+        ----------
+        peaks   list of q values of measured peaks
+        qmin    minimum q value to consider
+        qmax    maximum q value to consider
+        qstep   q bin width, bins of the index are merged when larger
+                than the step of the index axis
+        ids     optional list of amcsd_id to limit search
+        top     number of best matches to return [None, all]
+
+        Returns:
+        --------
+        list of (score, amcsd_id, total_peaks, matched_peaks, missed_peaks),
+        sorted by decreasing score, where score is matched_peaks - missed_peaks
+        '''
+        axis = self.axis
+        imin, imax = 0, len(axis)
+        if qmax < np.max(axis):
+            imax = abs(axis-qmax).argmin()
+        if qmin > np.min(axis):
+            imin = abs(axis-qmin).argmin()
+        qaxis = axis[imin:imax]
+        stepq = (qaxis[1]-qaxis[0])
+        matrix = self.matrix[imin:imax]
+        amcsd = self.amcsd
+        if ids is not None:
+            cols = np.where(np.in1d(amcsd, np.asarray(ids)))[0]
+            matrix = matrix[:, cols]
+            amcsd = amcsd[cols]
+
+        ## merge bins if a larger step size is specified
+        if qstep > stepq:
+            new_qaxis = np.arange(np.min(qaxis), np.max(qaxis)+stepq, qstep)
+            ibin = np.abs(new_qaxis[np.newaxis, :] - qaxis[:, np.newaxis]).argmin(axis=1)
+            merge = sparse.csr_matrix((np.ones(len(qaxis), dtype=np.int8),
+                                       (ibin, np.arange(len(qaxis)))),
+                                      shape=(len(new_qaxis), len(qaxis)))
+            matrix = merge.dot(matrix).tocsr()
+            matrix.data[:] = 1
+            qaxis = new_qaxis
+
+        peaks = np.asarray(peaks, dtype=np.float64).reshape(-1)
+        ipeaks = np.abs(qaxis[np.newaxis, :] - peaks[:, np.newaxis]).argmin(axis=1)
+        peaks_true = np.zeros(len(qaxis), dtype=np.int64)
+        peaks_true[ipeaks] = 1
+
+        total_peaks = np.asarray(matrix.sum(axis=0)).reshape(-1)
+        match_peaks = matrix.T.dot(peaks_true)
+        miss_peaks = total_peaks - match_peaks
+        scores = match_peaks - miss_peaks
+
+        rows = zip(scores.tolist(), amcsd.tolist(), total_peaks.tolist(),
+                   match_peaks.tolist(), miss_peaks.tolist())
+        if top is None:
+            return sorted(rows, reverse=True)
+        return heapq.nlargest(top, rows)
+
+
 class cifDB(object):
     '''
     interface to the American Mineralogist Crystal Structure Database
@@ -183,6 +339,7 @@ class cifDB(object):
         self.ciftbl  = Table('ciftbl', self.metadata)
 
         self.axis = np.array([float(q[0]) for q in self.query(self.qtbl.c.q).all()])
+        self.qindex = None
 
 
     def query(self, *args, **kws):
@@ -376,7 +533,8 @@ class cifDB(object):
                     print('Adding: %s %s' % (spgrp_no,spgrp_name))
                     self.spgptbl.insert().execute(iuc_id=spgrp_no,hm_notation=spgrp_name)
 
-    def add_ciffile(self, ciffile, verbose=True, url=False, ijklm=1, file=None):
+    def add_ciffile(self, ciffile, verbose=True, url=False, ijklm=1, file=None,
+                    save_qindex=True):
         '''
         ## Adds ciffile into database
         When reading in new CIF:
@@ -392,6 +550,10 @@ class cifDB(object):
              to 'compref'
         vii. calculate q - find each corresponding 'q_id' for all peaks; in write
             'q_id','amcsd_id' to 'qpeak'
+
+        The q-peak index is updated in memory, and written to its sidecar
+        file if save_qindex is True.  Use save_qindex=False when adding
+        many files, and call save_qindex() once at the end.
         '''
 
         if url:
@@ -429,7 +591,7 @@ class cifDB(object):
             return
 
         ## Define q-array for each entry at given energy
-        qhkl = cif.calc_q(wvlgth=lambda_from_E(ENERGY), q_min=QMIN, q_max=QMAX)
+        qhkl = cif.calc_q(wavelength=lambda_from_E(ENERGY), q_min=QMIN, q_max=QMAX)
         qarr = self.create_q_array(qhkl)
 
         ###################################################
@@ -480,6 +642,10 @@ class cifDB(object):
         zarr = self.create_z_array(z_list)
 
 
+        ## q-peak index, validated before this structure is added
+        qindex = self.get_qindex()
+        count, idsum = qindex.signature
+
         ## Save CIF entry into database
         new_cif.execute(amcsd_id=cif.id_no,
                         mineral_id=int(mineral_id),
@@ -541,6 +707,12 @@ class cifDB(object):
     #     cif_category.execute(category_id='none',
     #                          amcsd_id=cif.id_no)
 
+        ## update q-peak index
+        qindex.add(cif.id_no, qarr)
+        qindex.signature = (count+1, idsum+int(cif.id_no))
+        if save_qindex:
+            self.save_qindex()
+
         if url:
             self.amcsd_info(cif.id_no, no_qpeaks=np.sum(qarr))
         else:
@@ -594,9 +766,12 @@ class cifDB(object):
                             print('Saved %s' % file)
                     if addDB:
                         try:
-                            self.add_ciffile(url_to_scrape, url=True, verbose=verbose, ijklm=i)
+                            self.add_ciffile(url_to_scrape, url=True, verbose=verbose,
+                                             ijklm=i, save_qindex=False)
                         except:
                             pass
+        if addDB:
+            self.save_qindex()
 
 
 
@@ -640,7 +815,7 @@ class cifDB(object):
             print(' ===================== ')
         print(' AMCSD: %i' % amcsd_id)
         print(' Name: %s' % mineral_name)
-        print(' %s' % self.composition_by_amcsd(amcsd_id,string=True))
+        print(' Elements (Z): %s' % self.composition_by_amcsd(amcsd_id))
         try:
             print(' Space Group No.: %s (%s)' % (iuc_id,self.symm_id(iuc_id)))
         except:
@@ -730,52 +905,72 @@ class cifDB(object):
 ##################################################################################
 ##################################################################################
 
+    def qindex_signature(self):
+        "signature of the structures in the database, used to validate q-peak index"
+        count, idsum = self.query(func.count(self.ciftbl.c.amcsd_id),
+                                  func.sum(self.ciftbl.c.amcsd_id)).one()
+        return (int(count or 0), int(idsum or 0))
+
+    def get_qindex(self):
+        '''return the sparse q-peak index (QPeakIndex) for the database,
+        reading it from the sidecar file ('<dbname>.qidx.npz') when that
+        is up-to-date, or building it from the q arrays of all structures.
+        '''
+        signature = self.qindex_signature()
+        if self.qindex is not None and self.qindex.signature == signature:
+            return self.qindex
+        fname = self.dbname + QINDEX_SUFFIX
+        if os.path.exists(fname):
+            try:
+                qindex = QPeakIndex.read(fname)
+                if (qindex.signature == signature and
+                    len(qindex.axis) == len(self.axis)):
+                    self.qindex = qindex
+                    return qindex
+            except (IOError, ValueError, KeyError):
+                pass
+        rows = self.query(self.ciftbl.c.amcsd_id, self.ciftbl.c.qstr).all()
+        self.qindex = QPeakIndex.from_qarrays(self.axis,
+                                              [(r[0], json.loads(r[1])) for r in rows],
+                                              signature=signature)
+        self.save_qindex()
+        return self.qindex
+
+    def save_qindex(self):
+        "save q-peak index to sidecar file, if possible"
+        if self.qindex is None:
+            return
+        try:
+            self.qindex.save(self.dbname + QINDEX_SUFFIX)
+        except IOError:
+            pass
+
     def amcsd_by_q(self, peaks, qmin=None, qmax=None, qstep=None, list=None,
-                   verbose=False):
+                   top=None, verbose=False):
+        '''
+        search for structures matching a list of q peaks, using
+        the sparse q-peak index
+
+        Arguments:
+        ----------
+        peaks   list of q values of measured peaks
+        qmin    minimum q value to consider [QMIN]
+        qmax    maximum q value to consider [QMAX]
+        qstep   q bin width [QSTEP]
+        list    optional list of amcsd_id to limit search
+        top     number of best matches to return [None, all]
 
+        Returns:
+        --------
+        list of (score, amcsd_id, total_peaks, matched_peaks, missed_peaks),
+        sorted by decreasing score
+        '''
         if qmin is None: qmin = QMIN
         if qmax is None: qmax = QMAX
         if qstep is None: qstep = QSTEP
 
-        ## Defines min/max limits of q-range
-        imin, imax = 0, len(self.axis)
-        if qmax < np.max(self.axis):
-            imax = abs(self.axis-qmax).argmin()
-        if qmin > np.min(self.axis):
-            imin = abs(self.axis-qmin).argmin()
-        qaxis = self.axis[imin:imax]
-        stepq = (qaxis[1]-qaxis[0])
-
-        amcsd, q_amcsd = self.match_q(list=list, qmin=qmin, qmax=qmax)
-
-        ## Re-bins data if different step size is specified
-        if qstep > stepq:
-            new_qaxis   = np.arange(np.min(qaxis),np.max(qaxis)+stepq,qstep)
-            new_q_amcsd = np.zeros((np.shape(q_amcsd)[0],np.shape(new_qaxis)[0]))
-            for m,qrow in enumerate(q_amcsd):
-                for n,qn in enumerate(qrow):
-                    if qn == 1:
-                        k = np.abs(new_qaxis-qaxis[n]).argmin()
-                        new_q_amcsd[m][k] = 1
-            qaxis = new_qaxis
-            q_amcsd = new_q_amcsd
-
-
-        ## Create data array
-        peaks_weighting = np.ones(len(qaxis),dtype=int)*-1
-        peaks_true = np.zeros(len(qaxis),dtype=int)
-        peaks_false = np.ones(len(qaxis),dtype=int)
-        for p in peaks:
-            i = np.abs(qaxis-p).argmin()
-            peaks_weighting[i],peaks_true[i],peaks_false[i] = 1,1,0
-
-        ## Calculate score/matches/etc.
-        total_peaks = np.sum((q_amcsd),axis=1)
-        match_peaks = np.sum((peaks_true*q_amcsd),axis=1)
-        miss_peaks = np.sum((peaks_false*q_amcsd),axis=1)
-        scores = np.sum((peaks_weighting*q_amcsd),axis=1)
-
-        return sorted(zip(scores, amcsd, total_peaks, match_peaks, miss_peaks), reverse=True)
+        return self.get_qindex().search(peaks, qmin=qmin, qmax=qmax,
+                                        qstep=qstep, ids=list, top=top)
 
 
     def amcsd_by_chemistry(self, include=[], exclude=[]):
@@ -937,8 +1132,9 @@ class cifDB(object):
     def create_q_array(self, q):
 
         q_array = np.zeros(len(self.axis), dtype=int)
-        for qn in q:
-            i = np.abs(self.axis-qn).argmin()
+        q = np.asarray(q, dtype=np.float64).reshape(-1)
+        if len(q) > 0:
+            i = np.abs(self.axis[np.newaxis, :] - q[:, np.newaxis]).argmin(axis=1)
             q_array[i] = 1
         return q_array
 
@@ -15,7 +15,7 @@ import math
 import cmath
 from io import StringIO
 
-from xraydb import f0
+from ..xray import f0
 from .xrd_tools import (generate_hkl, qv_from_hkl, d_from_hkl, q_from_d,
                         twth_from_d, d_from_q, twth_from_q)
 
@@ -2395,6 +2395,7 @@ class CIF(object):
     -------
     read_ciffile(ciffile)
     read_ciftext(ciftext)
+    calc_q(wavelength=1.54056, q_min=0.2, q_max=10.0)
     structure_factors(wavelength=1.54056, q_min=0.2, q_max=10.0)
 
     mkak 2017.04.13
@@ -2643,82 +2644,104 @@ class CIF(object):
                     self.atom.symm_wyckoff += ['error']
 
 
+    def element_sums(self, hkl):
+        '''
+        geometric part of the structure factor for each element:
+        sum over positions (u,v,w) of cos(2*pi*(hu+kv+lw)), weighted
+        by the number of times the element appears in atom.label
+
+        returns list of elements and array of shape (len(hkl), len(elements))
+        '''
+        elems, counts = [], []
+        for el in self.atom.label:
+            if el in elems:
+                counts[elems.index(el)] += 1
+            else:
+                elems.append(el)
+                counts.append(1)
+
+        uvw, ielem = [], []
+        for i, el in enumerate(elems):
+            uvw.extend(self.elem_uvw[el])
+            ielem.extend([i]*len(self.elem_uvw[el]))
+
+        hkl = np.asarray(hkl, dtype=np.float64).reshape(-1, 3)
+        sums = np.zeros((len(hkl), len(elems)))
+        if len(uvw) > 0 and len(hkl) > 0:
+            uvw = np.array(uvw, dtype=np.float64).reshape(-1, 3)
+            phase = np.cos(2*np.pi*np.dot(hkl, uvw.T)) ## (hu+kv+lw) for each atom
+            onehot = np.zeros((len(uvw), len(elems)))
+            onehot[np.arange(len(uvw)), ielem] = 1
+            sums = np.dot(phase, onehot)*np.array(counts)
+        return elems, sums
+
     def calc_q(self, wavelength=1.54056, q_min=0.2, q_max=10.0):
         """
+        returns sorted list of q values (as float16) of reflections
+        with non-zero structure factors, without atomic form factors
         """
         hkl_list = generate_hkl(positive_only=True)
 
         dhkl = d_from_hkl(hkl_list, *self.unitcell)
         qhkl = q_from_d(dhkl)
 
-        F2hkl = np.zeros(len(hkl_list))
-
         ## removes q values outside of range
-        ii, jj = qhkl < q_max, qhkl > q_min
-        ii = jj*ii
-
-        for i, hkl in enumerate(hkl_list):
-            Fhkl = 0
-            if ii[i]:
-                for el in self.atom.label:  ## loops through each element
-                    for uvw in self.elem_uvw[el]: ## loops through each position in unit cell
-                        hukvlw = hkl[0]*uvw[0]+hkl[1]*uvw[1]+hkl[2]*uvw[2]## (hu+kv+lw)
-                        Fhkl = Fhkl + (cmath.exp(2*cmath.pi*imag*hukvlw)).real
-            if abs(Fhkl) > 1e-5:
-                F2hkl[i] = np.float(Fhkl**2)
+        ii = (qhkl < q_max)*(qhkl > q_min)
 
-        ## removes zero value structure factors
-        ii = ii*(F2hkl > 0.001)
+        elems, sums = self.element_sums(hkl_list[ii])
+        Fhkl = sums.sum(axis=1)
 
-        qarr = np.array(qhkl[ii],dtype=np.float16)
+        F2hkl = np.zeros(len(hkl_list))
+        F2hkl[ii] = np.where(abs(Fhkl) > 1e-5, Fhkl**2, 0)
 
-        return sorted(np.array(list(set(qarr))))
+        ## removes zero value structure factors
+        ii = ii*(F2hkl > 0.001)
 
+        return list(np.unique(np.array(qhkl[ii], dtype=np.float16)))
 
     def structure_factors(self, wavelength=1.54056, q_min=0.2, q_max=10.0):
+        '''
+        calculate structure factors, setting attributes
+        hkl, qhkl, dhkl, twthhkl, F2hkl, phkl (multiplicity), LAP, and Ihkl
+        '''
         hkl_list = generate_hkl()
         dhkl = d_from_hkl(hkl_list, *self.unitcell)
         qhkl = q_from_d(dhkl)
 
-        F2hkl = np.zeros(len(hkl_list))
-
         ## removes q values outside of range
-        ii, jj = qhkl < q_max, qhkl > q_min
-        ii = jj*ii
+        ii = (qhkl < q_max)*(qhkl > q_min)
 
+        elems, sums = self.element_sums(hkl_list[ii])
+        f0vals = np.zeros(sums.shape)
+        for j, el in enumerate(elems):
+            f0vals[:, j] = f0(el, qhkl[ii]/(4*math.pi))
+        self._set_structure_factors(hkl_list, qhkl, ii, (f0vals*sums).sum(axis=1),
+                                    wavelength)
 
-        for i, hkl in enumerate(hkl_list):
-            Fhkl = 0
-            if ii[i]:
-                for el in self.atom.label:  ## loops through each element
-                    f0 = f0(el, qhkl[i]/(4*math.pi))
-                    for uvw in self.elem_uvw[el]: ## loops through each position in unit cell
-                        hukvlw = hkl[0]*uvw[0] + hkl[1]*uvw[1] + hkl[2]*uvw[2] ## (hu+kv+lw)
-                        Fhkl = Fhkl + f0*(cmath.exp(2*cmath.pi*imag*hukvlw)).real
-            if abs(Fhkl) > 1e-2:
-                F2hkl[i] = np.float(Fhkl**2)
+    def _set_structure_factors(self, hkl_list, qhkl, ii, Fhkl, wavelength):
+        "merge reflections with the same q, and set intensities"
+        F2hkl = np.zeros(len(hkl_list))
+        F2hkl[ii] = np.where(abs(Fhkl) > 1e-2, Fhkl**2, 0)
 
         ## removes zero value structure factors
         ii = ii*(F2hkl > 0.001)
-        # print(" II ", len(ii), ii.sum())
 
-        qarr = np.array(qhkl[ii], dtype=np.float32)
-        qarr = sorted(np.array(list(set(qarr))))
+        ## merge reflections with the same (float32) q value: the
+        ## multiplicity is the number of reflections, hkl and F2 are
+        ## taken from the last of these reflections
+        qarr, jhkl = np.unique(np.array(qhkl[ii], dtype=np.float32),
+                               return_inverse=True)
         kk = len(qarr)
+        ilast = np.zeros(kk, dtype=int)
+        np.maximum.at(ilast, jhkl, np.arange(len(jhkl)))
 
-        self.hkl    = np.zeros(kk, dtype=np.ndarray)
-        self.qhkl   = np.zeros(kk, dtype=np.float32)
-        self.F2hkl  = np.zeros(kk, dtype=np.float32)
-        self.phkl   = np.zeros(kk, dtype=np.int)
-
-        for i, row in enumerate(zip(list(hkl_list[ii]), qhkl[ii], F2hkl[ii])):
-            hkl, q, F2 = row
-            j = (np.abs(qarr-q)).argmin()
-
-            self.hkl[j]  = hkl
-            self.qhkl[j] = q
-            self.F2hkl[j] = F2
-            self.phkl[j] += 1
+        hkls = hkl_list[ii]
+        self.hkl = np.zeros(kk, dtype=np.ndarray)
+        for j, i in enumerate(ilast):
+            self.hkl[j] = hkls[i]
+        self.qhkl   = qarr
+        self.F2hkl  = np.array(F2hkl[ii][ilast], dtype=np.float32)
+        self.phkl   = np.bincount(jhkl, minlength=kk)
 
         self.dhkl = d_from_q(self.qhkl)
         self.twthhkl = twth_from_q(self.qhkl,wavelength)
@@ -2761,6 +2784,52 @@ def check_elemsym(atom):
 def removeNonAscii(s):
     return "".join(i for i in s if ord(i)<128)
 
+def calc_pattern_batch(cifs, wavelength=1.54056, qrange=(0.2, 10.0)):
+    """
+    calculate diffraction patterns for many CIFs in one call, sharing
+    the hkl list and evaluating the atomic form factor once for each
+    element over the q values of all CIFs.
+
+    Arguments
+    ---------
+    cifs        list of CIF instances or CIF file names
+    wavelength  x-ray wavelength in Angstroms [1.54056]
+    qrange      (q_min, q_max) q range [(0.2, 10.0)]
+
+    Returns
+    -------
+    list of arrays [q, 2theta, d, I] for each CIF, with structure factors
+    also set for each CIF as with CIF.structure_factors()
+    """
+    q_min, q_max = qrange
+    hkl_list = generate_hkl()
+
+    cifs = [create_cif(filename=c) if isinstance(c, str) else c for c in cifs]
+    calcs, elem_q = [], {}
+    for cif in cifs:
+        qhkl = q_from_d(d_from_hkl(hkl_list, *cif.unitcell))
+        ii = (qhkl < q_max)*(qhkl > q_min)
+        elems, sums = cif.element_sums(hkl_list[ii])
+        for el in elems:
+            elem_q.setdefault(el, []).append(qhkl[ii])
+        calcs.append((qhkl, ii, elems, sums))
+
+    ## form factors for all CIFs, one call per element
+    elem_f0 = {}
+    for el, qlist in elem_q.items():
+        f0vals = f0(el, np.concatenate(qlist)/(4*math.pi))
+        elem_f0[el] = np.split(np.atleast_1d(f0vals),
+                               np.cumsum([len(q) for q in qlist])[:-1])
+
+    out = []
+    for cif, (qhkl, ii, elems, sums) in zip(cifs, calcs):
+        Fhkl = np.zeros(len(sums))
+        for j, el in enumerate(elems):
+            Fhkl += elem_f0[el].pop(0)*sums[:, j]
+        cif._set_structure_factors(hkl_list, qhkl, ii, Fhkl, wavelength)
+        out.append(np.array([cif.qhkl, cif.twthhkl, cif.dhkl, cif.Ihkl]))
+    return out
+
 def create_cif(filename=None, text=None, cifdb=None, amcsd_id=None):
     """
     create CIF representation from CIF filename, text of CIF file,
@@ -8,6 +8,11 @@ mkak 2017.03.14
 ##########################################################################
 # IMPORT PYTHON PACKAGES
 import os
+import hashlib
+from functools import partial
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 import numpy as np
 
 HAS_pyFAI = False
@@ -20,9 +25,53 @@ except ImportError:
 
 from larch.io import tifffile
 
+# number of azimuthal integrators (with their lookup tables) kept in cache
+AI_CACHESIZE = 8
+_ai_cache = OrderedDict()
+
 ##########################################################################
 # FUNCTIONS
 
+def _mask_key(mask):
+    "key for mask in integrator cache"
+    if mask is None:
+        return None
+    if isinstance(mask, str):
+        mtime = os.stat(mask).st_mtime if os.path.exists(mask) else None
+        return (os.path.abspath(mask), mtime)
+    mask = np.ascontiguousarray(mask)
+    return (mask.shape, hashlib.md5(mask.tobytes()).hexdigest())
+
+def get_integrator(calfile, shape=None, mask=None, unit='q', steps=2048):
+    '''
+    return pyFAI azimuthal integrator for a calibration file, re-using
+    integrators (and so the integration lookup tables they hold) for the
+    same calibration file, modification time, image shape, mask, unit,
+    and number of steps.
+
+    calfile      : poni calibration file
+    shape        : shape of images to integrate
+    mask         : mask array (or file name) for image
+    unit         : unit for integration data ('2th'/'q'); default is 'q'
+    steps        : number of steps in integration data
+    '''
+    calfile = os.path.abspath(calfile)
+    key = (calfile, os.stat(calfile).st_mtime,
+           None if shape is None else tuple(shape),
+           _mask_key(mask), unit, steps)
+    if key in _ai_cache:
+        _ai_cache.move_to_end(key)
+        return _ai_cache[key]
+    ai = pyFAI.load(calfile)
+    _ai_cache[key] = ai
+    while len(_ai_cache) > AI_CACHESIZE:
+        _ai_cache.popitem(last=False)
+    return ai
+
+def clear_integrator_cache():
+    "clear cache of azimuthal integrators"
+    _ai_cache.clear()
+
 def return_ai(calfile):
 
     if calfile is not None and os.path.exists(calfile):
@@ -70,41 +119,14 @@ def read_lambda(calfile):
     ai = pyFAI.load(calfile)
     return ai._wavelength*1e10 ## units A
 
-def integrate_xrd_row(rowxrd2d, calfile, unit='q', steps=2048,
-                      wedge_limits=None, mask=None, dark=None,
-                      flip=True):
-    '''
-    Uses pyFAI (poni) calibration file to produce 1D XRD data from a row of 2D XRD images
-
-    Must provide pyFAI calibration file
-
-    rowxrd2d     : 2D diffraction images for integration
-    calfile      : poni calibration file
-    unit         : unit for integration data ('2th'/'q'); default is 'q'
-    steps        : number of steps in integration data; default is 10000
-    wedge_limits : azimuthal slice limits
-    mask         : mask array for image
-    dark         : dark image array
-    flip         : vertically flips image to correspond with Dioptas poni file calibration
-    '''
-
-    if not HAS_pyFAI:
-        print('pyFAI not imported. Cannot calculate 1D integration.')
-        return
-
-    try:
-        ai = pyFAI.load(calfile)
-    except:
-        print('calibration file "%s" could not be loaded.' % calfile)
-        return
-
+def _integration_attrs(unit='q', wedge_limits=None, mask=None, dark=None):
+    "keyword arguments for integrate1d"
     if type(dark) is str:
         try:
-            dark = np.array(tifffile.imread(xrd2dbkgd))
+            dark = np.array(tifffile.imread(dark))
         except:
             dark = None
 
-    dir = -1 if flip else 1
     attrs = dict(mask=mask, dark=dark, method='csr',
              polarization_factor=0.999, correctSolidAngle=True)
 
@@ -115,15 +137,128 @@ def integrate_xrd_row(rowxrd2d, calfile, unit='q', steps=2048,
 
     if wedge_limits is not None:
         attrs.update({'azimuth_range':wedge_limits})
+    return attrs
+
+def _integrate_frames(frames, calfile=None, ai=None, unit='q', steps=2048,
+                      wedge_limits=None, mask=None, dark=None, flip=True,
+                      out=None, offset=0):
+    '''integrate a list of frames, returning q and 1D data, or writing
+    the 1D data into out[offset:offset+len(frames)]'''
+    if ai is None:
+        ai = get_integrator(calfile, shape=np.shape(frames[0]), mask=mask,
+                            unit=unit, steps=steps)
+    attrs = _integration_attrs(unit=unit, wedge_limits=wedge_limits,
+                               mask=mask, dark=dark)
+    dir = -1 if flip else 1
+    if out is None:
+        out = np.zeros((len(frames), steps))
+        offset = 0
+    q = None
+    for i, xrd2d in enumerate(frames):
+        q, out[offset+i] = calcXRD1d(xrd2d[::dir,:], ai, steps, attrs)
+    return q, out
+
+def integrate_xrd_stack(frames, calfile, unit='q', steps=2048,
+                        wedge_limits=None, mask=None, dark=None, flip=True,
+                        nworkers=1, use_processes=False, out=None):
+    '''
+    Uses pyFAI (poni) calibration file to produce 1D XRD data for a stack of
+    2D XRD images, spreading the images over a pool of workers.
+
+    The azimuthal integrator and its lookup table are built once for the
+    calibration file and image shape (see get_integrator()) and shared by
+    all frames, or built once per worker process.
+
+    frames        : stack of 2D diffraction images, shape (nframes, ny, nx)
+    calfile       : poni calibration file
+    unit          : unit for integration data ('2th'/'q'); default is 'q'
+    steps         : number of steps in integration data; default is 2048
+    wedge_limits  : azimuthal slice limits
+    mask          : mask array for image
+    dark          : dark image array
+    flip          : vertically flips image to correspond with Dioptas poni file calibration
+    nworkers      : number of worker threads or processes [1]
+    use_processes : whether to use processes instead of threads [False]
+    out           : optional preallocated output array, shape (nframes, steps)
+
+    Returns
+    -------
+    q, xrd1d  with xrd1d of shape (nframes, steps)
+    '''
+    if not HAS_pyFAI:
+        print('pyFAI not imported. Cannot calculate 1D integration.')
+        return
+
+    nframes = len(frames)
+    if out is None:
+        out = np.zeros((nframes, steps))
+    if nframes < 1:
+        return None, out
+    kws = dict(unit=unit, steps=steps, wedge_limits=wedge_limits,
+               mask=mask, dark=dark, flip=flip)
+
+    try:
+        ai = get_integrator(calfile, shape=np.shape(frames[0]), mask=mask,
+                            unit=unit, steps=steps)
+    except:
+        print('calibration file "%s" could not be loaded.' % calfile)
+        return
+
+    # first frame builds lookup table, in this process
+    q, out = _integrate_frames(frames[:1], ai=ai, out=out, offset=0, **kws)
+    nworkers = max(1, min(nworkers, nframes-1))
+    if nframes < 2:
+        return q, out
+    if nworkers == 1:
+        _integrate_frames(frames[1:], ai=ai, out=out, offset=1, **kws)
+    elif use_processes:
+        bounds = np.linspace(1, nframes, nworkers+1).astype(int)
+        chunks = [frames[bounds[i]:bounds[i+1]] for i in range(nworkers)]
+        pool = Pool(nworkers)
+        results = pool.map(partial(_integrate_frames, calfile=calfile, **kws),
+                           chunks)
+        pool.close()
+        pool.join()
+        for i, result in enumerate(results):
+            out[bounds[i]:bounds[i+1]] = result[1]
+    else:
+        bounds = np.linspace(1, nframes, nworkers+1).astype(int)
+        def integrate_chunk(i):
+            _integrate_frames(frames[bounds[i]:bounds[i+1]], ai=ai, out=out,
+                              offset=bounds[i], **kws)
+        pool = ThreadPool(nworkers)
+        pool.map(integrate_chunk, range(nworkers))
+        pool.close()
+        pool.join()
+    return q, out
 
-    # print("Calc XRD 1D for row", ai, steps, attrs)
-    q, xrd1d = [], []
-    for i, xrd2d in enumerate(rowxrd2d):
-        row_q,row_xrd1d = calcXRD1d(xrd2d[::dir,:], ai, steps, attrs)
-        q     += [row_q]
-        xrd1d += [row_xrd1d]
+def integrate_xrd_row(rowxrd2d, calfile, unit='q', steps=2048,
+                      wedge_limits=None, mask=None, dark=None,
+                      flip=True, nworkers=1):
+    '''
+    Uses pyFAI (poni) calibration file to produce 1D XRD data from a row of 2D XRD images
 
-    return np.array(q), np.array(xrd1d)
+    Must provide pyFAI calibration file
+
+    rowxrd2d     : 2D diffraction images for integration
+    calfile      : poni calibration file
+    unit         : unit for integration data ('2th'/'q'); default is 'q'
+    steps        : number of steps in integration data; default is 10000
+    wedge_limits : azimuthal slice limits
+    mask         : mask array for image
+    dark         : dark image array
+    flip         : vertically flips image to correspond with Dioptas poni file calibration
+    nworkers     : number of worker threads [1]
+
+    the azimuthal integrator is cached between calls, see get_integrator()
+    '''
+    result = integrate_xrd_stack(rowxrd2d, calfile, unit=unit, steps=steps,
+                                 wedge_limits=wedge_limits, mask=mask,
+                                 dark=dark, flip=flip, nworkers=nworkers)
+    if result is None:
+        return
+    q, xrd1d = result
+    return np.array([q]*len(xrd1d)), xrd1d
 
 def integrate_xrd(xrd2d, calfile, unit='q', steps=2048, file='',  wedge_limits=None,
                   mask=None, dark=None, is_eiger=True, save=False, verbose=False):
@@ -10,8 +10,8 @@ Authors/Modifications:
 import numpy as np
 from larch import Group, isgroup
 
-from xraydb import xray_line, xray_edge, material_mu
 from ..math import interp
+from ..xray import xray_line, xray_edge, material_mu
 from .deadtime import calc_icr, correction_factor
 from .roi import ROI
 
@@ -10,12 +10,13 @@ from scipy.optimize import nnls
 from lmfit import  Parameters, minimize, fit_report
 from lmfit.printfuncs import gformat
 
-from xraydb import (material_mu, mu_elam, ck_probability, xray_edge,
-                    xray_edges, xray_lines, xray_line)
+from xraydb import ck_probability
 from xraydb.xray import XrayLine
 
 from .. import Group
 from ..math import index_of, interp, savitzky_golay, hypermet, erfc
+from ..xray import (material_mu, mu_elam, xray_edge, xray_edges,
+                    xray_lines, xray_line)
 from ..xafs import ftwindow
 from ..utils import group2dict, json_dump, json_load
 
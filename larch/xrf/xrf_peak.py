@@ -9,11 +9,11 @@ This is a Larch group representing a Peak in an XRF Spectrum.
 import numpy as np
 from scipy.interpolate import UnivariateSpline
 
-from xraydb import xray_line
 
 from larch import Group
 from ..fitting import Parameter, isParameter, param_value
 from ..math import gaussian, lorentzian, voigt, pvoigt
+from ..xray import xray_line
 
 class XRFPeak(Group):
     def __init__(self, name=None, shape='gaussian',
@@ -4,6 +4,8 @@ from .xrm_mapfile import (read_xrmmap, process_mapfolder,
                           GSEXRM_MapFile)
 
 from .gsexrm_utils import GSEXRM_FileStatus
+from .mapwatcher import GSEXRM_MapWatcher, watch_mapfolder
 
 _larch_builtins = {'_io': {'read_xrmmap': read_xrmmap,
-                           'process_mapfolder': process_mapfolder}}
+                           'process_mapfolder': process_mapfolder,
+                           'watch_mapfolder': watch_mapfolder}}
@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+Watch a GSECARS X-ray Microprobe Map folder while data is being
+collected, and add rows to the HDF5 map file as soon as all the raw
+data files for a row are complete.
+
+On Linux, changes to the map folder are seen with inotify, so rows are
+processed as soon as the files are closed.  Elsewhere, or if inotify
+cannot be used, the folder is polled.
+
+    >>> from larch.xrmmap import GSEXRM_MapWatcher
+    >>> watcher = GSEXRM_MapWatcher('MyMap.001')
+    >>> watcher.run(idle_timeout=600)
+    >>> print(watcher.stats)
+"""
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from .xrm_mapfile import GSEXRM_MapFile, isGSEXRM_MapFolder
+from .gsexrm_utils import (GSEXRM_Exception, GSEXRM_FileStatus,
+                           fix_xrd1d_filename)
+
+# inotify event masks, from <sys/inotify.h>
+IN_MODIFY      = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_WATCH_MASK  = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+IN_EVENT_SIZE  = struct.calcsize('iIII')
+
+# names used for default raw files in Master.dat, see read_rowdata()
+ROWFILE_DEFAULTS = ('xsp3', 'struck', 'xps', 'pexrd')
+
+
+class FolderWatcher(object):
+    '''wait for files in a folder to change, using inotify when
+    available, and otherwise simply waiting for the poll time.
+
+    Files seen to be closed after writing are added to `closed_files`.
+    '''
+    def __init__(self, folder, use_inotify=True, poll_time=1.0):
+        self.folder = folder
+        self.poll_time = poll_time
+        self.closed_files = set()
+        self.nevents = 0
+        self.fd = None
+        if use_inotify:
+            self._init_inotify()
+
+    @property
+    def use_inotify(self):
+        return self.fd is not None
+
+    def _init_inotify(self):
+        if not sys.platform.startswith('linux'):
+            return
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK)
+            if fd < 0:
+                return
+            wd = libc.inotify_add_watch(fd, os.fsencode(self.folder),
+                                        IN_WATCH_MASK)
+            if wd < 0:
+                os.close(fd)
+                return
+        except (OSError, AttributeError, TypeError):
+            return
+        self.fd = fd
+
+    def wait(self, timeout=None):
+        '''wait for changes in the folder, up to timeout seconds
+        (default poll_time), returning list of changed file names,
+        which will be empty when polling.
+        '''
+        if timeout is None:
+            timeout = self.poll_time
+        if self.fd is None:
+            time.sleep(timeout)
+            return []
+        ready, _w, _x = select.select([self.fd], [], [], timeout)
+        if len(ready) < 1:
+            return []
+        try:
+            buff = os.read(self.fd, 65536)
+        except OSError:
+            return []
+        names = []
+        offset = 0
+        while offset + IN_EVENT_SIZE <= len(buff):
+            wd, mask, cookie, length = struct.unpack_from('iIII', buff, offset)
+            offset += IN_EVENT_SIZE
+            name = buff[offset:offset+length].rstrip(b'\0').decode('utf-8', 'replace')
+            offset += length
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.closed_files.add(name)
+            elif name in self.closed_files:
+                self.closed_files.discard(name)
+            names.append(name)
+        self.nevents += len(names)
+        return names
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class GSEXRM_MapWatcher(object):
+    '''process a GSEXRM Map folder into its HDF5 map file during
+    data collection.
+
+    Parameters
+    ----------
+    folder :       str     map folder
+    callback :     None or function called after each row is processed
+                   with keywords row, maxrow, filename, and status
+    use_inotify :  bool    whether to use inotify when available [True]
+    poll_time :    float   time (sec) to wait for changes [1.0]
+    settle_time :  float   time (sec) a file must be unchanged to be
+                   considered complete, when close events are not seen [1.0]
+    kws :          other keywords are passed to GSEXRM_MapFile()
+
+    Notes
+    -----
+    progress is kept in the `stats` dict, with keys
+       'nrows', 'nrows_expected', 'last_row', 'rows_processed',
+       'start_time', 'last_row_time', 'row_process_time', 'nevents', 'inotify'
+    '''
+    def __init__(self, folder, callback=None, use_inotify=True, poll_time=1.0,
+                 settle_time=1.0, **kws):
+        self.folder = folder
+        self.callback = callback
+        self.settle_time = settle_time
+        self.mapfile_kws = kws
+        self.mapfile = None
+        self.keep_running = True
+        self.watcher = FolderWatcher(folder, use_inotify=use_inotify,
+                                     poll_time=poll_time)
+        self.stats = {'nrows': 0, 'nrows_expected': None, 'last_row': -1,
+                      'rows_processed': 0, 'start_time': time.time(),
+                      'last_row_time': None, 'row_process_time': 0.0,
+                      'nevents': 0, 'inotify': self.watcher.use_inotify}
+
+    def open_mapfile(self):
+        "open or create map file, returning whether it is ready"
+        if self.mapfile is not None:
+            return True
+        if not isGSEXRM_MapFolder(self.folder):
+            return False
+        try:
+            self.mapfile = GSEXRM_MapFile(folder=self.folder, **self.mapfile_kws)
+        except (GSEXRM_Exception, IOError):
+            self.mapfile = None
+            return False
+        if not self.mapfile.check_hostid():
+            raise GSEXRM_Exception("Not Owner of HDF5 file %s" %
+                                   self.mapfile.filename)
+        return True
+
+    def row_files(self, irow):
+        "list of raw data files for a row"
+        files = []
+        for i, fname in enumerate(self.mapfile.rowdata[irow][1:5]):
+            if i == 3 and len(self.mapfile.rowdata[irow]) < 6:
+                break  # no XRD file for older scans
+            if '_unused_' in fname:
+                continue
+            if fname.startswith('None'):
+                fname = fname.replace('None', ROWFILE_DEFAULTS[i])
+            files.append((i, fname))
+        return files
+
+    def row_complete(self, irow):
+        '''return whether all raw data files for a row exist and have been
+        closed, or have not been changed for settle_time seconds'''
+        now = time.time()
+        for i, fname in self.row_files(irow):
+            path = os.path.join(self.folder, fname)
+            if not os.path.exists(path):
+                if i == 3 and fix_xrd1d_filename(path) is not None:
+                    continue
+                return False
+            if fname in self.watcher.closed_files:
+                continue
+            if now - os.stat(path).st_mtime < self.settle_time:
+                return False
+        return True
+
+    def check(self):
+        '''process any completed rows, returning number of rows processed'''
+        if not self.open_mapfile():
+            return 0
+        mfile = self.mapfile
+        mfile.read_master()
+        nrows = len(mfile.rowdata)
+        self.stats['nrows'] = nrows
+        self.stats['nrows_expected'] = getattr(mfile, 'nrows_expected', None)
+
+        irow = mfile.last_row + 1
+        lastrow = irow
+        while lastrow < nrows and self.row_complete(lastrow):
+            lastrow += 1
+        if lastrow == irow:
+            return 0
+
+        if mfile.status == GSEXRM_FileStatus.created:
+            mfile.initialize_xrmmap(callback=self.callback)
+            irow = mfile.last_row + 1
+        nproc = 0
+        while irow < lastrow and self.keep_running:
+            t0 = time.time()
+            mfile.process_row(irow, flush=(irow == lastrow-1),
+                              callback=self.callback)
+            now = time.time()
+            self.stats['row_process_time'] += now - t0
+            self.stats['last_row_time'] = now
+            nproc += 1
+            irow += 1
+        self.stats['rows_processed'] += nproc
+        self.stats['last_row'] = mfile.last_row
+        if not self.keep_running:
+            mfile.resize_arrays(mfile.last_row+1)
+            mfile.h5root.flush()
+        return nproc
+
+    def is_complete(self):
+        "whether all expected rows have been processed"
+        nexpected = self.stats['nrows_expected']
+        return (nexpected is not None and
+                self.stats['last_row'] >= nexpected - 1)
+
+    def run(self, timeout=None, idle_timeout=None):
+        '''watch and process map folder until all expected rows are
+        processed, or stop() is called.
+
+        Parameters
+        ----------
+        timeout :       None or float, max total time (sec) to run [None]
+        idle_timeout :  None or float, max time (sec) to wait without any
+                        new rows [None]
+
+        Returns
+        -------
+        stats dictionary
+        '''
+        t0 = tlast = time.time()
+        self.keep_running = True
+        try:
+            while self.keep_running:
+                if self.check() > 0:
+                    tlast = time.time()
+                if self.is_complete():
+                    break
+                now = time.time()
+                if timeout is not None and now - t0 > timeout:
+                    break
+                if idle_timeout is not None and now - tlast > idle_timeout:
+                    break
+                self.watcher.wait()
+                self.stats['nevents'] = self.watcher.nevents
+        except KeyboardInterrupt:
+            pass
+        if self.mapfile is not None and self.mapfile.h5root is not None:
+            self.mapfile.h5root.flush()
+        return self.stats
+
+    def stop(self):
+        "stop run() after the current row"
+        self.keep_running = False
+
+    def close(self):
+        self.watcher.close()
+        if self.mapfile is not None:
+            self.mapfile.close()
+            self.mapfile = None
+
+
+def watch_mapfolder(path, timeout=None, idle_timeout=600, callback=None,
+                    use_inotify=True, **kws):
+    """watch a map folder during data collection, adding rows to
+    the map file as they are completed, with optional keywords
+    passed to GSEXRM_MapFile.   Returns progress statistics.
+    """
+    watcher = GSEXRM_MapWatcher(path, callback=callback,
+                                use_inotify=use_inotify, **kws)
+    try:
+        stats = watcher.run(timeout=timeout, idle_timeout=idle_timeout)
+    finally:
+        watcher.close()
+    return stats
@@ -7,12 +7,14 @@ import h5py
 import numpy as np
 import scipy.stats as stats
 import json
+import hashlib
 import multiprocessing as mp
 from functools import partial
+from collections import OrderedDict
 
 import larch
 from larch.utils import debugtime, isotime
-from larch.utils.strutils import fix_filename, bytes2str, version_ge
+from larch.utils.strutils import fix_filename, fix_varname, bytes2str, version_ge
 
 from larch.io import (nativepath, new_filename, read_xrf_netcdf,
                       read_xsp3_hdf5, read_xrd_netcdf, read_xrd_hdf5)
@@ -28,7 +30,8 @@ from .gsexrm_utils import (GSEXRM_MCADetector, GSEXRM_Area, GSEXRM_Exception,
 from ..xrd import (XRD, E_from_lambda, integrate_xrd_row, q_from_twth,
                    q_from_d, lambda_from_E, read_xrd_data)
 
-from larch.math.tomography import tomo_reconstruction, reshape_sinogram, trim_sinogram
+from larch.math.tomography import (tomo_reconstruction, reshape_sinogram,
+                                   trim_sinogram, sinogram_axes)
 
 NINIT = 32
 COMPRESSION_OPTS = 2
@@ -37,8 +40,11 @@ COMPRESSION = 'gzip'
 DEFAULT_ROOTNAME = 'xrmmap'
 VALID_ROOTNAMES = ('xrmmap', 'xrfmap')
 EXTRA_DETGROUPS =  ('scalars', 'work', 'xrd1d', 'xrd2d')
+AREA_CACHE = 'area_cache'
 NOT_OWNER = "Not Owner of HDF5 file %s"
 QSTEPS = 2048
+TOMO_MAXMEM = 1024   # memory ceiling (MB) for streaming tomography
+ROIMAP_CACHESIZE = 64
 
 H5ATTRS = {'Type': 'XRM 2D Map',
            'Version': '2.1.0',
@@ -269,6 +275,9 @@ class GSEXRM_MapFile(object):
         self.force_no_dtc  = False
         self.save_each_mca = save_each_mca
         self.detector_list = None
+        self.area_cache    = {}
+        self.area_cache_unsaved = set()
+        self.roimap_cache  = OrderedDict()
 
         self.compress_args = {'compression': compression}
         if compression != 'lzf':
@@ -524,6 +533,7 @@ class GSEXRM_MapFile(object):
 
     def close(self):
         if self.check_hostid():
+            self.save_area_cache()
             self.xrmmap.attrs['Process_Machine'] = ''
             self.xrmmap.attrs['Process_ID'] = 0
             self.xrmmap.attrs['Last_Row'] = self.last_row
@@ -704,6 +714,7 @@ class GSEXRM_MapFile(object):
             return
 
         self.last_row = -1
+        self.clear_area_cache()
         # print(" Initialize XRMMAP -> Add Map Config ", self.mapconf)
         self.add_map_config(self.mapconf)
 
@@ -1552,7 +1563,7 @@ class GSEXRM_MapFile(object):
         dlist = []
         for det in self.get_detector_list():
            for idet in find_detector(self.xrmmap[det]):
-               if not (remove in idet):
+               if remove is None or remove not in idet:
                    dlist.append(idet)
 
         return dlist
@@ -1777,6 +1788,7 @@ class GSEXRM_MapFile(object):
         ds = workgroup.create_dataset(name, data=data)
         for key, val in kws.items():
             ds.attrs[key] = val
+        self.roimap_cache.clear()
         self.h5root.flush()
 
     def del_work_array(self, name, parent='work'):
@@ -1787,6 +1799,7 @@ class GSEXRM_MapFile(object):
         name = h5str(name)
         if name in workgroup:
             del workgroup[name]
+            self.roimap_cache.clear()
             self.h5root.flush()
 
     def get_work_array(self, name, parent='work'):
@@ -1926,6 +1939,86 @@ class GSEXRM_MapFile(object):
 
         return roidata
 
+    def area_signature(self, area, *args):
+        '''return content hash for an area mask and the state of the
+        map data it is applied to (last row, plus any extra arguments)
+        '''
+        sig = hashlib.md5(np.asarray(area, dtype=bool).tobytes())
+        sig.update(repr((self.last_row,) + args).encode('utf-8'))
+        return sig.hexdigest()
+
+    def get_area_cache(self, areaname, source, signature):
+        '''return (data, attrs) cached for an area and data source
+        (detector name, 'xrd1d', 'xrd2d', ...), or (None, None)
+        if nothing is cached or the cached signature does not match
+        '''
+        cached = self.area_cache.get(areaname, {}).get(source, None)
+        if cached is not None and cached[0] == signature:
+            return cached[1], cached[2]
+
+        cache_grp = self.xrmmap.get(AREA_CACHE, None)
+        if (cache_grp is None or areaname not in cache_grp or
+            source not in cache_grp[areaname]):
+            return None, None
+        dset = cache_grp[areaname][source]
+        if h5str(dset.attrs.get('signature', '')) != signature:
+            return None, None
+        attrs = json.loads(h5str(dset.attrs.get('values', '{}')))
+        data = dset[()]
+        self.area_cache.setdefault(areaname, {})[source] = (signature, data, attrs)
+        return data, attrs
+
+    def set_area_cache(self, areaname, source, signature, data, **attrs):
+        '''cache data (summed spectra or patterns) for an area and data
+        source, with a content signature and optional attributes.
+        The cache is held in memory, and written to the HDF5 file by
+        save_area_cache(), as when the file is closed.
+        '''
+        self.area_cache.setdefault(areaname, {})[source] = (signature, data, attrs)
+        self.area_cache_unsaved.add((areaname, source))
+
+    def save_area_cache(self):
+        '''write area cache data not yet saved to the HDF5 file, as
+        '/xrmmap/area_cache/<areaname>/<source>', when this process
+        owns the file
+        '''
+        if len(self.area_cache_unsaved) < 1 or not self.check_hostid():
+            return
+        cache_grp = ensure_subgroup(AREA_CACHE, self.xrmmap, dtype='area cache')
+        for areaname, source in self.area_cache_unsaved:
+            signature, data, attrs = self.area_cache[areaname][source]
+            agrp = ensure_subgroup(areaname, cache_grp, dtype='area cache')
+            if source in agrp:
+                del agrp[source]
+            dset = agrp.create_dataset(source, data=data, **self.compress_args)
+            dset.attrs['signature'] = signature
+            dset.attrs['values'] = json.dumps(attrs)
+        self.area_cache_unsaved = set()
+        self.h5root.flush()
+
+    def clear_area_cache(self, areaname=None):
+        '''clear cached area data, for one area or for all areas'''
+        if areaname is None:
+            self.area_cache = {}
+            self.area_cache_unsaved = set()
+        else:
+            self.area_cache.pop(areaname, None)
+            self.area_cache_unsaved = set(k for k in self.area_cache_unsaved
+                                          if k[0] != areaname)
+
+        if self.xrmmap is None or not self.check_hostid():
+            return
+        cache_grp = self.xrmmap.get(AREA_CACHE, None)
+        if cache_grp is None:
+            return
+        if areaname is None:
+            del self.xrmmap[AREA_CACHE]
+        elif areaname in cache_grp:
+            del cache_grp[areaname]
+        else:
+            return
+        self.h5root.flush()
+
     def get_translation_axis(self, hotcols=None):
         if hotcols is None:
             hotcols = self.hotcols
@@ -2043,9 +2136,15 @@ class GSEXRM_MapFile(object):
 
     def save_tomograph(self, datapath, algorithm='gridrec',
                        filter_name='shepp', num_iter=1, dtcorrect=None,
-                       hotcols=None, **kws):
+                       hotcols=None, stream=False, max_memory=TOMO_MAXMEM,
+                       ncpus=1, **kws):
         '''
         saves group for tomograph for selected detector
+
+        with stream=True, MCA counts are read, reconstructed, and written
+        to the 'tomo' group in slabs of channels, with the slab size set
+        so that the data in flight stays below max_memory (in MB), and
+        slabs reconstructed in parallel with ncpus worker processes.
         '''
         if hotcols is None:
             hotcols = self.hotcols
@@ -2092,6 +2191,21 @@ class GSEXRM_MapFile(object):
                 grp = ensure_subgroup(kpath ,grp)
         tomogrp = grp
 
+        if (stream and datapath.endswith('counts') and
+            len(datagroup.shape) == 3 and 'xrd' not in datapath and
+            len(x) != datagroup.shape[2]):
+            center = self._save_tomograph_stream(datapath, detpath, tomogrp,
+                                                 x, omega, center,
+                                                 dtcorrect=dtcorrect,
+                                                 max_memory=max_memory,
+                                                 ncpus=ncpus,
+                                                 algorithm=algorithm,
+                                                 filter_name=filter_name,
+                                                 num_iter=num_iter)
+            self._save_tomograph_attrs(tomogrp, detgroup, algorithm,
+                                       filter_name, center)
+            return
+
         ## define sino group from datapath
         if 'scalars' in datapath or 'xrd' in datapath:
             sino = datagroup.value
@@ -2117,15 +2231,21 @@ class GSEXRM_MapFile(object):
                                            num_iter=num_iter, omega=omega,
                                            center=center, sinogram_order=order)
 
-        tomogrp.attrs['tomo_alg'] = '-'.join([str(t) for t in (algorithm, filter_name)])
-        tomogrp.attrs['center'] = '%0.2f pixels' % (center)
-
         try:
             tomogrp.create_dataset('counts', data=np.swapaxes(tomo,0,2), **self.compress_args)
         except:
             del tomogrp['counts']
             tomogrp.create_dataset('counts', data=np.swapaxes(tomo,0,2), **self.compress_args)
 
+        self._save_tomograph_attrs(tomogrp, detgroup, algorithm,
+                                   filter_name, center)
+
+    def _save_tomograph_attrs(self, tomogrp, detgroup, algorithm,
+                              filter_name, center):
+        "save energy/q arrays and attributes for a saved tomograph"
+        tomogrp.attrs['tomo_alg'] = '-'.join([str(t) for t in (algorithm, filter_name)])
+        tomogrp.attrs['center'] = '%0.2f pixels' % (center)
+
         for data_tag in ('energy','q'):
             if data_tag in detgroup.keys():
                 try:
@@ -2140,6 +2260,96 @@ class GSEXRM_MapFile(object):
 
         self.h5root.flush()
 
+    def _save_tomograph_stream(self, datapath, detpath, tomogrp, x, omega,
+                               center, dtcorrect=True, max_memory=TOMO_MAXMEM,
+                               ncpus=1, **kws):
+        '''reconstruct and save tomograph for MCA counts in slabs of
+        channels, reading, reconstructing, and writing one batch of slabs
+        at a time, returning the rotation center used.
+        '''
+        datagroup = self.xrmmap[datapath]
+        nrow, npts, nchan = datagroup.shape
+
+        dsets = [(datagroup, self.xrmmap[detpath])]
+        if dtcorrect and 'sum' in datapath:
+            dsets = []
+            for i in range(self.nmca):
+                idatapath = datapath.replace('sum', str(i+1))
+                idetpath  = detpath.replace('sum', str(i+1))
+                dsets.append((self.xrmmap[idatapath], self.xrmmap[idetpath]))
+        dtfactors = []
+        for dset, dgroup in dsets:
+            dtfac = None
+            if dtcorrect and 'dtfactor' in dgroup:
+                dtfac = dgroup['dtfactor'][:nrow, :npts]
+            dtfactors.append(dtfac)
+
+        # sinograms are built as [channel, row, column], as for
+        # save_tomograph(), and reordered as with reshape_sinogram()
+        subscripts, order = sinogram_axes((nchan, nrow, npts), x, omega)
+        nimg = nrow if 'ikj->ijk' in subscripts else npts
+
+        # bytes per channel in flight: for each slab of the batch, the
+        # float64 sinogram (and its copy in a worker process), the float32
+        # copy made for reconstruction and the float32 reconstruction (and
+        # its copy returned from a worker); for the slab being read, the
+        # counts in their own dtype and a float64 deadtime-corrected copy
+        ncpus = max(1, mp.cpu_count()-1) if ncpus is None else max(1, int(ncpus))
+        ncopy = 2 if ncpus > 1 else 1
+        npix = 1.0*nrow*npts
+        itemsize = max([dset.dtype.itemsize for dset, dgroup in dsets])
+        slab_bytes = (8*ncopy + 4)*npix + 4*ncopy*nimg*nimg
+        read_bytes = (itemsize + 8)*npix
+        nslab = int(max_memory*2**20/(ncpus*slab_bytes + read_bytes))
+        nslab = max(1, min(nchan, nslab))
+        slabs = [(c0, min(c0+nslab, nchan)) for c0 in range(0, nchan, nslab)]
+
+        if 'counts' in tomogrp:
+            del tomogrp['counts']
+        out = None
+
+        pool = None
+        if ncpus > 1:
+            pool = mp.Pool(ncpus)
+        recon = partial(_tomo_recon_slab, omega=omega, sinogram_order=order, **kws)
+        try:
+            for ibatch in range(0, len(slabs), ncpus):
+                batch = slabs[ibatch:ibatch+ncpus]
+                sinos = []
+                for c0, c1 in batch:
+                    sino = np.zeros((c1-c0, nrow, npts), dtype=np.float64)
+                    for (dset, dgroup), dtfac in zip(dsets, dtfactors):
+                        slab = np.einsum('jki->ijk', dset[:, :, c0:c1])
+                        if dtfac is not None:
+                            slab = slab * dtfac
+                        sino += slab
+                    for subs in subscripts:
+                        sino = np.einsum(subs, sino)
+                    sinos.append(sino)
+                tomos = []
+                if ibatch == 0:
+                    # the center from the first slab is used for all slabs
+                    center, tomo = recon(sinos.pop(0), center=center)
+                    tomos.append(tomo)
+                _recon = partial(recon, center=center, refine_center=False)
+                if pool is None or len(sinos) < 2:
+                    tomos.extend([_recon(sino)[1] for sino in sinos])
+                else:
+                    tomos.extend([t[1] for t in pool.map(_recon, sinos)])
+                for (c0, c1), tomo in zip(batch, tomos):
+                    tomo = np.swapaxes(tomo, 0, 2)
+                    if out is None:
+                        out = tomogrp.create_dataset('counts',
+                                                     (tomo.shape[0], tomo.shape[1], nchan),
+                                                     tomo.dtype, **self.compress_args)
+                    out[:, :, c0:c1] = tomo
+                self.h5root.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return center
+
     def take_ownership(self):
         "claim ownership of file"
         if self.xrmmap is None:
@@ -2400,9 +2610,73 @@ class GSEXRM_MapFile(object):
             counts = mapdat['counts'][sy, sx, :]
 
         if dtcorrect and 'dtfactor' in mapdat.keys():
-            counts *= mapdat['dtfactor'][sy, sx].reshape(ny, nx, 1)
+            counts = counts*mapdat['dtfactor'][sy, sx].reshape(ny, nx, 1)
         return counts
 
+    def get_counts_area(self, area, mapdat=None, det=None, dtcorrect=None):
+        '''return counts summed over the pixels of an area mask,
+        optionally applying deadtime correction
+
+        Parameters
+        ---------
+        area :       ndarray   boolean area mask, same shape as map
+        mapdat :     optional, None or map data
+        det :        optional, None or int         index of detector
+        dtcorrect :  optional, bool [None]         dead-time correct data
+
+        Returns
+        -------
+        ndarray for XRF counts summed over area
+
+        Notes
+        -----
+        Only the HDF5 chunks of the counts dataset that intersect the
+        mask are read, and the sum is accumulated chunk by chunk, so
+        that a sparse or irregular area does not need the full bounding
+        rectangle of counts to be held in memory.
+
+        Note:  if mapdat is None, the map data is taken from the 'det' parameter
+        '''
+        if dtcorrect is None:
+            dtcorrect = self.dtcorrect
+        if mapdat is None:
+            mapdat = self._det_group(det)
+
+        dset = mapdat['counts']
+        dtfactor = None
+        if dtcorrect and 'dtfactor' in mapdat.keys():
+            dtfactor = mapdat['dtfactor']
+
+        ny, nx = dset.shape[0], dset.shape[1]
+        area = np.asarray(area, dtype=bool)[:ny, :nx]
+        total = np.zeros(dset.shape[2:], dtype=np.float64)
+        if not area.any():
+            return total
+
+        cy, cx = 1, nx
+        if dset.chunks is not None:
+            cy, cx = dset.chunks[:2]
+
+        _ay, _ax = np.where(area)
+        ymin, ymax, xmin, xmax = _ay.min(), _ay.max()+1, _ax.min(), _ax.max()+1
+        for y0 in range(cy*(ymin//cy), ymax, cy):
+            for x0 in range(cx*(xmin//cx), xmax, cx):
+                y1, x1 = min(y0+cy, ymax), min(x0+cx, xmax)
+                _cy, _cx = np.where(area[y0:y1, x0:x1])
+                if len(_cy) < 1:
+                    continue
+                # trim to the masked pixels within this chunk
+                sy = slice(y0 + _cy.min(), y0 + _cy.max()+1)
+                sx = slice(x0 + _cx.min(), x0 + _cx.max()+1)
+                amask = area[sy, sx]
+                counts = dset[sy, sx][amask]
+                if dtfactor is None:
+                    total += counts.sum(axis=0)
+                else:
+                    total += np.tensordot(dtfactor[sy, sx][amask], counts,
+                                          axes=(0, 0))
+        return total
+
     def get_mca_area(self, areaname, det=None, dtcorrect=None):
         '''return XRF spectra as MCA() instance for
         spectra summed over a pre-defined area
@@ -2416,6 +2690,11 @@ class GSEXRM_MapFile(object):
         -------
         MCA object for XRF counts in area
 
+        Notes
+        -----
+        summed spectra are kept in the area cache by area name, detector,
+        and dtcorrect, and are recomputed when the area mask or the map
+        data changes.
         '''
         try:
             area = self.get_area(areaname).value
@@ -2429,20 +2708,27 @@ class GSEXRM_MapFile(object):
 
         dgroup = self._det_name(det)
 
-        # first get data for bounding rectangle
-        _ay, _ax = np.where(area)
-        ymin, ymax, xmin, xmax = _ay.min(), _ay.max()+1, _ax.min(), _ax.max()+1
-
-        counts = self.get_counts_rect(ymin, ymax, xmin, xmax, det=det,
-                                      dtcorrect=dtcorrect)
-        ltime, rtime = self.get_livereal_rect(ymin, ymax, xmin, xmax, det=det,
-                                              dtcorrect=dtcorrect)
-        ltime = ltime[area[ymin:ymax, xmin:xmax]].sum()
-        rtime = rtime[area[ymin:ymax, xmin:xmax]].sum()
-        counts = counts[area[ymin:ymax, xmin:xmax]]
-        while(len(counts.shape) > 1):
-            counts = counts.sum(axis=0)
-        return self._getmca(dgroup, counts, areaname, npixels=npixels,
+        source = '%s_%s' % (dgroup, 'dtc' if dtcorrect else 'raw')
+        signature = self.area_signature(area, source,
+                                        self.xrmmap[dgroup]['counts'].shape)
+        counts, attrs = self.get_area_cache(areaname, source, signature)
+        if counts is not None:
+            ltime, rtime = attrs['live_time'], attrs['real_time']
+        else:
+            counts = self.get_counts_area(area, det=det, dtcorrect=dtcorrect)
+
+            _ay, _ax = np.where(area)
+            ymin, ymax, xmin, xmax = _ay.min(), _ay.max()+1, _ax.min(), _ax.max()+1
+            ltime, rtime = self.get_livereal_rect(ymin, ymax, xmin, xmax,
+                                                  det=det, dtcorrect=dtcorrect)
+            ltime = float(ltime[area[ymin:ymax, xmin:xmax]].sum())
+            rtime = float(rtime[area[ymin:ymax, xmin:xmax]].sum())
+            while(len(counts.shape) > 1):
+                counts = counts.sum(axis=0)
+            self.set_area_cache(areaname, source, signature, counts,
+                                live_time=ltime, real_time=rtime)
+
+        return self._getmca(dgroup, 1.0*counts, areaname, npixels=npixels,
                             real_time=rtime, live_time=ltime)
 
     def get_mca_rect(self, ymin, ymax, xmin, xmax, det=None, dtcorrect=None):
@@ -2606,21 +2892,19 @@ class GSEXRM_MapFile(object):
             return None
 
         stps, xpix, ypix, qdat = 0, 0, 0, None
-        sy, sx = [slice(min(_a), max(_a)+1) for _a in np.where(area)]
-        xmin, xmax, ymin, ymax = sx.start, sx.stop, sy.start, sy.stop
-        nx, ny = (xmax-xmin), (ymax-ymin)
 
         xrdgroup = 'xrd1d'
         mapdat = self.xrmmap[xrdgroup]
-        counts = self.get_counts_rect(ymin, ymax, xmin, xmax,
-                                      mapdat=mapdat, dtcorrect=False)
-        counts = counts[area[ymin:ymax, xmin:xmax]]
+        signature = self.area_signature(area, xrdgroup, mapdat['counts'].shape)
+        counts, attrs = self.get_area_cache(areaname, xrdgroup, signature)
+        if counts is None:
+            counts = self.get_counts_area(area, mapdat=mapdat, dtcorrect=False)
+            self.set_area_cache(areaname, xrdgroup, signature, counts)
 
         name = '%s: %s' % (xrdgroup, areaname)
         kws['energy'] = energy = 0.001 * self.get_incident_energy()
         kws['wavelength'] = lambda_from_E(energy, E_units='keV')
 
-        counts = counts.sum(axis=0)
         xrd = XRD(data1D=counts, steps=len(counts), name=name, **kws)
         if xrdgroup != 'xrd1d':
             xpix, ypix = counts.shape
@@ -2648,7 +2932,9 @@ class GSEXRM_MapFile(object):
 
         Notes
         ------
-        slow because it really reads from the raw XRD h5 files
+        slow because it really reads from the raw XRD h5 files,
+        so the summed pattern is kept in the area cache, and only
+        re-read when the area or the raw XRD files change.
         '''
         try:
             area = self.get_area(areaname).value
@@ -2658,7 +2944,7 @@ class GSEXRM_MapFile(object):
         npix = area.sum()
         if npix < 1:
             return None
-        
+
         xrdgroup = 'xrd2d'
         xrdgrp = ensure_subgroup('xrd2d', self.xrmmap, dtype='2DXRD')
 
@@ -2666,11 +2952,23 @@ class GSEXRM_MapFile(object):
         sy, sx = [slice(min(_a), max(_a)+1) for _a in np.where(area)]
         xmin, xmax, ymin, ymax = sx.start, sx.stop, sy.start, sy.stop
         nx, ny = (xmax-xmin), (ymax-ymin)
+
+        rowfiles = []
+        for yrow in range(ymin, ymax):
+            xrd_file = os.path.join(self.folder, self.rowdata[yrow][4])
+            if os.path.exists(xrd_file):
+                fstat = os.stat(xrd_file)
+                rowfiles.append((xrd_file, fstat.st_size, fstat.st_mtime))
+        signature = self.area_signature(area, xrdgroup, rowfiles)
+        data, attrs = self.get_area_cache(areaname, xrdgroup, signature)
+
         xrd_file = os.path.join(self.folder, self.rowdata[0][4])
-        if os.path.exists(xrd_file):
+        if data is None and os.path.exists(xrd_file):
             print("Reading XRD Patterns for rows %d to %d" %(ymin, ymax))
             data = None
-            for yrow in range(ymin, ymax+1):
+            for yrow in range(ymin, ymax):
+                if not area[yrow].any():
+                    continue
                 xrd_file = os.path.join(self.folder, self.rowdata[yrow][4])
                 print("row ", yrow)
                 h5file = h5py.File(xrd_file, 'r')
@@ -2683,6 +2981,8 @@ class GSEXRM_MapFile(object):
                     data = rowdat
                 else:
                     data += rowdat
+            if data is not None:
+                self.set_area_cache(areaname, xrdgroup, signature, data)
 
         name = '%s: %s' % (xrdgroup, areaname)
         kws = {}
@@ -2848,6 +3148,7 @@ class GSEXRM_MapFile(object):
         roiname = h5str(roiname)
         if roiname in roigrp_xrd1d:
             del roigrp_xrd1d[roiname]
+            self.roimap_cache.clear()
             self.h5root.flush()
 
 
@@ -2859,6 +3160,7 @@ class GSEXRM_MapFile(object):
         ds['limits'].attrs['type']  = dtype
         ds['limits'].attrs['units'] = units
 
+        self.roimap_cache.clear()
         self.h5root.flush()
 
     def build_mca_roimap(self):
@@ -3017,12 +3319,47 @@ class GSEXRM_MapFile(object):
         if dtcorrect is None:
             dtcorrect = self.dtcorrect
 
-        nrow, ncol, npos = self.xrmmap['positions']['pos'].shape
-        out = np.zeros((nrow, ncol))
-
         det = self._det_name(det)
         dtcorrect = dtcorrect and ('mca' in det or 'det' in det)
 
+        key = (roiname, det, dtcorrect, hotcols, zigzag)
+        out = self._get_cached_roimap(key)
+        if out is None:
+            out = self._get_roimap(roiname, det, hotcols, zigzag, dtcorrect)
+            self._set_cached_roimap(key, out)
+        return out.copy()
+
+    def _roimap_stamp(self):
+        "state of the map file used to validate cached ROI maps"
+        try:
+            mtime = os.stat(self.filename).st_mtime
+        except (OSError, TypeError):
+            mtime = 0
+        return (self.last_row, mtime)
+
+    def _get_cached_roimap(self, key):
+        "return ROI map from the LRU cache, or None"
+        cached = self.roimap_cache.get(key, None)
+        if cached is None:
+            return None
+        if cached[0] != self._roimap_stamp():
+            self.roimap_cache.pop(key)
+            return None
+        self.roimap_cache.move_to_end(key)
+        return cached[1]
+
+    def _set_cached_roimap(self, key, out):
+        "save ROI map to the LRU cache"
+        self.roimap_cache[key] = (self._roimap_stamp(), out)
+        self.roimap_cache.move_to_end(key)
+        while len(self.roimap_cache) > ROIMAP_CACHESIZE:
+            self.roimap_cache.popitem(last=False)
+
+    def _get_roimap(self, roiname, det, hotcols, zigzag, dtcorrect):
+        "read ROI map from file, see get_roimap()"
+        nrow, ncol, npos = self.xrmmap['positions']['pos'].shape
+        out = np.zeros((nrow, ncol))
+
         if roiname == '1' or roiname == 1:
             out = np.ones((nrow, ncol))
             if hotcols:
@@ -3066,6 +3403,97 @@ class GSEXRM_MapFile(object):
             out = out[:, 1:-1]
         return out
 
+    def get_roimaps(self, roinames, dets=None, hotcols=None, zigzag=None,
+                    dtcorrect=None, as_dict=False):
+        '''extract roi maps for several ROIs and detectors at once
+
+        Parameters
+        ---------
+        roinames   :  str or list of str      ROI names
+        dets       :  detector name or list of detector names [None]
+        dtcorrect  :  optional, bool [None]   dead-time correct data
+        hotcols    :  optional, bool [None]   suppress hot columns
+        as_dict    :  optional, bool [False]  return dict instead of array
+
+        Returns
+        -------
+        ndarray of shape (len(roinames), len(dets), nrow, ncol) of ROI data,
+        or, with as_dict=True, a dict with keys (roiname, det)
+
+        Notes
+        -----
+        This reads the same data as get_roimap().  For version 2.1 map
+        files, ROI maps whose 'roimap/<det>/<roi>/raw' (or 'cor') dataset
+        has not yet been filled for the whole map are read from the
+        columns of 'roimap/det_raw', 'roimap/det_cor', 'roimap/sum_raw',
+        or 'roimap/sum_cor', as in get_roimap(), but with a single read
+        per dataset and without writing back to the per-ROI datasets.
+        Other ROI maps use get_roimap().  Recently read maps are cached.
+        '''
+        if hotcols is None:
+            hotcols = self.hotcols
+        if zigzag is None:
+            zigzag = self.zigzag
+        if dtcorrect is None:
+            dtcorrect = self.dtcorrect
+        if isinstance(roinames, (str, int)):
+            roinames = [roinames]
+        if dets is None or isinstance(dets, (str, int)):
+            dets = [dets]
+
+        nrow, ncol, npos = self.xrmmap['positions']['pos'].shape
+        out = {}
+        slabs = {}
+        for det in dets:
+            detname = self._det_name(det)
+            dtc = dtcorrect and ('mca' in detname or 'det' in detname)
+            for roiname in roinames:
+                key = (roiname, detname, dtc, hotcols, zigzag)
+                cached = self._get_cached_roimap(key)
+                if cached is not None:
+                    out[(roiname, det)] = cached.copy()
+                    continue
+                addr = None
+                if (version_ge(self.version, '2.1.0') and roiname not in ('1', 1)
+                    and detname not in EXTRA_DETGROUPS):
+                    try:
+                        roi, detaddr = self.check_roi(roiname, detname)
+                        if detaddr.startswith('roimap'):
+                            roiaddr = '%s/%s' % (roi, 'cor' if dtc else 'raw')
+                            if self.xrmmap[detaddr][roiaddr].shape != (nrow, ncol):
+                                addr = self.check_roi(roiname, detname,
+                                                      version='1.0.0')
+                    except (ValueError, KeyError, AttributeError, TypeError):
+                        addr = None
+                if addr is None:
+                    out[(roiname, det)] = self.get_roimap(roiname, det=det,
+                                                          hotcols=hotcols,
+                                                          zigzag=zigzag,
+                                                          dtcorrect=dtcorrect)
+                    continue
+                iroi, detaddr = addr
+                dsetname = '%s%s' % (detaddr, 'cor' if dtc else 'raw')
+                if dsetname not in slabs:
+                    slabs[dsetname] = []
+                slabs[dsetname].append((int(iroi), (roiname, det), key))
+
+        for dsetname, items in slabs.items():
+            index = sorted(set([item[0] for item in items]))
+            data = self.xrmmap[dsetname][:nrow, :ncol, index]
+            for iroi, outkey, key in items:
+                rmap = data[:, :, index.index(iroi)]
+                if zigzag is not None and zigzag != 0:
+                    rmap = remove_zigzag(rmap, zigzag)
+                elif hotcols:
+                    rmap = rmap[:, 1:-1]
+                self._set_cached_roimap(key, rmap)
+                out[outkey] = rmap.copy()
+
+        if as_dict:
+            return out
+        return np.array([[out[(roiname, det)] for det in dets]
+                         for roiname in roinames])
+
 
     def get_mca_erange(self, det=None, dtcorrect=None,
                        emin=None, emax=None, by_energy=True):
@@ -3172,6 +3600,12 @@ class GSEXRM_MapFile(object):
         roi_names.pop(iroi)
 
 
+def _tomo_recon_slab(sino, omega=None, center=None, **kws):
+    """reconstruct a slab of sinograms, returning center, tomograph
+    (module-level for use with multiprocessing)
+    """
+    return tomo_reconstruction(sino, omega, center=center, **kws)
+
 def read_xrmmap(filename, root=None, **kws):
     '''read GSE XRF FastMap data from HDF5 file or raw map folder'''
     key = 'filename'
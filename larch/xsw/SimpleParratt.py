@@ -92,13 +92,13 @@ class Layer:
 
 def reflectivity(eV0=14000.0, th_deg=[], mat=[], thick=[], den=[], rough=[], tag=[],  depths=[], xsw_mode=0):
 #   --------------------set default values------------------------
-    if th_deg==[]:  # set default th list
+    if len(th_deg)==0:  # set default th list
         th_min=0.0         # minimum th
         th_max=1.0          # maximum th
         th_step=0.002      # stepsize th
         th_deg = np.arange(th_min, th_max+th_step, th_step)
-        th=[]               #   theta(incident angle) in radian
-        qz=[]               #   momentum transfer (1/Angstrom)
+    th=[]               #   theta(incident angle) in radian
+    qz=[]               #   momentum transfer (1/Angstrom)
     if mat==[] or thick==[] or den==[] or rough==[]:
     #set defalut layer material, air, film1, film2, substrate
         tag=['air', 'film', 'underlayer', 'substrate']
@@ -212,6 +212,87 @@ def reflectivity(eV0=14000.0, th_deg=[], mat=[], thick=[], den=[], rough=[], tag
     return ListOut  #list of [[th1, refl1], [th2, refl2] ...]
 
 
+def parratt(eV0=14000.0, th_deg=None, mat=None, thick=None, den=None,
+            rough=None, tag=None, depths=None):
+    """Parratt reflectivity and E-field intensity of a multilayer, computed
+    for all incident angles and depths at once, without writing any file.
+
+    Arguments are as for reflectivity(), with the same default Pt/Cr/Si stack.
+    Within each layer, the E-field is the sum of transmitted and reflected
+    waves referenced to the bottom of the layer (top of the substrate).
+
+    Returns
+    -------
+    th_deg : 1D array (n_theta) incident angles in degrees
+    refl   : 1D array (n_theta) reflected intensity
+    efi    : 2D array (n_theta, n_depth) E-field intensity at each depth,
+             depth=0 being the surface, depth<0 above the film.
+    """
+    if th_deg is None or len(th_deg) == 0:
+        th_deg = np.arange(0.0, 1.002, 0.002)
+    if mat is None or thick is None or den is None or rough is None:
+        tag = ['air', 'film', 'underlayer', 'substrate']
+        mat = ['N1.56O0.48C0.03Ar0.01Kr0.000001Xe0.0000009', 'Pt', 'Cr', 'Si']
+        thick = [0., 200., 50., 10000]
+        den = [1.e-10, 21.45, 7.19, 2.33]
+        rough = [1.0, 1.0, 1.0, 1.0]
+    if tag is None:
+        tag = ['layer%d' % i for i in range(len(mat))]
+    if depths is None:
+        depths = [0.0]
+    th_deg = np.asarray(th_deg, dtype=float)
+    depths = np.atleast_1d(np.asarray(depths, dtype=float))
+
+    nlayers = len(thick)
+    delta, beta, rms = np.zeros(nlayers), np.zeros(nlayers), np.zeros(nlayers)
+    for ix in range(nlayers):
+        layer = Layer(tag[ix], mat[ix], den[ix])
+        layer.set_DenThickRms(1.0, thick[ix], rough[ix])
+        layer.get_index(eV0)
+        delta[ix], beta[ix] = layer.delta, layer.beta
+        rms[ix] = rough[ix] if rough[ix] != 0 else 1e-9
+    thick = np.asarray(thick, dtype=float)
+    interface = np.cumsum(thick)        # depth of bottom of each layer
+
+    k0 = 2.*math.pi/(12.39842/(eV0/1000.0))
+    sin_th = np.sin(th_deg*math.pi/180.0)[:, None]
+    # wavenumber, Fresnel and roughness-corrected coefficients, (n_theta, n_layers)
+    kz = k0*np.sqrt(sin_th**2 - 2.0*delta - 2.0j*beta + 0j)
+    kz = kz.real + 1.0j*abs(kz.imag)
+    kz0, kz1 = kz[:, :-1], kz[:, 1:]
+    rf = (kz0-kz1)/(kz0+kz1) * np.exp(-2.0*kz0*kz1*rms[:-1])
+    tf = rf + 1.0
+
+    # reflectivity, recursing up from the substrate
+    rrr = np.zeros(kz.shape, dtype=complex)
+    rrr[:, nlayers-2] = rf[:, nlayers-2]
+    for ix in range(nlayers-3, -1, -1):
+        phase = np.exp(2.0j*kz[:, ix+1]*thick[ix+1])
+        rrr[:, ix] = ((rrr[:, ix+1]*phase + rf[:, ix]) /
+                      (1.0 + rf[:, ix]*rrr[:, ix+1]*phase))
+    refl = abs(rrr[:, 0])**2
+
+    # transmission, recursing down from the surface
+    e_t = np.zeros(kz.shape, dtype=complex)
+    e_t[:, 0] = 1.0
+    for ix in range(1, nlayers-1):
+        e_t[:, ix] = (tf[:, ix-1]*e_t[:, ix-1]*np.exp(1.0j*thick[ix]*kz[:, ix]) /
+                      (1.0 + rf[:, ix-1]*rrr[:, ix]*np.exp(2.0j*thick[ix]*kz[:, ix])))
+    e_r = e_t*rrr
+    e_t[:, nlayers-1] = tf[:, nlayers-2]*e_t[:, nlayers-2]
+    e_r[:, nlayers-1] = 0.0
+
+    # E-field intensity on the (n_theta, n_depth) grid
+    zref = interface.copy()
+    zref[nlayers-1] = interface[nlayers-2]
+    ilayer = np.searchsorted(interface[:-1], depths, side='left')
+    dist = zref[ilayer] - depths
+    cph = kz[:, ilayer]*dist
+    etot = e_t[:, ilayer]*np.exp(-1.0j*cph) + e_r[:, ilayer]*np.exp(1.0j*cph)
+    efi = etot.real**2 + etot.imag**2
+    return th_deg, refl, efi
+
+
 
 
 if __name__=='__main__':
@@ -48,7 +48,7 @@ import math
 import numpy
 import sys
 from larch.utils.physical_constants import AVOGADRO, BARN
-from larch.xray import xray_delta_beta, chemparse
+from larch.xray import xray_delta_beta, chemparse, atomic_mass, atomic_number
 
 pre_edge_margin=150.    # FY calculated from 150 eV below the absorption edge.
 fluo_emit_min=500.      # minimum energy for emitted fluorescence.  ignore fluorescence emissions below 500eV
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+tests of cauchy_wavelet_stack, comparing to cauchy_wavelet for each spectrum
+"""
+import os
+import unittest
+import importlib
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import cauchy_wavelet_stack, cauchy_wavelet
+
+# module, as larch.xafs.cauchy_wavelet is the function
+cauchy_module = importlib.import_module('larch.xafs.cauchy_wavelet')
+
+XAFSDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples', 'xafsdata')
+
+def make_stack(nspectra=5):
+    "scaled and noisy copies of Cu chi(k)"
+    dat = read_ascii(os.path.join(XAFSDATA, 'cu_chi.dat'))
+    k, chi = dat.k, dat.chi_k
+    rng = np.random.RandomState(4)
+    stack = [(1+0.1*i)*chi + rng.normal(scale=0.01, size=len(k))
+             for i in range(nspectra)]
+    return k, np.array(stack)
+
+class CauchyWaveletStackTest(unittest.TestCase):
+    def setUp(self):
+        self.k, self.stack = make_stack()
+        self.maxmem = cauchy_module.MAXMEM
+
+    def tearDown(self):
+        cauchy_module.MAXMEM = self.maxmem
+
+    def compare(self, **kws):
+        r, out = cauchy_wavelet_stack(self.k, self.stack, **kws)
+        self.assertEqual(out.shape, (len(self.stack), len(r), len(self.k)))
+        for i, chi in enumerate(self.stack):
+            grp = Group()
+            cauchy_wavelet(self.k, chi, group=grp, **kws)
+            assert_allclose(r, grp.r)
+            assert_allclose(out[i], grp.wcauchy, rtol=1.e-10, atol=1.e-12)
+        return out
+
+    def test_stack(self):
+        self.compare(kweight=2)
+        self.compare(kweight=1, rmax_out=6, rstep=0.1)
+
+    def test_chunks(self):
+        full = self.compare(kweight=2)
+        # 2 spectra and 1 R row at a time
+        cauchy_module.MAXMEM = 2*(2*2048*16)
+        chunked = self.compare(kweight=2)
+        assert_allclose(chunked, full, rtol=1.e-12, atol=1.e-14)
+        # 1 spectrum at a time, 3 R rows at a time
+        cauchy_module.MAXMEM = 3*(2*2048*16) + 100
+        r, out = cauchy_wavelet_stack(self.k, self.stack[:1], kweight=2)
+        assert_allclose(out[0], full[0], rtol=1.e-12, atol=1.e-14)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (CauchyWaveletStackTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
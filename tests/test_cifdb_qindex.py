@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+tests of the sparse q-peak index of the cif database (QPeakIndex),
+compared to dense scoring of q arrays
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.xrd.cifdb import (cifDB, QPeakIndex, QAXIS, QSTEP,
+                             QINDEX_SUFFIX)
+from larch.xrd.xrd_cif import HAS_CifFile
+
+# q axis as stored in the database, with values rounded to 0.01
+AXIS = np.round(QAXIS, 2)
+
+CIFDB = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                     '..', 'larch', 'xrd', 'amcsd_cif.db')
+
+def make_qarrays(nstruct=40, seed=5):
+    "random q arrays (0 or 1 for each bin of AXIS)"
+    rng = np.random.RandomState(seed)
+    rows = []
+    for i in range(nstruct):
+        qarr = np.zeros(len(AXIS), dtype=int)
+        qarr[rng.choice(len(AXIS), rng.randint(5, 60), replace=False)] = 1
+        rows.append((1000+3*i, qarr))
+    return rows
+
+def dense_search(rows, peaks, qstep=QSTEP):
+    "scores (score, amcsd_id, total, matched, missed), from dense arrays"
+    ibin = np.arange(len(AXIS))
+    nbins = len(AXIS)
+    if qstep > QSTEP:
+        new_qaxis = np.arange(AXIS.min(), AXIS.max()+QSTEP, qstep)
+        ibin = np.abs(new_qaxis[np.newaxis, :] - AXIS[:, np.newaxis]).argmin(axis=1)
+        qaxis, nbins = new_qaxis, len(new_qaxis)
+    else:
+        qaxis = AXIS
+    peaks_true = np.zeros(nbins, dtype=int)
+    for p in peaks:
+        peaks_true[np.abs(qaxis - p).argmin()] = 1
+    out = []
+    for amcsd_id, qarr in rows:
+        merged = np.zeros(nbins, dtype=int)
+        merged[ibin[np.where(qarr == 1)[0]]] = 1
+        total = merged.sum()
+        match = (merged*peaks_true).sum()
+        out.append((match - (total-match), amcsd_id, total, match, total-match))
+    return sorted(out, reverse=True)
+
+class QPeakIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.rows = make_qarrays()
+        self.index = QPeakIndex.from_qarrays(AXIS, self.rows, signature=(40, 7))
+        self.peaks = np.random.RandomState(1).uniform(1.0, 6.0, 20)
+
+    def test_build(self):
+        self.assertEqual(self.index.matrix.shape, (len(AXIS), len(self.rows)))
+        self.assertEqual(list(self.index.amcsd), [r[0] for r in self.rows])
+        dense = np.array([r[1] for r in self.rows]).T
+        assert_allclose(self.index.matrix.toarray(), dense)
+        empty = QPeakIndex.from_qarrays(AXIS, [])
+        self.assertEqual(empty.matrix.shape, (len(AXIS), 0))
+
+    def test_add(self):
+        index = QPeakIndex.from_qarrays(AXIS, self.rows[:30])
+        for amcsd_id, qarr in self.rows[30:]:
+            index.add(amcsd_id, qarr)
+        # replace one already in the matrix, and one that is still pending
+        new5 = self.rows[5][1][::-1]
+        new35 = self.rows[35][1][::-1]
+        index.add(self.rows[5][0], new5)
+        index.add(self.rows[35][0], new35)
+        self.assertEqual(len(index._pending), 11)
+
+        rows = self.rows[:5] + self.rows[6:35] + self.rows[36:]
+        rows = rows[:34] + [(self.rows[35][0], new35)] + rows[34:]
+        rows.append((self.rows[5][0], new5))
+        self.assertEqual(list(index.amcsd), [r[0] for r in rows])
+        self.assertEqual(len(index._pending), 0)
+        assert_allclose(index.matrix.toarray(), np.array([r[1] for r in rows]).T)
+
+    def test_search(self):
+        for qstep in (QSTEP, 0.05):
+            expected = dense_search(self.rows, self.peaks, qstep=qstep)
+            result = self.index.search(self.peaks, qstep=qstep)
+            self.assertEqual(result, expected)
+            self.assertEqual(self.index.search(self.peaks, qstep=qstep, top=5),
+                             expected[:5])
+        ids = [r[0] for r in self.rows[::3]]
+        result = self.index.search(self.peaks, ids=ids)
+        self.assertEqual(result, dense_search(self.rows[::3], self.peaks))
+
+    def test_npz(self):
+        self.index.add(5000, self.rows[0][1])
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, 'test' + QINDEX_SUFFIX)
+            self.index.save(fname)
+            index = QPeakIndex.read(fname)
+        finally:
+            shutil.rmtree(tmpdir)
+        self.assertEqual(index.signature, (40, 7))
+        assert_allclose(index.axis, AXIS)
+        assert_allclose(index.amcsd, self.index.amcsd)
+        assert_allclose(index.matrix.toarray(), self.index.matrix.toarray())
+
+class CifDBQIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dbname = os.path.join(self.tmpdir, 'amcsd_cif.db')
+        shutil.copy(CIFDB, self.dbname)
+        self.sidecar = self.dbname + QINDEX_SUFFIX
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stale_signature(self):
+        cifdb = cifDB(self.dbname)
+        qindex = cifdb.get_qindex()
+        self.assertTrue(os.path.exists(self.sidecar))
+        signature = cifdb.qindex_signature()
+        self.assertEqual(qindex.signature, signature)
+
+        # sidecar with wrong signature is rebuilt
+        stale = QPeakIndex(AXIS, signature=(1, 2))
+        stale.save(self.sidecar)
+        cifdb = cifDB(self.dbname)
+        qindex2 = cifdb.get_qindex()
+        self.assertEqual(qindex2.signature, signature)
+        assert_allclose(qindex2.matrix.toarray(), qindex.matrix.toarray())
+        self.assertEqual(QPeakIndex.read(self.sidecar).signature, signature)
+
+        # up-to-date sidecar is read, and in-memory index is reused
+        cifdb = cifDB(self.dbname)
+        self.assertEqual(cifdb.get_qindex().signature, signature)
+        self.assertIs(cifdb.get_qindex(), cifdb.qindex)
+
+    @unittest.skipUnless(HAS_CifFile, 'PyCifRW not installed')
+    def test_add_ciffile(self):
+        cifdb = cifDB(self.dbname)
+        amcsd_id = int(cifdb.get_qindex().amcsd[0])
+        ciftext = cifdb.return_cif(amcsd_id)
+        ciftext = ciftext.replace('%07d' % amcsd_id, '%07d' % 99001)
+        ciffile = os.path.join(self.tmpdir, 'new.cif')
+        with open(ciffile, 'w') as fh:
+            fh.write(ciftext)
+        qindex = cifdb.get_qindex()
+        mtime = os.stat(self.sidecar).st_mtime_ns
+        cifdb.add_ciffile(ciffile, save_qindex=False)
+        # updated in place, without rebuilding, and not yet saved
+        self.assertIs(cifdb.get_qindex(), qindex)
+        self.assertEqual(qindex.signature, cifdb.qindex_signature())
+        self.assertEqual(qindex.amcsd[-1], 99001)
+        self.assertEqual(os.stat(self.sidecar).st_mtime_ns, mtime)
+        cifdb.save_qindex()
+        self.assertEqual(QPeakIndex.read(self.sidecar).signature,
+                         cifdb.qindex_signature())
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (QPeakIndexTest, CifDBQIndexTest):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
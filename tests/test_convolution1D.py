@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+tests of energy-dependent broadening in larch.math.convolution1D,
+compared to direct quadrature of the broadening integral
+"""
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.integrate import quad
+
+from larch.math.convolution1D import conv, lin_gamma, atan_gamma
+
+def spectrum(x):
+    return (1.0/(1+np.exp(-(x-7150.0)/3.0)) +
+            0.5*np.exp(-(x-7130.0)**2/8.0) + 0.001*(x-7100.0))
+
+def kernel_shape(kernel, dx, hwhm):
+    if kernel == 'gaussian':
+        return np.exp(-(dx/hwhm)**2/2.0)
+    return 1.0/(1.0 + (dx/hwhm)**2)
+
+def quad_conv(x0, fwhm, kernel):
+    """broadening integral at x0, with the kernel (of width parameter fwhm/2)
+    truncated at +/- 1.5*fwhm and normalized to unit area"""
+    hwhm, lim = fwhm/2.0, 1.5*fwhm
+    num = quad(lambda x: spectrum(x)*kernel_shape(kernel, x-x0, hwhm),
+               x0-lim, x0+lim, epsabs=1.e-12)[0]
+    den = quad(lambda x: kernel_shape(kernel, x-x0, hwhm),
+               x0-lim, x0+lim, epsabs=1.e-12)[0]
+    return num/den
+
+class ConvolutionTest(unittest.TestCase):
+    def setUp(self):
+        self.energy = np.linspace(7050, 7350, 6001)
+        self.mu = spectrum(self.energy)
+        self.widths = {'lin': lin_gamma(self.energy, fwhm=1.0,
+                                        linbroad=[6.0, 7140, 7200]),
+                       'atan': atan_gamma(self.energy, 1.5, gamma_max=6,
+                                          e0=7160, eslope=10)}
+
+    def check_quadrature(self, kernel):
+        ipts = np.arange(500, 5000, 250)
+        for fwhm_e in self.widths.values():
+            out = conv(self.energy, self.mu, kernel=kernel, fwhm_e=fwhm_e)
+            self.assertEqual(out.shape, self.mu.shape)
+            for i in ipts:
+                expected = quad_conv(self.energy[i], fwhm_e[i], kernel)
+                assert_allclose(out[i], expected, atol=1.e-3)
+
+    def test_gaussian(self):
+        self.check_quadrature('gaussian')
+
+    def test_lorentzian(self):
+        self.check_quadrature('lorentzian')
+
+    def test_batch(self):
+        fwhm_e = self.widths['atan']
+        stack = np.array([self.mu*(1+0.1*i) for i in range(4)])
+        single = conv(self.energy, self.mu, fwhm_e=fwhm_e)
+        batch = conv(self.energy, stack, fwhm_e=fwhm_e)
+        self.assertEqual(batch.shape, stack.shape)
+        assert_allclose(batch[2], 1.2*single, rtol=1.e-10)
+        # RIXS-like plane, broadened along axis 0
+        plane = conv(self.energy, stack.T, fwhm_e=fwhm_e, axis=0)
+        assert_allclose(plane, batch.T, rtol=1.e-12)
+
+    def test_efermi(self):
+        fwhm_e = self.widths['lin']
+        out = conv(self.energy, self.mu, fwhm_e=fwhm_e, efermi=7120.0)
+        ief = np.argmin(np.abs(self.energy-7120.0))
+        mu = 1.0*self.mu
+        mu[:ief] = 0
+        assert_allclose(out, conv(self.energy, mu, fwhm_e=fwhm_e), rtol=1.e-12)
+        self.assertTrue(abs(out[:ief-100]).max() < 1.e-12)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (ConvolutionTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
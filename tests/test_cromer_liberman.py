@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+tests of batched Cromer-Liberman f1, f2 and the FFT Lorentzian convolution,
+compared to direct convolution of values on an extended energy grid
+"""
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.signal import convolve
+
+from larch.xray import cromer_liberman as cl
+from larch.xray import core_width
+
+try:
+    cl._cl_f1f2(29, np.array([9000.0]))
+    HAS_CLLIB = True
+except Exception:
+    HAS_CLLIB = False
+
+def f1f2_direct(z, en, width=None):
+    """f1, f2 for one element, with the raw values on an extended energy
+    grid convolved directly with a Lorentzian"""
+    if width is None:
+        return cl._cl_f1f2(z, en)
+    e_extra = int(width*80.0)
+    estep = (en[1:] - en[:-1]).min()
+    emin, emax = min(en) - e_extra, max(en) + e_extra
+    egrid = np.linspace(emin, emax, int(1 + (emax-emin+estep*0.02)/estep))
+    nk = int(e_extra / estep)
+    sig = width/2.0
+    lor = (1./(1 + ((np.arange(2*nk+1)-nk*1.0)/sig)**2))/(np.pi*sig)
+    f1, f2 = cl._cl_f1f2(z, egrid)
+    return (np.interp(en, egrid, convolve(f1, lor)[nk:-nk])/lor.sum(),
+            np.interp(en, egrid, convolve(f2, lor)[nk:-nk])/lor.sum())
+
+class LorentzianConvolveTest(unittest.TestCase):
+    def test_convolve(self):
+        en = np.linspace(8800, 9300, 1001)
+        ydat = np.array([np.sin(en/50.0) + (en > 8979),
+                         np.cos(en/70.0) + 3*(en > 8979)])
+        for width in (0.3, 1.5, 4.0):
+            emin, emax, npts, estep = cl._extended_grid(en, width)
+            self.assertIsInstance(npts, int)
+            nk = int(int(width*80.0) / estep)
+            sig = width/2.0
+            lor = (1./(1 + ((np.arange(2*nk+1)-nk*1.0)/sig)**2))/(np.pi*sig)
+            out = cl._convolve_lorentzian(ydat, width, estep)
+            for y, yconv in zip(ydat, out):
+                expected = convolve(y, lor)[nk:-nk]/lor.sum()
+                assert_allclose(yconv, expected, rtol=1.e-10, atol=1.e-12)
+
+@unittest.skipUnless(HAS_CLLIB, 'Cromer-Liberman library not available')
+class F1F2BatchTest(unittest.TestCase):
+    def test_batch(self):
+        en = np.linspace(6000, 9500, 701)
+        zvals = [26, 'Ni', 29]
+        for width in (None, 1.0):
+            f1, f2 = cl.f1f2_batch(zvals, en, width=width)
+            self.assertEqual(f1.shape, (3, len(en)))
+            for i, z in enumerate((26, 28, 29)):
+                f1z, f2z = f1f2_direct(z, en, width=width)
+                assert_allclose(f1[i], f1z, rtol=1.e-8, atol=1.e-10)
+                assert_allclose(f2[i], f2z, rtol=1.e-8, atol=1.e-10)
+            # single element, and repeated call from cached values
+            for _ in range(2):
+                f1z, f2z = cl.f1f2(29, en, width=width)
+                assert_allclose(f1z, f1[2], rtol=1.e-12)
+                assert_allclose(f2z, f2[2], rtol=1.e-12)
+
+    def test_edges(self):
+        en = np.linspace(8800, 9300, 501)
+        f1, f2 = cl.f1f2_batch([29, 30], en, edge=['K', 'K'])
+        for i, z in enumerate((29, 30)):
+            f1z, f2z = f1f2_direct(z, en, width=core_width(element=z, edge='K'))
+            assert_allclose(f1[i], f1z, rtol=1.e-8, atol=1.e-10)
+            assert_allclose(f2[i], f2z, rtol=1.e-8, atol=1.e-10)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (LorentzianConvolveTest, F1F2BatchTest):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
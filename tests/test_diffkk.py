@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+tests of differential Kramers-Kronig transforms in larch.xafs.diffkk,
+comparing the FFT forms to the scalar and vector MacLaurin series forms
+for Lorentzian line shapes
+"""
+import os
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.io import read_ascii
+from larch.xafs.diffkk import (kkmclf_sca, kkmclr_sca, kkmclf, kkmclr,
+                               kkmclf_fft, kkmclr_fft, diffkk_batch,
+                               diffkk)
+
+XAFSDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples', 'xafsdata')
+
+def lorentzian(x, center=9000.0, gamma=5.0):
+    return gamma/((x-center)**2 + gamma**2)
+
+class DiffKKTest(unittest.TestCase):
+    def setUp(self):
+        self.energy = np.linspace(8500, 9500, 1000)
+        self.fpp = lorentzian(self.energy)
+
+    def assert_close(self, actual, expected, rtol=1.e-9):
+        expected = np.asarray(expected)
+        scale = abs(expected).max()
+        self.assertTrue(abs(actual - expected).max() < rtol*scale)
+
+    def test_reverse(self):
+        fp = kkmclr_fft(self.energy, self.fpp)
+        self.assertEqual(fp.shape, self.fpp.shape)
+        self.assert_close(fp, kkmclr_sca(self.energy, self.fpp))
+        self.assert_close(fp, kkmclr(self.energy, self.fpp))
+
+    def test_forward(self):
+        fpp = kkmclf_fft(self.energy, self.fpp)
+        self.assert_close(fpp, kkmclf_sca(self.energy, self.fpp))
+        self.assert_close(fpp, kkmclf(self.energy, self.fpp))
+
+    def test_stack(self):
+        centers = np.linspace(8700, 9300, 7)
+        stack = np.array([lorentzian(self.energy, c, 2+i)
+                          for i, c in enumerate(centers)])
+        fp = kkmclr_fft(self.energy, stack)
+        self.assertEqual(fp.shape, stack.shape)
+        for i, fpp in enumerate(stack):
+            self.assert_close(fp[i], kkmclr(self.energy, fpp))
+
+        batch = diffkk_batch(self.energy, stack)
+        vector = diffkk_batch(self.energy, stack, how='vector')
+        self.assertEqual(batch.shape, stack.shape)
+        self.assert_close(batch, vector)
+
+    def test_damped_oscillator(self):
+        # f' and f'' of chi = 1/(w0^2 - w^2 - i g w) are a KK pair
+        w = np.linspace(0, 200, 20000)
+        chi = 1.0/(50.0**2 - w**2 - 2.0j*w)
+        fp = kkmclr_fft(w, chi.imag)
+        self.assert_close(fp, -chi.real, rtol=1.e-3)
+
+class DiffKKGroupTest(unittest.TestCase):
+    def test_kk(self):
+        dat = read_ascii(os.path.join(XAFSDATA, 'cu_metal_rt.xdi'))
+        out = {}
+        for how in ('vector', 'fft'):
+            dkk = diffkk(dat.energy, dat.mutrans, z=29, edge='K',
+                         mback_kws={'e0': 8979, 'order': 4})
+            dkk.kk(how=how)
+            self.assertEqual(dkk.fp.shape, dat.energy.shape)
+            self.assertTrue(dkk.time_elapsed >= 0)
+            out[how] = dkk.fp
+        scale = abs(out['vector']).max()
+        self.assertTrue(abs(out['fft'] - out['vector']).max() < 1.e-9*scale)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (DiffKKTest, DiffKKGroupTest):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
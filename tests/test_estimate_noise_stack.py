@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+tests of estimate_noise_stack, comparing to estimate_noise for each spectrum
+"""
+import os
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Interpreter, Group
+from larch.io import read_ascii
+from larch.xafs import autobk, estimate_noise, estimate_noise_stack
+
+XAFSDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples', 'xafsdata')
+
+def make_stack(session, nspectra=10):
+    "scaled copies of Cu foil chi(k) with increasing noise"
+    dat = read_ascii(os.path.join(XAFSDATA, 'cu_metal_rt.xdi'))
+    dat.mu = dat.mutrans
+    autobk(dat, rbkg=1.0, kweight=2, _larch=session)
+    rng = np.random.RandomState(1)
+    stack = [dat.chi*(1+0.1*i) + rng.normal(scale=0.001*(i+1), size=len(dat.k))
+             for i in range(nspectra)]
+    return dat.k, np.array(stack)
+
+class EstimateNoiseStackTest(unittest.TestCase):
+    def setUp(self):
+        self.session = Interpreter()
+        self.k, self.stack = make_stack(self.session)
+
+    def compare(self, ks, chis, out, **kws):
+        for i, (k, chi) in enumerate(zip(ks, chis)):
+            grp = Group()
+            estimate_noise(k, chi, group=grp, _larch=self.session, **kws)
+            assert_allclose(out.epsilon_k[i], grp.epsilon_k, rtol=1.e-10)
+            assert_allclose(out.epsilon_r[i], grp.epsilon_r, rtol=1.e-10)
+            assert_allclose(out.kmax_suggest[i], grp.kmax_suggest)
+
+    def test_stack(self):
+        for kws in ({}, {'kweight': 2, 'kmax': 16},
+                    {'kmin': 2, 'kmax': 14, 'dk': 2, 'kwindow': 'hanning'}):
+            out = estimate_noise_stack(self.k, self.stack, **kws)
+            self.assertEqual(out.epsilon_k.shape, (len(self.stack),))
+            self.compare([self.k]*len(self.stack), self.stack, out, **kws)
+
+    def test_ragged(self):
+        ks = [self.k[10:200+15*i] for i in range(len(self.stack))]
+        chis = [chi[10:200+15*i] for i, chi in enumerate(self.stack)]
+        out = estimate_noise_stack(ks, chis, kmax=12)
+        self.compare(ks, chis, out, kmax=12)
+
+        chis = [chi[:200+15*i] for i, chi in enumerate(self.stack)]
+        out = estimate_noise_stack(self.k, chis, kmax=12)
+        self.compare([self.k[:len(c)] for c in chis], chis, out, kmax=12)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (EstimateNoiseStackTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
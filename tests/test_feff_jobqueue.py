@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""
+tests of FeffJobQueue: hashing of feff.inp text, and running small
+Cu clusters with the bundled feff6l or a stand-in executable, with
+results cached
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from itertools import permutations
+from subprocess import Popen, PIPE, STDOUT
+
+from larch.xafs.feffrunner import (FeffJobQueue, feff_jobqueue, find_exe,
+                                   normalize_feffinp, feffinp_hash)
+
+FEFFINP = """ TITLE Cu metal, first shell, a = {a:.3f}
+ HOLE      1   1.0   * Cu K edge
+ CONTROL   1      1     1     1
+ PRINT     1      0     0     0
+ RMAX      {rmax:.2f}
+
+ POTENTIALS
+     0     29     Cu
+     1     29     Cu
+
+ ATOMS
+{atoms}
+ END
+"""
+
+def cu_cluster(a=3.61, rmax=3.0):
+    "feff.inp text for Cu first shell cluster with lattice constant a"
+    h = a/2.0
+    atoms = ['  0.00000  0.00000  0.00000  0']
+    for pos in sorted(set(permutations((h, -h, 0))) | set(permutations((h, h, 0))) |
+                      set(permutations((-h, -h, 0)))):
+        atoms.append('  %.5f  %.5f  %.5f  1' % pos)
+    return FEFFINP.format(a=a, rmax=rmax, atoms='\n'.join(atoms))
+
+def feff6l_runs():
+    "whether the bundled feff6l can be run here"
+    exe = find_exe('feff6l')
+    if exe is None:
+        return False
+    tmpdir = tempfile.mkdtemp()
+    try:
+        proc = Popen(exe, cwd=tmpdir, stdout=PIPE, stderr=STDOUT)
+        out = proc.communicate()[0].decode('utf-8', 'replace')
+    except OSError:
+        return False
+    finally:
+        shutil.rmtree(tmpdir)
+    return proc.returncode != 127 and 'shared libraries' not in out
+
+# stand-in for feff: writes feff0001.dat and records its start and end
+# times, and exits with status 3 (after writing output) for 'FAIL' inputs
+FAKEFEFF = """#!{python}
+import time
+with open('feff.inp') as fh:
+    text = fh.read()
+t0 = time.time()
+time.sleep(0.5)
+with open('feff0001.dat', 'w') as fh:
+    fh.write(text)
+with open({runlog!r}, 'a') as fh:
+    fh.write('%.6f %.6f\\n' % (t0, time.time()))
+if 'FAIL' in text:
+    raise SystemExit(3)
+"""
+
+class FeffInpHashTest(unittest.TestCase):
+    def test_normalize(self):
+        text = cu_cluster()
+        messy = '* a comment\n' + text.replace(' 1   1.0', '   1  1.0  ').replace('\n', '\n\n')
+        self.assertEqual(normalize_feffinp(text), normalize_feffinp(messy))
+        self.assertEqual(feffinp_hash(text), feffinp_hash(messy))
+        self.assertNotEqual(feffinp_hash(text), feffinp_hash(text, exe='feff8l'))
+        self.assertNotEqual(feffinp_hash(text), feffinp_hash(cu_cluster(a=3.65)))
+
+    def test_add(self):
+        queue = FeffJobQueue(cachedir=tempfile.gettempdir(), verbose=False)
+        job1 = queue.add(cu_cluster())
+        job2 = queue.add(cu_cluster(a=3.65), label='expanded')
+        self.assertEqual(job1.label, 'job0001')
+        self.assertEqual(job2.label, 'expanded')
+        self.assertEqual(job1.status, 'queued')
+        self.assertNotEqual(job1.folder, job2.folder)
+
+@unittest.skipUnless(feff6l_runs(), 'feff6l cannot be run')
+class FeffJobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.cachedir = tempfile.mkdtemp(prefix='feffcache_')
+
+    def tearDown(self):
+        shutil.rmtree(self.cachedir)
+
+    def test_run_and_cache(self):
+        texts = [cu_cluster(a=a) for a in (3.55, 3.61, 3.67)]
+        texts.append('* same as second\n' + texts[1])
+        queue = feff_jobqueue(texts, cachedir=self.cachedir, nproc=3,
+                              verbose=False)
+        jobs = queue.run()
+        self.assertEqual([j.status for j in jobs], ['done']*4)
+        self.assertEqual(len(os.listdir(self.cachedir)), 3)
+        self.assertEqual(jobs[1].folder, jobs[3].folder)
+        for job in jobs:
+            self.assertTrue(len(job.feffdat) >= 1)
+            self.assertTrue(os.path.exists(job.feffdat[0]))
+
+        queue = feff_jobqueue(texts[:2], cachedir=self.cachedir, verbose=False)
+        jobs = queue.run()
+        self.assertEqual([j.status for j in jobs], ['cached']*2)
+
+@unittest.skipIf(os.name == 'nt', 'stand-in feff needs a #! script')
+class FakeFeffJobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='feffqueue_')
+        self.cachedir = os.path.join(self.tmpdir, 'cache')
+        self.runlog = os.path.join(self.tmpdir, 'runs.log')
+        self.exe = os.path.join(self.tmpdir, 'fakefeff')
+        with open(self.exe, 'w') as fh:
+            fh.write(FAKEFEFF.format(python=sys.executable, runlog=self.runlog))
+        os.chmod(self.exe, 0o755)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def make_queue(self, texts, nproc=1):
+        queue = feff_jobqueue(texts, cachedir=self.cachedir, nproc=nproc,
+                              verbose=False)
+        queue._programs = lambda: [self.exe]
+        return queue
+
+    def get_runs(self):
+        if not os.path.exists(self.runlog):
+            return []
+        with open(self.runlog) as fh:
+            return [tuple(float(w) for w in line.split()) for line in fh]
+
+    def test_dedup_and_concurrency(self):
+        texts = [cu_cluster(a=a) for a in (3.55, 3.61, 3.67)]
+        texts.append('* same as second\n' + texts[1])
+        jobs = self.make_queue(texts, nproc=3).run()
+        self.assertEqual([j.status for j in jobs], ['done']*4)
+        self.assertEqual(jobs[1].folder, jobs[3].folder)
+        self.assertEqual(jobs[1].feffdat, jobs[3].feffdat)
+        with open(jobs[2].feffdat[0]) as fh:
+            self.assertEqual(fh.read(), texts[2])
+        runs = self.get_runs()
+        # one run per distinct input, overlapping in time
+        self.assertEqual(len(runs), 3)
+        self.assertTrue(max(r[0] for r in runs) < min(r[1] for r in runs))
+
+        # all found in the cache, without running again
+        jobs = self.make_queue(texts[1:], nproc=3).run()
+        self.assertEqual([j.status for j in jobs], ['cached']*3)
+        self.assertEqual(len(self.get_runs()), 3)
+
+    def test_failed(self):
+        good, bad = cu_cluster(), 'FAIL\n' + cu_cluster(a=3.65)
+        jobs = self.make_queue([good, bad, '* again\n' + bad]).run()
+        self.assertEqual([j.status for j in jobs], ['done', 'failed', 'failed'])
+        self.assertEqual(jobs[1].feffdat, [])
+        self.assertEqual(jobs[2].feffdat, [])
+        self.assertEqual(len(self.get_runs()), 2)
+        # nothing cached for the failed job, and no staging folders left
+        self.assertEqual(os.listdir(self.cachedir), [jobs[0].key])
+        self.assertFalse(os.path.exists(jobs[1].folder))
+
+        # failed job is run again, not read from the cache
+        jobs = self.make_queue([good, bad]).run()
+        self.assertEqual([j.status for j in jobs], ['cached', 'failed'])
+        self.assertEqual(len(self.get_runs()), 3)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (FeffInpHashTest, FeffJobQueueTest, FakeFeffJobQueueTest):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
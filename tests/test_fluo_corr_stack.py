@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+tests of fluo_corr_stack, comparing to fluo_corr for each spectrum
+"""
+import os
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import fluo_corr, fluo_corr_stack
+
+XAFSDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples', 'xafsdata')
+
+def make_stack(nspectra=8):
+    "shifted, scaled, and noisy copies of Cu foil data, on one energy grid"
+    dat = read_ascii(os.path.join(XAFSDATA, 'cu_metal_rt.xdi'))
+    energy, mu = dat.energy, dat.mutrans
+    rng = np.random.RandomState(3)
+    stack = []
+    for i in range(nspectra):
+        shift = rng.uniform(-5, 5)
+        stack.append((1+0.2*i)*np.interp(energy, energy+shift, mu) + 0.01*i +
+                     rng.normal(scale=0.002, size=len(energy)))
+    return energy, np.array(stack)
+
+class FluoCorrStackTest(unittest.TestCase):
+    def setUp(self):
+        self.energy, self.stack = make_stack()
+
+    def compare(self, anginp=45, angout=45, **kws):
+        out = fluo_corr_stack(self.energy, self.stack, 'CuO', 'Cu',
+                              anginp=anginp, angout=angout, **kws)
+        self.assertEqual(out.mu_corr.shape, self.stack.shape)
+        self.assertEqual(out.norm_corr.shape, self.stack.shape)
+        anginp = np.ones(len(self.stack))*anginp
+        angout = np.ones(len(self.stack))*angout
+        for i, mu in enumerate(self.stack):
+            grp = Group()
+            fluo_corr(self.energy, mu, 'CuO', 'Cu', group=grp,
+                      anginp=anginp[i], angout=angout[i], **kws)
+            assert_allclose(out.mu_corr[i], grp.mu_corr, rtol=1.e-8)
+            assert_allclose(out.norm_corr[i], grp.norm_corr, rtol=1.e-8,
+                            atol=1.e-8)
+
+    def test_defaults(self):
+        self.compare()
+
+    def test_angles(self):
+        nspec = len(self.stack)
+        self.compare(anginp=np.linspace(10, 80, nspec), angout=30)
+        out = fluo_corr_stack(self.energy, self.stack, 'CuO', 'Cu',
+                              anginp=np.linspace(10, 80, nspec))
+        self.assertTrue((np.diff(out.alpha) > 0).all())
+
+    def test_pre_edge_options(self):
+        self.compare(pre1=-150, pre2=-40, norm1=60, norm2=500)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (FluoCorrStackTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
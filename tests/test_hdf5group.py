@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""
+tests of h5group and netcdf_group, eager and lazy, on synthetic files
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import h5py
+import numpy as np
+from numpy.testing import assert_allclose
+import scipy.io.netcdf
+
+from larch.io import h5group, netcdf_group
+from larch.io.hdf5group import H5ProxyGroup, H5DatasetProxy
+
+class H5GroupTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.h5name = os.path.join(self.tmpdir, 'nested.h5')
+        self.map = np.arange(20*30*40, dtype='float32').reshape(20, 30, 40)
+        with h5py.File(self.h5name, 'w') as fh:
+            fh.attrs['title'] = 'test file'
+            top = fh.create_group('xrmmap')
+            top.attrs['version'] = '2.0'
+            mca = top.create_group('mca1')
+            dset = mca.create_dataset('counts', data=self.map, chunks=(1, 30, 40))
+            dset.attrs['units'] = 'counts'
+            mca.create_dataset('energy', data=np.linspace(0, 20, 40))
+            top.create_group('config/scan').create_dataset('npts', data=np.array([20]))
+            top.create_dataset('name', data=np.array([b'sample 1']))
+            fh.create_dataset('pos-x', data=np.arange(5.0))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_eager(self):
+        grp = h5group(self.h5name, mode='r')
+        self.assertIsInstance(grp.xrmmap.mca1.counts, h5py.Dataset)
+        assert_allclose(grp.xrmmap.mca1.counts[3, 4], self.map[3, 4])
+        self.assertEqual(grp.xrmmap._attrs['version'], '2.0')
+        self.assertEqual(grp.xrmmap.mca1.counts_attrs['units'], 'counts')
+        grp.h5_file.close()
+
+        grp = h5group(self.h5name, mode='r', max_eager_size=1000)
+        self.assertIsInstance(grp.xrmmap.mca1.energy, np.ndarray)
+        self.assertIsInstance(grp.xrmmap.mca1.counts, h5py.Dataset)
+        grp.h5_file.close()
+
+    def test_lazy(self):
+        grp = h5group(self.h5name, mode='r', lazy=True)
+        self.assertIsInstance(grp, H5ProxyGroup)
+        for name in ('xrmmap', 'pos_x'):
+            self.assertIn(name, dir(grp))
+        self.assertNotIn('xrmmap', grp.__dict__)
+
+        counts = grp.xrmmap.mca1.counts
+        self.assertIsInstance(counts, H5DatasetProxy)
+        self.assertEqual(counts.shape, self.map.shape)
+        self.assertEqual(counts.nbytes, self.map.nbytes)
+        self.assertIs(grp.xrmmap.mca1.counts, counts)
+        assert_allclose(counts[3, 4:7, ::2], self.map[3, 4:7, ::2])
+        assert_allclose(np.asarray(counts), self.map)
+        self.assertEqual(counts.attrs['units'], 'counts')
+
+        self.assertEqual(grp._attrs['title'], 'test file')
+        self.assertEqual(grp.xrmmap._attrs['version'], '2.0')
+        self.assertEqual(grp.xrmmap.mca1.counts_attrs['units'], 'counts')
+        self.assertEqual(grp.xrmmap.name, b'sample 1')
+        assert_allclose(grp.pos_x[2:4], [2.0, 3.0])
+        assert_allclose(grp.xrmmap.config.scan.npts[0], 20)
+        self.assertFalse(hasattr(grp.xrmmap, 'nonexistent'))
+        self.assertFalse(hasattr(grp.xrmmap.mca1, 'energy_attrs'))
+        grp.h5_file.close()
+
+    def test_lazy_eager_size(self):
+        grp = h5group(self.h5name, mode='r', lazy=True, max_eager_size=1000)
+        self.assertIsInstance(grp.xrmmap.mca1.energy, np.ndarray)
+        self.assertIsInstance(grp.xrmmap.mca1.counts, H5DatasetProxy)
+        grp.h5_file.close()
+
+    def test_netcdf(self):
+        ncname = os.path.join(self.tmpdir, 'test.nc')
+        fh = scipy.io.netcdf.netcdf_file(ncname, 'w')
+        fh.createDimension('x', 40)
+        fh.createDimension('y', 30)
+        var = fh.createVariable('image', 'f', ('y', 'x'))
+        var[:] = self.map[0]
+        var = fh.createVariable('x', 'd', ('x',))
+        var[:] = np.arange(40.0)
+        fh.close()
+
+        grp = netcdf_group(ncname)
+        assert_allclose(grp.image, self.map[0])
+
+        grp = netcdf_group(ncname, lazy=True, max_eager_size=400)
+        self.assertFalse(grp.image.flags.owndata)    # memory-mapped
+        self.assertTrue(grp.x.flags.owndata)
+        assert_allclose(grp.image[5], self.map[0, 5])
+        assert_allclose(grp.x, np.arange(40.0))
+        del grp.image, grp.x
+        grp.nc_file.close()
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (H5GroupTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
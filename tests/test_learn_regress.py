@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+tests of Cross-Validation in pls_train and lasso_train, compared to
+fitting scikit-learn models fold by fold, and with different numbers
+of parallel workers
+"""
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.math.learn_regress import HAS_SKLEARN, pls_train, lasso_train
+
+X = np.linspace(-20, 60, 200)
+
+def make_groups(ngroups=30, seed=1):
+    "model spectra with edge position and white line varying with valence"
+    rand = np.random.RandomState(seed)
+    groups = []
+    for i in range(ngroups):
+        val = rand.uniform(2, 3)
+        e0 = 4*(val-2)
+        norm = (1/(1+np.exp(-(X-e0)/2.5)) +
+                0.6*(3-val)*np.exp(-(X-e0-4)**2/8) +
+                rand.normal(scale=0.003, size=len(X)))
+        groups.append(Group(energy=X, norm=norm, valence=val,
+                            filename='spec%d' % i))
+    return groups
+
+def direct_rmse_cv(model, cv_folds, cv_repeats, random_state):
+    "RMSE_CV from fitting a copy of model for each fold"
+    from sklearn.base import clone
+    from sklearn.model_selection import RepeatedKFold
+    spectra, ydat = model.spectra, model.ydat
+    cv = RepeatedKFold(n_splits=cv_folds, n_repeats=cv_repeats,
+                       random_state=random_state)
+    resid = []
+    for ctrain, ctest in cv.split(range(len(ydat))):
+        fold_model = clone(model.model).fit(spectra[ctrain], ydat[ctrain])
+        resid.extend(np.ravel(fold_model.predict(spectra[ctest])) - ydat[ctest])
+    return np.sqrt((np.array(resid)**2).mean())
+
+@unittest.skipUnless(HAS_SKLEARN, 'scikit-learn not installed')
+class LearnRegressTest(unittest.TestCase):
+    def setUp(self):
+        self.groups = make_groups()
+
+    def test_pls_ncomps_search(self):
+        model = pls_train(self.groups, ncomps=None, max_ncomps=8,
+                          random_state=3)
+        assert_allclose(model.ncomps_cv, np.arange(1, 9))
+        self.assertEqual(model.ncomps, 1+np.argmin(model.rmse_cv_curve))
+        self.assertEqual(model.rmse_cv, model.rmse_cv_curve.min())
+        self.assertEqual(model.model.n_components, model.ncomps)
+        for ncomps in (1, 2, 5):
+            fixed = pls_train(self.groups, ncomps=ncomps, random_state=3)
+            expected = direct_rmse_cv(fixed, model.cv_folds,
+                                      model.cv_repeats, 3)
+            assert_allclose(fixed.rmse_cv, expected, rtol=1.e-10)
+            assert_allclose(model.rmse_cv_curve[ncomps-1], expected, rtol=1.e-10)
+
+    def test_pls_n_jobs(self):
+        serial = pls_train(self.groups, ncomps=None, max_ncomps=6,
+                           random_state=7)
+        parallel = pls_train(self.groups, ncomps=None, max_ncomps=6,
+                             random_state=7, n_jobs=2)
+        assert_allclose(parallel.rmse_cv_curve, serial.rmse_cv_curve,
+                        rtol=1.e-14)
+        self.assertEqual(parallel.ncomps, serial.ncomps)
+        assert_allclose(parallel.ypred, serial.ypred)
+
+    def test_lasso(self):
+        alphas = [1.e-5, 1.e-4, 1.e-3]
+        serial = lasso_train(self.groups, alpha=alphas, random_state=3)
+        parallel = lasso_train(self.groups, alpha=alphas, random_state=3,
+                               n_jobs=2)
+        assert_allclose(parallel.rmse_cv_curve, serial.rmse_cv_curve,
+                        rtol=1.e-14)
+        self.assertEqual(serial.alpha, alphas[np.argmin(serial.rmse_cv_curve)])
+        expected = direct_rmse_cv(serial, serial.cv_folds,
+                                  serial.cv_repeats, 3)
+        assert_allclose(serial.rmse_cv, expected, rtol=1.e-10)
+
+        serial = lasso_train(self.groups, random_state=3)
+        parallel = lasso_train(self.groups, random_state=3, n_jobs=2)
+        self.assertEqual(parallel.alpha, serial.alpha)
+        assert_allclose(parallel.rmse_cv, serial.rmse_cv, rtol=1.e-14)
+
+        with self.assertRaises(ValueError):
+            lasso_train(self.groups, alpha=alphas, skip_cv=True)
+        out = lasso_train(self.groups, alpha=[1.e-4], skip_cv=True)
+        self.assertEqual(out.alpha, 1.e-4)
+        self.assertIsNone(out.rmse_cv)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (LearnRegressTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+tests of lincombo_fitall, with combinations ranked from Gram-matrix
+solutions compared to fitting every combination with lincombo_fit
+"""
+import unittest
+from itertools import combinations
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.optimize import lsq_linear
+
+from larch import Group
+from larch.math import lincombo_fit, lincombo_fitall, groups2matrix
+from larch.math.lincombo_fitting import _lincombo_screen, _lincombo_bounded
+
+X = np.linspace(-20, 60, 250)
+
+def make_groups(ncomps=6, seed=4):
+    "model standards, and a mixture of 3 of them with noise"
+    rand = np.random.RandomState(seed)
+    comps = []
+    for i in range(ncomps):
+        e0, amp, wid = rand.uniform(-3, 3), rand.uniform(0, 1), rand.uniform(2, 8)
+        norm = 1/(1+np.exp(-(X-e0)/2)) + amp*np.exp(-(X-e0-wid)**2/10)
+        comps.append(Group(energy=X, norm=norm, filename='std%d' % i))
+    norm = (0.5*comps[0].norm + 0.3*comps[2].norm + 0.2*comps[4].norm +
+            rand.normal(scale=0.002, size=len(X)))
+    return Group(energy=X, norm=norm, filename='unknown'), comps
+
+def labels(results):
+    return [tuple(r.weights.keys()) for r in results]
+
+class LincomboTest(unittest.TestCase):
+    def setUp(self):
+        self.group, self.comps = make_groups()
+        xdat, yall = groups2matrix([self.group] + self.comps)
+        self.ydat, self.ycomps = yall[0], yall[1:]
+        self.gram = np.dot(self.ycomps, self.ycomps.T)
+        self.aty = np.dot(self.ycomps, self.ydat)
+        self.yy = np.dot(self.ydat, self.ydat)
+
+    def test_screen(self):
+        ncomps = len(self.comps)
+        lo, hi = -np.inf*np.ones(ncomps), np.inf*np.ones(ncomps)
+        subsets = np.array(list(combinations(range(ncomps), 3)))
+        wts, chisqr, ok = _lincombo_screen(self.gram, self.aty, self.yy,
+                                           subsets, lo, hi, False)
+        self.assertTrue(np.all(ok))
+        for subset, w, chi2 in zip(subsets, wts, chisqr):
+            amat = self.ycomps[subset].T
+            expected = np.linalg.lstsq(amat, self.ydat, rcond=None)[0]
+            assert_allclose(w, expected, rtol=1.e-7)
+            assert_allclose(chi2, ((np.dot(amat, w)-self.ydat)**2).sum(),
+                            rtol=1.e-6)
+        wts, chisqr, ok = _lincombo_screen(self.gram, self.aty, self.yy,
+                                           subsets, lo, hi, True)
+        assert_allclose(wts.sum(axis=1), 1.0)
+        for subset, w, chi2 in zip(subsets, wts, chisqr):
+            comps = [self.comps[i] for i in subset]
+            out = lincombo_fit(self.group, comps, weights=[1/3.]*3)
+            assert_allclose(w, list(out.weights.values()), rtol=1.e-5, atol=1.e-7)
+            assert_allclose(chi2, out.chisqr, rtol=1.e-5)
+
+    def test_bounded(self):
+        ncomps = len(self.comps)
+        lo, hi = np.zeros(ncomps), np.ones(ncomps)
+        for subset in combinations(range(ncomps), 4):
+            subset = np.array(subset)
+            w, chi2 = _lincombo_bounded(self.gram, self.aty, self.yy, subset,
+                                        lo, hi, False)
+            amat = self.ycomps[subset].T
+            expected = lsq_linear(amat, self.ydat, bounds=(0, 1), tol=1.e-12)
+            assert_allclose(chi2, 2*expected.cost, rtol=1.e-6)
+
+            w, chi2 = _lincombo_bounded(self.gram, self.aty, self.yy, subset,
+                                        lo, hi, True)
+            assert_allclose(w.sum(), 1.0)
+            self.assertTrue(np.all(w >= 0) and np.all(w <= 1))
+
+    def test_fitall(self):
+        ncomps = len(self.comps)
+        for sum_to_one in (True, False):
+            for bounds in ((None, None), ([0]*ncomps, [1]*ncomps)):
+                allfits = lincombo_fitall(self.group, self.comps,
+                                          minvals=bounds[0], maxvals=bounds[1],
+                                          sum_to_one=sum_to_one)
+                self.assertEqual(len(allfits), 2**ncomps - ncomps - 1)
+                best = lincombo_fitall(self.group, self.comps, nbest=8,
+                                       minvals=bounds[0], maxvals=bounds[1],
+                                       sum_to_one=sum_to_one)
+                self.assertEqual(labels(best), labels(allfits[:8]))
+                assert_allclose([r.redchi for r in best],
+                                [r.redchi for r in allfits[:8]])
+        self.assertEqual(labels(best)[0], ('std0', 'std2', 'std4'))
+
+    def test_nbest_bounds(self):
+        kws = dict(minvals=[0]*7, maxvals=[1]*7)
+        for seed in (1, 6, 10):
+            group, comps = make_groups(ncomps=7, seed=seed)
+            allfits = lincombo_fitall(group, comps, **kws)
+            for nbest in (1, 3, 5):
+                best = lincombo_fitall(group, comps, nbest=nbest, **kws)
+                self.assertEqual(labels(best), labels(allfits[:nbest]))
+                assert_allclose([r.redchi for r in best],
+                                [r.redchi for r in allfits[:nbest]])
+                for r in best:
+                    assert_allclose(sum(r.weights.values()), 1.0)
+
+    def test_none_bounds(self):
+        ncomps = len(self.comps)
+        minvals = [0, None, 0, None, 0, None]
+        maxvals = [None, 1, None, 1, None, 1]
+        kws = dict(nbest=6, prune=True)
+        mixed = lincombo_fitall(self.group, self.comps, minvals=minvals,
+                                maxvals=maxvals, **kws)
+        explicit = lincombo_fitall(self.group, self.comps,
+                                   minvals=[0, -np.inf]*3,
+                                   maxvals=[np.inf, 1]*3, **kws)
+        self.assertEqual(len(mixed), 6)
+        self.assertEqual(labels(mixed), labels(explicit))
+        assert_allclose([r.redchi for r in mixed],
+                        [r.redchi for r in explicit])
+
+    def test_prune_nproc(self):
+        ncomps = len(self.comps)
+        kws = dict(minvals=[0]*ncomps, maxvals=[1]*ncomps, nbest=5, prune=True)
+        serial = lincombo_fitall(self.group, self.comps, **kws)
+        parallel = lincombo_fitall(self.group, self.comps, nproc=2, **kws)
+        self.assertEqual(labels(serial), labels(parallel))
+        names = [c.filename for c in self.comps]
+        for result in serial:
+            subset = np.array([[names.index(n) for n in result.weights]])
+            wts, chisqr, ok = _lincombo_screen(self.gram, self.aty, self.yy,
+                                               subset, np.zeros(ncomps),
+                                               np.ones(ncomps), True)
+            self.assertTrue(ok[0])
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (LincomboTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+tests of xrmmap.mapwatcher, with row files written to a fake map
+folder and rows processed by a stand-in for GSEXRM_MapFile
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from larch.xrmmap.mapwatcher import FolderWatcher, GSEXRM_MapWatcher
+from larch.xrmmap.asciifiles import readMasterFile
+from larch.xrmmap.gsexrm_utils import GSEXRM_FileStatus
+
+def write_file(fname, text='data\n'):
+    with open(fname, 'w') as fh:
+        fh.write(text)
+
+def age_file(fname, age=60.0):
+    "set file modification time to age seconds ago"
+    mtime = time.time() - age
+    os.utime(fname, (mtime, mtime))
+
+class FakeMapFile(object):
+    "reads Master.dat rows and records processed rows, without HDF5"
+    def __init__(self, folder):
+        self.folder = folder
+        self.rowdata = []
+        self.nrows_expected = None
+        self.last_row = -1
+        self.status = GSEXRM_FileStatus.hasdata
+        self.processed = []
+        self.h5root = None
+
+    def read_master(self):
+        header, self.rowdata = readMasterFile(os.path.join(self.folder,
+                                                           'Master.dat'))
+        for line in header:
+            words = line.split('=')
+            if 'scan.nrows_expected' in words[0].lower():
+                self.nrows_expected = int(words[1].strip())
+
+    def process_row(self, irow, flush=False, callback=None):
+        self.processed.append((irow, flush))
+        self.last_row = irow
+
+    def close(self):
+        pass
+
+class MapWatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='mapwatcher')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def path(self, fname):
+        return os.path.join(self.folder, fname)
+
+    def write_master(self, nrows, nrows_expected=3):
+        lines = ['# Scan.version = 1.40',
+                 '# Scan.nrows_expected = %d' % nrows_expected,
+                 '#------------------------']
+        for i in range(nrows):
+            lines.append('%.3f xsp3.%3.3d struck.%3.3d xps.%3.3d xrd.%3.3d %.1f' %
+                         (0.1*i, i, i, i, i, 10.0*i))
+        write_file(self.path('Master.dat'), '\n'.join(lines) + '\n')
+
+    def write_row(self, irow, age=60.0):
+        for prefix in ('xsp3', 'struck', 'xps', 'xrd'):
+            fname = self.path('%s.%3.3d' % (prefix, irow))
+            write_file(fname)
+            if age is not None:
+                age_file(fname, age)
+
+    def get_watcher(self, **kws):
+        kws.setdefault('use_inotify', False)
+        kws.setdefault('poll_time', 0.01)
+        watcher = GSEXRM_MapWatcher(self.folder, **kws)
+        watcher.mapfile = FakeMapFile(self.folder)
+        return watcher
+
+    def test_polling(self):
+        watcher = FolderWatcher(self.folder, use_inotify=False, poll_time=0.05)
+        self.assertFalse(watcher.use_inotify)
+        t0 = time.time()
+        self.assertEqual(watcher.wait(), [])
+        self.assertTrue(time.time() - t0 >= 0.04)
+        write_file(self.path('a.dat'))
+        self.assertEqual(watcher.wait(timeout=0.01), [])
+        self.assertEqual(watcher.closed_files, set())
+        watcher.close()
+
+    def test_inotify(self):
+        watcher = FolderWatcher(self.folder, use_inotify=True, poll_time=0.05)
+        if not watcher.use_inotify:
+            self.skipTest('inotify not available')
+        self.assertEqual(watcher.wait(), [])
+        write_file(self.path('a.dat'))
+        names = []
+        t0 = time.time()
+        while 'a.dat' not in watcher.closed_files and time.time() - t0 < 5:
+            names.extend(watcher.wait(timeout=1.0))
+        self.assertIn('a.dat', names)
+        self.assertIn('a.dat', watcher.closed_files)
+        self.assertEqual(watcher.nevents, len(names))
+        # re-opened for writing: no longer closed
+        with open(self.path('a.dat'), 'a') as fh:
+            fh.write('more\n')
+            fh.flush()
+            t0 = time.time()
+            while 'a.dat' in watcher.closed_files and time.time() - t0 < 5:
+                watcher.wait(timeout=1.0)
+            self.assertNotIn('a.dat', watcher.closed_files)
+        watcher.close()
+        self.assertFalse(watcher.use_inotify)
+
+    def test_row_complete(self):
+        self.write_master(1)
+        watcher = self.get_watcher(settle_time=30.0)
+        watcher.mapfile.read_master()
+        self.assertEqual([f for i, f in watcher.row_files(0)],
+                         ['xsp3.000', 'struck.000', 'xps.000', 'xrd.000'])
+        # missing files
+        self.assertFalse(watcher.row_complete(0))
+        # new files, not yet settled
+        self.write_row(0, age=None)
+        self.assertFalse(watcher.row_complete(0))
+        # closed files do not need to settle
+        watcher.watcher.closed_files.update(['xsp3.000', 'struck.000',
+                                             'xps.000', 'xrd.000'])
+        self.assertTrue(watcher.row_complete(0))
+        watcher.watcher.closed_files.clear()
+        # settled files
+        for fname in ('xsp3.000', 'struck.000', 'xps.000', 'xrd.000'):
+            age_file(self.path(fname), 40.0)
+        self.assertTrue(watcher.row_complete(0))
+        watcher.settle_time = 50.0
+        self.assertFalse(watcher.row_complete(0))
+
+    def test_row_files(self):
+        self.write_master(1)
+        watcher = self.get_watcher(settle_time=0.0)
+        watcher.mapfile.read_master()
+        watcher.mapfile.rowdata[0][1] = 'None.000'
+        watcher.mapfile.rowdata[0][3] = '_unused_'
+        self.assertEqual([f for i, f in watcher.row_files(0)],
+                         ['xsp3.000', 'struck.000', 'xrd.000'])
+        # XRD saved as 1D pattern
+        for fname in ('xsp3.000', 'struck.000', 'xrd.000.npy'):
+            write_file(self.path(fname))
+        self.assertTrue(watcher.row_complete(0))
+        # older scans have no XRD file
+        del watcher.mapfile.rowdata[0][4:]
+        os.unlink(self.path('xrd.000.npy'))
+        self.assertEqual([f for i, f in watcher.row_files(0)],
+                         ['xsp3.000', 'struck.000'])
+        self.assertTrue(watcher.row_complete(0))
+
+    def test_check(self):
+        self.write_master(2, nrows_expected=3)
+        self.write_row(0)
+        self.write_row(1, age=None)
+        watcher = self.get_watcher(settle_time=30.0)
+        mfile = watcher.mapfile
+        # only first row is complete
+        self.assertEqual(watcher.check(), 1)
+        self.assertEqual(mfile.processed, [(0, True)])
+        self.assertEqual(watcher.stats['nrows'], 2)
+        self.assertEqual(watcher.stats['nrows_expected'], 3)
+        self.assertEqual(watcher.stats['last_row'], 0)
+        self.assertFalse(watcher.is_complete())
+        self.assertEqual(watcher.check(), 0)
+
+        # second row settles, third row collected
+        self.write_master(3, nrows_expected=3)
+        self.write_row(2)
+        for prefix in ('xsp3', 'struck', 'xps', 'xrd'):
+            age_file(self.path('%s.001' % prefix))
+        self.assertEqual(watcher.check(), 2)
+        self.assertEqual(mfile.processed, [(0, True), (1, False), (2, True)])
+        self.assertEqual(watcher.stats['rows_processed'], 3)
+        self.assertTrue(watcher.is_complete())
+
+    def test_run(self):
+        self.write_master(3, nrows_expected=3)
+        for irow in range(3):
+            self.write_row(irow)
+        watcher = self.get_watcher()
+        stats = watcher.run(timeout=5)
+        self.assertEqual(watcher.mapfile.processed, [(0, False), (1, False),
+                                                     (2, True)])
+        self.assertEqual(stats['last_row'], 2)
+        self.assertTrue(watcher.is_complete())
+
+        # incomplete map: stops at idle timeout
+        self.write_master(3, nrows_expected=4)
+        watcher = self.get_watcher()
+        t0 = time.time()
+        stats = watcher.run(idle_timeout=0.1)
+        self.assertTrue(time.time() - t0 < 5)
+        self.assertEqual(stats['last_row'], 2)
+        self.assertFalse(watcher.is_complete())
+        watcher.close()
+        self.assertIsNone(watcher.mapfile)
+
+    def test_open_mapfile(self):
+        watcher = GSEXRM_MapWatcher(self.folder, use_inotify=False)
+        self.assertFalse(watcher.open_mapfile())
+        self.assertEqual(watcher.check(), 0)
+        watcher.close()
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (MapWatcherTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+tests of merge_groups and merge_arrays, compared to averaging
+all interpolated arrays at once
+"""
+import unittest
+import weakref
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.math import interp
+from larch.io import merge_groups, merge_arrays
+from larch.io import mergegroups
+
+NSCANS = 30
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(7)
+        self.energy = np.linspace(8900, 9400, 1500)
+        self.base = np.tanh((self.energy-8980)/4) + 0.05*np.sin(self.energy/5)
+        self.groups = []
+        for i in range(NSCANS):
+            x = self.energy + (0 if i % 3 else np.random.uniform(-0.4, 0.4))
+            y = self.base + np.random.normal(scale=0.01, size=len(x))
+            self.groups.append(Group(energy=x, mu=y))
+
+    def test_merge_groups(self):
+        for kind in ('linear', 'quadratic', 'cubic'):
+            yvals = np.array([interp(g.energy, g.mu, self.energy, kind=kind)
+                              for g in self.groups])
+            out = merge_groups(self.groups, master=Group(energy=self.energy),
+                               kind=kind, trim=False,
+                               chunksize=4*len(self.energy))
+            self.assertEqual(out.nmerged, NSCANS)
+            assert_allclose(out.energy, self.energy)
+            assert_allclose(out.mu, yvals.mean(axis=0), rtol=1.e-12)
+            assert_allclose(out.mu_std, yvals.std(axis=0), rtol=1.e-8, atol=1.e-14)
+            assert_allclose(out.mu_stderr, yvals.std(axis=0, ddof=1)/np.sqrt(NSCANS),
+                            rtol=1.e-8, atol=1.e-14)
+
+    def test_interp_cache(self):
+        live, nlive = weakref.WeakSet(), []
+        class CountingInterpolator(mergegroups.ScanInterpolator):
+            def __call__(self, ys):
+                live.add(self)
+                nlive.append(len(live))
+                return super(CountingInterpolator, self).__call__(ys)
+
+        groups = [Group(energy=self.energy + 0.01*i, mu=g.mu)
+                  for i, g in enumerate(self.groups)]
+        yvals = np.array([interp(g.energy, g.mu, self.energy, kind='linear')
+                          for g in groups])
+        saved = mergegroups.ScanInterpolator, mergegroups.MERGE_INTERP_CACHESIZE
+        mergegroups.ScanInterpolator = CountingInterpolator
+        mergegroups.MERGE_INTERP_CACHESIZE = 3
+        try:
+            out = merge_groups(groups, master=Group(energy=self.energy),
+                               kind='linear', trim=False, method='sigmaclip',
+                               chunksize=4*len(self.energy))
+        finally:
+            mergegroups.ScanInterpolator, mergegroups.MERGE_INTERP_CACHESIZE = saved
+        # one interpolator per group and pass, at most 3 kept
+        self.assertTrue(len(nlive) >= 2*NSCANS)
+        self.assertTrue(max(nlive) <= 4)
+        self.assertEqual(out.nmerged, NSCANS)
+        assert_allclose(out.mu, yvals.mean(axis=0), rtol=1.e-12)
+
+    def test_merge_arrays(self):
+        ys = np.array([g.mu for g in self.groups])
+        xout = self.energy[10:-10:2]
+        out = merge_arrays(self.energy, ys, xout=xout, kind='linear', chunksize=5000)
+        expected = np.array([np.interp(xout, self.energy, y) for y in ys])
+        assert_allclose(out.y, expected.mean(axis=0), rtol=1.e-12)
+        assert_allclose(out.y_std, expected.std(axis=0), rtol=1.e-8)
+        out = merge_arrays(self.energy, ys)
+        assert_allclose(out.y, ys.mean(axis=0), rtol=1.e-12)
+
+    def test_reject(self):
+        ys = np.array([g.mu for g in self.groups])
+        ys[4] += 0.2
+        ys[17] += np.random.normal(scale=0.1, size=ys.shape[1])
+        good = [i for i in range(NSCANS) if i not in (4, 17)]
+        out = merge_arrays(self.energy, ys, method='sigmaclip', chunksize=5000)
+        self.assertEqual(out.rejected, [4, 17])
+        self.assertEqual(out.nmerged, NSCANS-2)
+        assert_allclose(out.y, ys[good].mean(axis=0), rtol=1.e-12)
+        assert_allclose(out.y_std, ys[good].std(axis=0), rtol=1.e-8)
+
+        out = merge_arrays(self.energy, ys[good], method='sigmaclip')
+        self.assertEqual(out.rejected, [])
+
+        out = merge_arrays(self.energy, ys, method='median', nbatch=5)
+        batches = [ys[6*i:6*(i+1)].mean(axis=0) for i in range(5)]
+        assert_allclose(out.y, np.median(batches, axis=0), rtol=1.e-12)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (MergeTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
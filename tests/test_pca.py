@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+tests of PCA training and fitting: randomized and incremental
+training compared to the full eigen-decomposition, IND and F1R
+statistics compared to direct sums, and pca_fit_many compared to pca_fit
+"""
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.math import (pca_train, pca_train_matrix, pca_fit, pca_fit_many,
+                        pca_statistics)
+
+X = np.linspace(-20, 80, 300)
+
+def make_spectra(nspectra, seed=0):
+    "mixtures of 3 model XANES spectra, with noise"
+    rand = np.random.RandomState(seed)
+    refs = np.array([1/(1+np.exp(-(X-e0)/3)) + amp*np.exp(-(X-epk)**2/20)
+                     for e0, amp, epk in ((0, 0.5, 5), (3, 0.2, 10), (-2, 0.8, 2))])
+    weights = rand.dirichlet(np.ones(3), size=nspectra)
+    return np.dot(weights, refs) + rand.normal(scale=0.002, size=(nspectra, len(X)))
+
+def same_components(comps1, comps2, ncomps, rtol):
+    "components agree up to sign"
+    for c1, c2 in zip(comps1[:ncomps], comps2[:ncomps]):
+        sign = np.sign(np.dot(c1, c2))
+        assert_allclose(c1, sign*c2, rtol=rtol, atol=rtol*abs(c2).max())
+
+class PCATest(unittest.TestCase):
+    def setUp(self):
+        self.ydat = make_spectra(40)
+        self.groups = [Group(energy=X, norm=y, filename='spec%d' % i)
+                       for i, y in enumerate(self.ydat)]
+        self.model = pca_train(self.groups)
+
+    def test_train(self):
+        model = self.model
+        self.assertEqual(model.components.shape, (40, len(X)))
+        self.assertEqual(len(model.ind), 40)
+        # IND as summed for each r
+        narr, nfreq = self.ydat.shape
+        eigv = model.eigenvalues
+        for r in range(narr-1):
+            nr = narr - r - 1
+            assert_allclose(model.ind[r+1], np.sqrt(nfreq*eigv[r:].sum()/nr)/nr**2,
+                            rtol=1.e-10)
+
+    def test_randomized(self):
+        model = pca_train_matrix(X, self.ydat, method='randomized', ncomps=5,
+                                 random_state=2)
+        self.assertEqual(model.components.shape, (5, len(X)))
+        # signal components are exact, noise components approximate
+        assert_allclose(model.eigenvalues[:3], self.model.eigenvalues[:3], rtol=1.e-8)
+        assert_allclose(model.eigenvalues, self.model.eigenvalues[:5], rtol=1.e-4)
+        assert_allclose(model.variances, self.model.variances[:5], rtol=1.e-4)
+        same_components(model.components, self.model.components, 3, 1.e-4)
+
+    def test_incremental(self):
+        model = pca_train_matrix(X, self.ydat, method='incremental',
+                                 chunksize=7*len(X))
+        assert_allclose(model.mean, self.model.mean, rtol=1.e-12)
+        assert_allclose(model.eigenvalues[:30], self.model.eigenvalues[:30],
+                        rtol=1.e-8)
+        assert_allclose(model.ind, self.model.ind, rtol=1.e-8)
+        self.assertEqual(model.nsig, self.model.nsig)
+        same_components(model.components, self.model.components, 8, 1.e-8)
+
+    def test_statistics(self):
+        ydat = make_spectra(400)
+        model = pca_train_matrix(X, ydat)
+        ind, f1r = pca_statistics(model)
+        p, n = ydat.shape
+        eigv = model.eigenvalues
+        for r in (0, 1, 2, 5, 50, n-2):
+            nr = n - r - 1
+            assert_allclose(ind[r], np.sqrt(eigv[r:].sum()/(p*nr))/nr**2, rtol=1.e-10)
+            f1sum = sum([eigv[i]/((p+1-i)*(n+1-i)) for i in range(r, n)])
+            assert_allclose(f1r[r], eigv[r]/((p+1-r)*(n-r+1)*max(1.e-10, f1sum)),
+                            rtol=1.e-10)
+        # fewer spectra than energies
+        ind, f1r = pca_statistics(self.model)
+        self.assertEqual(len(f1r), len(X)-1)
+        self.assertTrue(np.all(np.isfinite(f1r[:30])))
+
+    def test_fit_many(self):
+        unknowns = [Group(energy=X, norm=scale*y) for scale, y in
+                    zip((0.8, 1.0, 1.3), make_spectra(3, seed=5))]
+        result = pca_fit_many(unknowns, self.model, ncomps=4)
+        self.assertEqual(result.weights.shape, (3, 4))
+        for i, grp in enumerate(unknowns):
+            batch = grp.pca_result
+            pca_fit(grp, self.model, ncomps=4)
+            assert_allclose(batch.data_scale, grp.pca_result.data_scale, rtol=1.e-5)
+            assert_allclose(batch.yfit, grp.pca_result.yfit, rtol=1.e-5)
+            assert_allclose(batch.chi_square, grp.pca_result.chi_square, rtol=1.e-4)
+            assert_allclose(result.yfit[i], batch.yfit)
+
+        ydat = np.array([g.norm for g in unknowns])
+        result = pca_fit_many(ydat, self.model, ncomps=4, rescale=False)
+        assert_allclose(result.data_scale, 1.0)
+        pca_fit(unknowns[2], self.model, ncomps=4, rescale=False)
+        assert_allclose(result.weights[2], unknowns[2].pca_result.weights, rtol=1.e-8)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (PCATest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
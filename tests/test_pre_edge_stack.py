@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""
+tests of pre_edge_stack, comparing to pre_edge for each spectrum
+"""
+import os
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.io import read_ascii
+from larch.xafs import pre_edge, pre_edge_stack
+
+XAFSDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        '..', 'examples', 'xafsdata')
+
+def make_stack(nspectra=12):
+    "shifted, scaled, and noisy copies of Cu foil data, on one energy grid"
+    dat = read_ascii(os.path.join(XAFSDATA, 'cu_metal_rt.xdi'))
+    energy, mu = dat.energy, dat.mutrans
+    rng = np.random.RandomState(2)
+    stack = []
+    for i in range(nspectra):
+        shift = rng.uniform(-8, 8)
+        stack.append((1+0.2*i)*np.interp(energy, energy+shift, mu) + 0.01*i +
+                     rng.normal(scale=0.002, size=len(energy)))
+    return energy, np.array(stack)
+
+class PreEdgeStackTest(unittest.TestCase):
+    def setUp(self):
+        self.energy, self.stack = make_stack()
+
+    def compare(self, **kws):
+        out = pre_edge_stack(self.energy, self.stack, make_flat=True, **kws)
+        self.assertEqual(out.norm.shape, self.stack.shape)
+        for i, mu in enumerate(self.stack):
+            grp = Group()
+            pre_edge(self.energy, mu, group=grp, **kws)
+            self.assertEqual(out.e0[i], grp.e0)
+            self.assertEqual(out.nnorm[i], grp.pre_edge_details.nnorm)
+            assert_allclose(out.edge_step[i], grp.edge_step, rtol=1.e-10)
+            assert_allclose(out.pre_slope[i], grp.pre_edge_details.pre_slope,
+                            rtol=1.e-6)
+            assert_allclose(out.norm[i], grp.norm, rtol=1.e-10, atol=1.e-10)
+            # flat uses an iterative fit in pre_edge
+            assert_allclose(out.flat[i], grp.flat, atol=1.e-4)
+
+    def test_defaults(self):
+        self.compare()
+
+    def test_ranges(self):
+        self.compare(pre1=-150, pre2=-40, norm1=60, norm2=700, nnorm=2)
+
+    def test_e0(self):
+        self.compare(e0=8985.0)
+        out = pre_edge_stack(self.energy, self.stack,
+                             e0=8980.0+np.arange(len(self.stack)))
+        self.assertEqual(len(out.e0), len(self.stack))
+        # flattened output by default, as for pre_edge()
+        self.assertEqual(out.flat.shape, self.stack.shape)
+        out = pre_edge_stack(self.energy, self.stack, make_flat=False)
+        self.assertFalse(hasattr(out, 'flat'))
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (PreEdgeStackTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
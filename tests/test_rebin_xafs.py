@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+tests of rebin_xafs and rebin_xafs_stack, compared to rebinning
+one segment at a time
+"""
+import os
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch import Group
+from larch.io import read_ascii
+from larch.math import index_of, interp1d
+from larch.xafs import rebin_xafs, rebin_xafs_stack
+
+TOP = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+E0 = 8980.0
+
+def rebin_by_segment(energy, mu, en, method='centroid'):
+    "rebinning with a loop over new energies"
+    bounds = [index_of(energy, e) for e in en]
+    mu_out, err_out = [], []
+    j0 = 0
+    for i in range(len(en)):
+        if i == len(en) - 1:
+            j1 = len(energy) - 1
+        else:
+            j1 = int((bounds[i] + bounds[i+1] + 1)/2.0)
+        if (j1 - j0) < 3:
+            jx = j1 + 1
+            if (jx - j0) < 2:
+                jx += 1
+            val = interp1d(energy[j0:jx], mu[j0:jx], en[i])
+        elif method.startswith('box'):
+            val = mu[j0:j1].mean()
+        else:
+            val = (mu[j0:j1]*energy[j0:j1]).mean()/energy[j0:j1].mean()
+        mu_out.append(val)
+        err_out.append(mu[j0:j1].std() if j1 > j0 else np.nan)
+        j0 = j1
+    return np.array(mu_out), np.array(err_out)
+
+class RebinXAFSTest(unittest.TestCase):
+    def setUp(self):
+        dat = read_ascii(os.path.join(TOP, 'examples', 'xafsdata', 'cu_metal_rt.xdi'))
+        self.energy = dat.energy
+        self.mu = np.log(dat.i0/dat.itrans)
+        # continuous scan: many points per bin
+        np.random.seed(3)
+        self.qenergy = np.linspace(8850, 9600, 20000)
+        self.qmu = (np.interp(self.qenergy, self.energy, self.mu) +
+                    np.random.normal(scale=0.005, size=len(self.qenergy)))
+
+    def check_rebin(self, energy, mu, method):
+        group = Group(energy=energy, mu=mu, e0=E0, __name__='test')
+        rebin_xafs(group, method=method)
+        out = group.rebinned
+        mu_exp, err_exp = rebin_by_segment(energy, mu, out.energy, method=method)
+        assert_allclose(out.mu, mu_exp, rtol=1.e-12)
+        assert_allclose(out.delta_mu, err_exp, rtol=1.e-8, atol=1.e-14)
+        return out
+
+    def test_step_scan(self):
+        for method in ('centroid', 'boxcar'):
+            self.check_rebin(self.energy, self.mu, method)
+
+    def test_continuous_scan(self):
+        for method in ('centroid', 'boxcar'):
+            out = self.check_rebin(self.qenergy, self.qmu, method)
+            self.assertTrue(len(out.energy) < len(self.qenergy)/10)
+
+    def test_stack(self):
+        mus = np.array([self.qmu*(1 + 0.1*i) + 0.01*i for i in range(5)])
+        out = rebin_xafs_stack(self.qenergy, mus, E0, method='boxcar')
+        self.assertEqual(out.mu.shape, (5, len(out.energy)))
+        for i in range(5):
+            group = Group(energy=self.qenergy, mu=mus[i], e0=E0, __name__='test')
+            rebin_xafs(group, method='boxcar')
+            assert_allclose(out.energy, group.rebinned.energy)
+            assert_allclose(out.mu[i], group.rebinned.mu, rtol=1.e-12)
+            assert_allclose(out.delta_mu[i], group.rebinned.delta_mu, rtol=1.e-12)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (RebinXAFSTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
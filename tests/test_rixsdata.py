@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+tests of gridding, cropping and line cuts of RIXS planes in
+qtrixs.rixsdata, compared to scipy.interpolate.griddata
+"""
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.interpolate import griddata
+
+try:
+    from larch.qtrixs.rixsdata import RixsData, rectilinear_grid
+    HAS_SILX = True
+except ImportError:
+    HAS_SILX = False
+
+def make_rixs_cols():
+    "scan-structured RIXS plane: one scan per emitted energy"
+    ene_in = np.arange(7100.0, 7130.0, 0.25)
+    ene_out = np.arange(7040.0, 7055.0, 0.3)
+    xx, yy = np.meshgrid(ene_in, ene_out)
+    zz = (np.exp(-(xx-7112)**2/20.0 - (xx-yy-65.0)**2/8.0) +
+          0.2*np.sin(xx/3.0)*np.cos(yy/2.0))
+    return xx.ravel(), yy.ravel(), zz.ravel()
+
+@unittest.skipUnless(HAS_SILX, 'silx not installed')
+class RixsDataTest(unittest.TestCase):
+    def setUp(self):
+        self.x, self.y, self.z = make_rixs_cols()
+
+    def get_rixsdata(self, method):
+        rxd = RixsData()
+        rxd._x, rxd._y, rxd._z = self.x, self.y, self.z
+        rxd.ene_grid = 0.2
+        rxd.grid_method = method
+        rxd.grid_rixs_from_col()
+        return rxd
+
+    def test_grid(self):
+        for method in ('nearest', 'linear', 'cubic'):
+            rxd = self.get_rixsdata(method)
+            zz = griddata((self.x, self.y), self.z,
+                          (rxd.ene_in[None, :], rxd.ene_out[:, None]),
+                          method=method, fill_value=0)
+            ezz = griddata((self.x, self.x-self.y), self.z,
+                           (rxd.ene_in[None, :], rxd.ene_et[:, None]),
+                           method=method, fill_value=0)
+            assert_allclose(rxd.rixs_map, zz)
+            assert_allclose(rxd.rixs_et_map, ezz)
+
+    def test_crop(self):
+        x1, y1, x2, y2 = (7105.0, 7042.0, 7125.0, 7052.0)
+        for method in ('nearest', 'linear'):
+            rxd = self.get_rixsdata(method)
+            rxd.crop((x1, y1, x2, y2))
+            xx, yy = np.meshgrid(rxd.ene_in_crop, rxd.ene_out_crop)
+            zz = griddata((self.x, self.y), self.z, (xx, yy), method=method)
+            assert_allclose(rxd.rixs_map_crop, zz)
+            xx, et = np.meshgrid(rxd.ene_in_crop, rxd.ene_et_crop)
+            ezz = griddata((self.x, self.x-self.y), self.z, (xx, et), method=method)
+            assert_allclose(rxd.rixs_et_map_crop, ezz)
+
+    def test_cuts(self):
+        rxd = self.get_rixsdata('linear')
+        ene, cuts = rxd.get_cuts('CEE', [7043.0, 7050.0])
+        self.assertEqual(cuts.shape, (2, len(rxd.ene_in)))
+        assert_allclose(cuts[1], griddata((self.x, self.y), self.z,
+                                          (ene, 7050.0), method='linear'))
+        ene, cut = rxd.get_cuts('CIE', 7112.0)
+        assert_allclose(cut, griddata((self.x, self.y), self.z,
+                                      (7112.0, ene), method='linear'))
+        ene, cut = rxd.get_cuts('cet', 65.0, ene=np.linspace(7105, 7120, 31))
+        assert_allclose(cut, griddata((self.x, self.x-self.y), self.z,
+                                      (ene, 65.0), method='linear'))
+
+    def test_interpolator_cache(self):
+        rxd = self.get_rixsdata('linear')
+        interp = rxd.get_interpolator()
+        # same contents in new arrays: reused
+        rxd._z = self.z.copy()
+        self.assertIs(rxd.get_interpolator(), interp)
+        # modified in place: rebuilt
+        rxd._z *= 2.0
+        interp2 = rxd.get_interpolator()
+        self.assertIsNot(interp2, interp)
+        assert_allclose(interp2(self.x[:5], self.y[:5], method='linear'),
+                        2*self.z[:5])
+        # new arrays with same length: rebuilt
+        rxd._y = self.y + 0.1
+        self.assertIsNot(rxd.get_interpolator(), interp2)
+
+    def test_rectilinear(self):
+        self.assertIsNotNone(rectilinear_grid(self.x, self.y, self.z))
+        self.assertIsNone(rectilinear_grid(self.x[1:], self.y[1:], self.z[1:]))
+        rxd = self.get_rixsdata('linear')
+        zlin = rxd.rixs_map
+        rxd.grid_rectilinear = True
+        rxd.grid_rixs_from_col()
+        self.assertIsNotNone(rxd.get_interpolator().grid)
+        # bilinear vs triangle interpolation of a smooth map
+        assert_allclose(rxd.rixs_map, zlin, atol=0.01)
+        # exact at the scan points
+        ene, cut = rxd.get_cuts('CEE', self.y[0], ene=self.x[:10])
+        assert_allclose(cut, self.z[:10])
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (RixsDataTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
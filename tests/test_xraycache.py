@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+tests of cached X-ray data functions in larch.xray compared to
+the xraydb functions, and of database queries made by the cache
+"""
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+import xraydb
+
+from larch.xray import xraycache
+
+ENERGY = np.linspace(1000, 50000, 1000)
+
+class XrayCacheTest(unittest.TestCase):
+    def test_mu_elam(self):
+        for elem in (1, 8, 'Si', 'Fe', 'cu', 56, 'Pb', 'U', 96):
+            for kind in ('total', 'photo', 'coh', 'incoh'):
+                assert_allclose(xraycache.mu_elam(elem, ENERGY, kind=kind),
+                                xraydb.mu_elam(elem, ENERGY, kind=kind),
+                                rtol=1.e-12)
+        # energies at edges, and single energies
+        edges = [xraydb.xray_edge('Pb', e).energy for e in ('K', 'L1', 'L3', 'M5')]
+        assert_allclose(xraycache.mu_elam('Pb', edges),
+                        xraydb.mu_elam('Pb', edges), rtol=1.e-12)
+        assert_allclose(xraycache.mu_elam('Fe', 7000.0),
+                        xraydb.mu_elam('Fe', 7000.0), rtol=1.e-12)
+        self.assertRaises(ValueError, xraycache.mu_elam, 'Fe', ENERGY, kind='xx')
+
+    def test_mu_elam_array(self):
+        elems = ('O', 'Si', 'Fe', 'Zn', 'Pb')
+        mu = xraycache.mu_elam_array(elems, ENERGY, kind='photo')
+        self.assertEqual(mu.shape, (len(elems), len(ENERGY)))
+        for elem, row in zip(elems, mu):
+            assert_allclose(row, xraydb.mu_elam(elem, ENERGY, kind='photo'),
+                            rtol=1.e-12)
+
+    def test_material_mu(self):
+        for name, density in (('water', None), ('kapton', None), ('quartz', None),
+                              ('SiO2', 2.2), ('Fe2O3', 5.24), ('air', None)):
+            assert_allclose(xraycache.material_mu(name, ENERGY, density=density),
+                            xraydb.material_mu(name, ENERGY, density=density),
+                            rtol=1.e-12)
+            assert_allclose(xraycache.material_mu(name, 8000.0, density=density),
+                            xraydb.material_mu(name, 8000.0, density=density),
+                            rtol=1.e-12)
+        self.assertRaises(Warning, xraycache.material_mu, 'CaCO3', ENERGY)
+        comps = xraycache.material_mu_components('quartz', 10000.0)
+        expected = xraydb.material_mu_components('quartz', 10000.0)
+        self.assertEqual(comps['elements'], expected['elements'])
+        for elem in comps['elements']:
+            assert_allclose(comps[elem], expected[elem], rtol=1.e-12)
+
+    def test_f0(self):
+        q = np.linspace(0, 3, 101)
+        for ion in ('H', 'O', 'Fe', 'Fe2+', 'Ba', 26, 'U'):
+            assert_allclose(xraycache.f0(ion, q), xraydb.f0(ion, q), rtol=1.e-12)
+        assert_allclose(xraycache.f0('Cu', 0.5), xraydb.f0('Cu', 0.5), rtol=1.e-12)
+        self.assertRaises(ValueError, xraycache.f0, 'Xx', q)
+
+    def test_lines_edges(self):
+        for elem in ('Ca', 'Fe', 30, 'Pb'):
+            self.assertEqual(xraycache.xray_edges(elem), xraydb.xray_edges(elem))
+            self.assertEqual(xraycache.xray_edge(elem, 'K'), xraydb.xray_edge(elem, 'K'))
+            self.assertEqual(xraycache.xray_lines(elem, 'K'), xraydb.xray_lines(elem, 'K'))
+            self.assertEqual(xraycache.xray_lines(elem, excitation_energy=20000),
+                             xraydb.xray_lines(elem, excitation_energy=20000))
+            for line in ('Ka', 'Kb', 'La', 'Lb', 'Ka1', 'K', 'L'):
+                self.assertEqual(xraycache.xray_line(elem, line),
+                                 xraydb.xray_line(elem, line))
+            self.assertEqual(xraycache.atomic_mass(elem), xraydb.atomic_mass(elem))
+        self.assertEqual(xraycache.chemparse('Fe2O3'), xraydb.chemparse('Fe2O3'))
+
+    def test_queries(self):
+        cache = xraycache.get_xraycache()
+        xraycache.clear_xraycache()
+        nquery0 = cache.nqueries
+        xraycache.material_mu('Fe2O3', ENERGY, density=5.24)
+        self.assertEqual(cache.nqueries - nquery0, 5)
+        for i in range(10):
+            xraycache.material_mu('Fe2O3', ENERGY, density=5.24)
+            xraycache.mu_elam('Fe', 1000*(i+5))
+        self.assertEqual(cache.nqueries - nquery0, 5)
+        # returned dicts are copies
+        lines = xraycache.xray_lines('Fe')
+        lines.pop('Ka1')
+        self.assertTrue('Ka1' in xraycache.xray_lines('Fe'))
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (XrayCacheTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
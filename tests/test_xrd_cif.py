@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+tests of structure factors and q lists calculated by xrd_cif.CIF,
+compared to direct sums over reflections and atomic positions,
+using CIFs from the bundled AMCSD database
+"""
+import math
+import cmath
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from xraydb import f0
+
+from larch.xrd import generate_hkl, d_from_hkl, q_from_d
+from larch.xrd.xrd_cif import HAS_CifFile, create_cif, calc_pattern_batch
+
+AMCSD_IDS = (0, 1, 2)
+
+def get_cifs(ids=AMCSD_IDS):
+    from larch.xrd.cifdb import cifDB
+    cifdb = cifDB('amcsd_cif.db')
+    allids = sorted([row[0] for row in cifdb.query(cifdb.ciftbl.c.amcsd_id).all()])
+    return [create_cif(text=cifdb.return_cif(allids[i])) for i in ids]
+
+def direct_fhkl(cif, hkl_list, qhkl, ii, use_f0=True):
+    "structure factors summed one term at a time"
+    imag = complex(0, 1)
+    fhkl = np.zeros(len(hkl_list))
+    for i, hkl in enumerate(hkl_list):
+        if not ii[i]:
+            continue
+        for el in cif.atom.label:
+            fel = f0(el, qhkl[i]/(4*math.pi)) if use_f0 else 1.0
+            for uvw in cif.elem_uvw[el]:
+                hukvlw = hkl[0]*uvw[0] + hkl[1]*uvw[1] + hkl[2]*uvw[2]
+                fhkl[i] += fel*(cmath.exp(2*cmath.pi*imag*hukvlw)).real
+    return fhkl
+
+@unittest.skipUnless(HAS_CifFile, 'PyCifRW not installed')
+class XRDCIFTest(unittest.TestCase):
+    def setUp(self):
+        self.cifs = get_cifs()
+
+    def test_calc_q(self):
+        hkl_list = generate_hkl(positive_only=True)
+        for cif in self.cifs:
+            qhkl = q_from_d(d_from_hkl(hkl_list, *cif.unitcell))
+            ii = (qhkl < 10.0)*(qhkl > 0.2)
+            fhkl = direct_fhkl(cif, hkl_list, qhkl, ii, use_f0=False)
+            ii = ii*(abs(fhkl) > 1e-5)*(fhkl**2 > 0.001)
+            expected = sorted(set(np.array(qhkl[ii], dtype=np.float16)))
+            self.assertEqual(list(cif.calc_q()), expected)
+
+    def test_structure_factors(self):
+        q_min, q_max = 0.5, 5.0
+        hkl_list = generate_hkl()
+        for cif in self.cifs:
+            qhkl = q_from_d(d_from_hkl(hkl_list, *cif.unitcell))
+            ii = (qhkl < q_max)*(qhkl > q_min)
+            fhkl = direct_fhkl(cif, hkl_list, qhkl, ii)
+            ii = ii*(abs(fhkl) > 1e-2)*(fhkl**2 > 0.001)
+            qarr = np.array(qhkl[ii], dtype=np.float32)
+            expected_q = np.array(sorted(set(qarr)))
+            expected_p = np.array([(qarr == q).sum() for q in expected_q])
+
+            cif.structure_factors(wavelength=0.6, q_min=q_min, q_max=q_max)
+            assert_allclose(cif.qhkl, expected_q)
+            assert_allclose(cif.phkl, expected_p)
+            for q, f2 in zip(cif.qhkl, cif.F2hkl):
+                assert_allclose(f2, fhkl[ii][qarr == q][-1]**2, rtol=1.e-5)
+
+    def test_calc_pattern_batch(self):
+        patterns = calc_pattern_batch(self.cifs, wavelength=0.6, qrange=(0.5, 5.0))
+        self.assertEqual(len(patterns), len(self.cifs))
+        for pattern, cif in zip(patterns, get_cifs()):
+            cif.structure_factors(wavelength=0.6, q_min=0.5, q_max=5.0)
+            assert_allclose(pattern[0], cif.qhkl)
+            assert_allclose(pattern[3], cif.Ihkl, rtol=1.e-6)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (XRDCIFTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+"""
+tests of azimuthal integration of XRD images with pyFAI, using a
+synthetic calibration and images of powder rings
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.xrd.xrd_pyFAI import (HAS_pyFAI, get_integrator, integrate_xrd_row,
+                                 integrate_xrd_stack, clear_integrator_cache)
+
+RING_Q = (1.0, 1.6, 2.2)
+SHAPE = (256, 320)
+
+def make_poni(folder):
+    from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+    ai = AzimuthalIntegrator(dist=0.08, poni1=0.0128, poni2=0.016,
+                             pixel1=1.e-4, pixel2=1.e-4, wavelength=0.6e-10)
+    calfile = os.path.join(folder, 'synthetic.poni')
+    ai.save(calfile)
+    return calfile, ai
+
+def ring_images(ai, nframes=6, width=0.02):
+    "images with Gaussian rings at RING_Q, of increasing intensity"
+    qpix = ai.qArray(SHAPE)/10.0   # 1/nm -> 1/A
+    ring = np.zeros(SHAPE)
+    for q0 in RING_Q:
+        ring += np.exp(-(qpix-q0)**2/(2*width**2))
+    return np.array([100*(i+1)*ring + 1 for i in range(nframes)])
+
+@unittest.skipUnless(HAS_pyFAI, 'pyFAI not installed')
+class XRDIntegrateTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.calfile, ai = make_poni(self.folder)
+        self.frames = ring_images(ai)
+        clear_integrator_cache()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_integrator_cache(self):
+        ai1 = get_integrator(self.calfile, shape=SHAPE, steps=512)
+        ai2 = get_integrator(self.calfile, shape=SHAPE, steps=512)
+        ai3 = get_integrator(self.calfile, shape=SHAPE, steps=1024)
+        mask = np.zeros(SHAPE, dtype=np.int8)
+        ai4 = get_integrator(self.calfile, shape=SHAPE, steps=512, mask=mask)
+        self.assertIs(ai1, ai2)
+        self.assertIsNot(ai1, ai3)
+        self.assertIsNot(ai1, ai4)
+
+    def test_ring_positions(self):
+        q, xrd1d = integrate_xrd_stack(self.frames, self.calfile, steps=1024,
+                                       flip=False)
+        self.assertEqual(xrd1d.shape, (len(self.frames), 1024))
+        for i, counts in enumerate(xrd1d):
+            for q0 in RING_Q:
+                near = np.where(abs(q-q0) < 0.2)[0]
+                qpeak = q[near[np.argmax(counts[near])]]
+                self.assertTrue(abs(qpeak-q0) < 0.02)
+        assert_allclose(xrd1d[3]-xrd1d[2], xrd1d[1]-xrd1d[0], rtol=1.e-4, atol=1.e-3)
+
+    def test_workers(self):
+        q, serial = integrate_xrd_stack(self.frames, self.calfile, steps=512)
+        q2, threads = integrate_xrd_stack(self.frames, self.calfile, steps=512,
+                                          nworkers=3)
+        out = np.zeros((len(self.frames), 512), dtype=np.float32)
+        q3, procs = integrate_xrd_stack(self.frames, self.calfile, steps=512,
+                                        nworkers=2, use_processes=True, out=out)
+        self.assertIs(procs, out)
+        assert_allclose(q, q2)
+        assert_allclose(q, q3)
+        assert_allclose(serial, threads)
+        assert_allclose(serial, procs, rtol=1.e-5)
+
+    def test_integrate_row(self):
+        q, serial = integrate_xrd_stack(self.frames, self.calfile, steps=512)
+        rowq, row1d = integrate_xrd_row(self.frames, self.calfile, steps=512)
+        self.assertEqual(rowq.shape, row1d.shape)
+        assert_allclose(rowq[0], q)
+        assert_allclose(row1d, serial)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (XRDIntegrateTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
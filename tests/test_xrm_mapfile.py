@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+"""
+tests of GSEXRM_MapFile area and ROI map reads on a small synthetic
+map file, compared to sums and slices of the map arrays
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+import h5py
+from larch.xrmmap import xrm_mapfile
+from larch.xrmmap.xrm_mapfile import (GSEXRM_MapFile, create_xrmmap, strlist,
+                                      AREA_CACHE)
+from larch.math.tomography import HAS_tomopy, reshape_sinogram, sinogram_axes
+
+ROIS = (('Fe Ka', (10, 20)), ('Cu Ka', (30, 40)))
+
+def make_mapfile(fname, nrow=9, ncol=12, nmca=2, nchan=64, seed=3):
+    """write a version 2.1 map file with random XRF counts, and ROI
+    maps summed from these as when collected, returning the counts
+    (nmca, nrow, ncol, nchan) and deadtime factors (nmca, nrow, ncol)"""
+    rand = np.random.RandomState(seed)
+    h5root = h5py.File(fname, 'w')
+    create_xrmmap(h5root, dimension=2, folder='')
+    h5root.close()
+
+    xrmfile = GSEXRM_MapFile(filename=fname)
+    conf = xrmfile.xrmmap['config']
+    xrmfile.add_data(conf['rois'], 'name', strlist([r[0] for r in ROIS]))
+    xrmfile.add_data(conf['rois'], 'address',
+                     strlist(['mca%%i.R%d' % i for i in range(len(ROIS))]))
+    xrmfile.add_data(conf['rois'], 'limits',
+                     np.array([[lims]*nmca for name, lims in ROIS]))
+    for key, val in (('offset', 0.0), ('slope', 0.1), ('quad', 0.0)):
+        xrmfile.add_data(conf['mca_calib'], key, val*np.ones(nmca))
+    for key, val in (('name', 'Mono Energy'), ('address', 'mono.E'),
+                     ('value', '10000.0')):
+        xrmfile.add_data(conf['environ'], key, strlist([val]))
+    xrmfile.build_schema(ncol, nmca=nmca, nchan=nchan,
+                         scaler_names=['i0'], scaler_addrs=['I0'])
+    xrmfile.resize_arrays(nrow)
+
+    xrmap = xrmfile.xrmmap
+    counts = rand.poisson(20, size=(nmca, nrow, ncol, nchan)).astype(np.uint32)
+    dtfactor = rand.uniform(1.0, 1.3, size=(nmca, nrow, ncol)).astype(np.float32)
+    for i in range(nmca):
+        dgrp = xrmap['mca%d' % (i+1)]
+        dgrp['counts'][:] = counts[i]
+        dgrp['dtfactor'][:] = dtfactor[i]
+        dgrp['realtime'][:] = 100000
+        dgrp['livetime'][:] = (100000/dtfactor[i]).astype(np.int64)
+    xrmap['mcasum/counts'][:] = (counts*dtfactor[:, :, :, np.newaxis]).sum(axis=0)
+    xrmap['scalars/i0'][:] = rand.uniform(1e4, 2e4, size=(nrow, ncol))
+    xpos, ypos = np.meshgrid(np.arange(ncol)*0.01, np.arange(nrow)*0.01)
+    xrmap['positions/pos'][:, :, 0] = xpos
+    xrmap['positions/pos'][:, :, 1] = ypos
+
+    # ROI maps as written by process_row() for version 2.1
+    detraw, detcor = [xrmap['scalars/i0'][:]], [xrmap['scalars/i0'][:]]
+    sumraw, sumcor = [detraw[0]], [detcor[0]]
+    for name, (lo, hi) in ROIS:
+        iraw = counts[:, :, :, lo:hi].sum(axis=3)
+        icor = iraw*dtfactor
+        detraw.extend(iraw)
+        detcor.extend(icor)
+        sumraw.append(iraw.sum(axis=0))
+        sumcor.append(icor.sum(axis=0))
+    for dname, dat in (('det_raw', detraw), ('det_cor', detcor),
+                       ('sum_raw', sumraw), ('sum_cor', sumcor)):
+        xrmap['roimap'][dname][:] = np.einsum('ijk->jki', np.array(dat))
+    xrmap.attrs['Last_Row'] = nrow - 1
+    xrmfile.close()
+    return counts, dtfactor
+
+def make_areas(nrow=9, ncol=12):
+    "an L-shaped area and a sparse area"
+    lshape = np.zeros((nrow, ncol), dtype=bool)
+    lshape[1:8, 2:4] = True
+    lshape[6:8, 2:11] = True
+    sparse = np.zeros((nrow, ncol), dtype=bool)
+    sparse[::3, 1::4] = True
+    return lshape, sparse
+
+class MapFileTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='xrmmap_')
+        self.fname = os.path.join(self.tmpdir, 'test.h5')
+        self.counts, self.dtfactor = make_mapfile(self.fname)
+        self.xrmfile = GSEXRM_MapFile(filename=self.fname)
+
+    def tearDown(self):
+        if self.xrmfile.h5root is not None:
+            self.xrmfile.close()
+        shutil.rmtree(self.tmpdir)
+
+    def reopen(self):
+        self.xrmfile.close()
+        self.xrmfile = GSEXRM_MapFile(filename=self.fname)
+
+    def area_sum(self, area, det=None, dtcorrect=True):
+        """summed spectrum for area and detector index (None for the
+        deadtime-corrected sum of detectors), from the synthetic counts"""
+        counts = self.counts*self.dtfactor[:, :, :, np.newaxis]
+        if det is None:
+            return counts.sum(axis=0)[area].sum(axis=0)
+        if not dtcorrect:
+            counts = self.counts*1.0
+        return counts[det-1][area].sum(axis=0)
+
+class CountsAreaTest(MapFileTest):
+    def rect_sum(self, area, mapdat=None, det=None, dtcorrect=True):
+        "area sum of counts from the bounding rectangle"
+        _ay, _ax = np.where(area)
+        ymin, ymax, xmin, xmax = _ay.min(), _ay.max()+1, _ax.min(), _ax.max()+1
+        counts = self.xrmfile.get_counts_rect(ymin, ymax, xmin, xmax,
+                                              mapdat=mapdat, det=det,
+                                              dtcorrect=dtcorrect)
+        return counts[area[ymin:ymax, xmin:xmax]].sum(axis=0)
+
+    def test_counts_area(self):
+        lshape, sparse = make_areas()
+        single = np.zeros(lshape.shape, dtype=bool)
+        single[4, 7] = True
+        for area in (lshape, sparse, single):
+            for det in (None, 1, 2):
+                for dtc in (True, False):
+                    counts = self.xrmfile.get_counts_area(area, det=det,
+                                                          dtcorrect=dtc)
+                    assert_allclose(counts, self.rect_sum(area, det=det,
+                                                          dtcorrect=dtc),
+                                    rtol=1.e-6)
+                    assert_allclose(counts, self.area_sum(area, det=det,
+                                                          dtcorrect=dtc),
+                                    rtol=1.e-6)
+        assert_allclose(self.xrmfile.get_counts_area(~lshape & lshape), 0)
+
+    def test_chunks(self):
+        # counts chunked across rows and columns
+        lshape, sparse = make_areas()
+        work = self.xrmfile.xrmmap['work'].create_group('chunked')
+        work.create_dataset('counts', data=self.counts[1], chunks=(2, 5, 16))
+        work.create_dataset('dtfactor', data=self.dtfactor[1])
+        for area in (lshape, sparse):
+            for dtc in (True, False):
+                counts = self.xrmfile.get_counts_area(area, mapdat=work,
+                                                      dtcorrect=dtc)
+                assert_allclose(counts, self.rect_sum(area, mapdat=work,
+                                                      dtcorrect=dtc),
+                                rtol=1.e-6)
+
+    def test_mca_area(self):
+        lshape, sparse = make_areas()
+        self.xrmfile.add_area(lshape, name='area_1')
+        for dtc in (True, False):
+            mca = self.xrmfile.get_mca_area('area_1', det=2, dtcorrect=dtc)
+            assert_allclose(mca.counts, self.rect_sum(lshape, det=2,
+                                                      dtcorrect=dtc),
+                            rtol=1.e-6)
+            # repeated call uses the cached spectrum
+            get_counts_area = self.xrmfile.get_counts_area
+            self.xrmfile.get_counts_area = None
+            mca2 = self.xrmfile.get_mca_area('area_1', det=2, dtcorrect=dtc)
+            self.xrmfile.get_counts_area = get_counts_area
+            assert_allclose(mca2.counts, mca.counts)
+            self.assertEqual(mca2.real_time, mca.real_time)
+            self.assertEqual(mca2.live_time, mca.live_time)
+
+class AreaCacheTest(MapFileTest):
+    def test_cache(self):
+        lshape, sparse = make_areas()
+        # names that are the same after fix_varname(), and name prefixes
+        for name, area in (('a-1', lshape), ('a_1', sparse),
+                           ('a_1_mcasum', lshape)):
+            self.assertEqual(self.xrmfile.add_area(area, name=name), name)
+
+        mcas = {}
+        for name, area in (('a-1', lshape), ('a_1', sparse),
+                           ('a_1_mcasum', lshape)):
+            for dtc in (True, False):
+                mca = self.xrmfile.get_mca_area(name, det=1, dtcorrect=dtc)
+                assert_allclose(mca.counts, self.area_sum(area, det=1, dtcorrect=dtc),
+                                rtol=1.e-6)
+                mcas[(name, dtc)] = mca.counts
+        self.assertEqual(sorted(self.xrmfile.area_cache['a_1'].keys()),
+                         ['mca1_dtc', 'mca1_raw'])
+
+        # read paths do not write to the file
+        self.assertNotIn(AREA_CACHE, self.xrmfile.xrmmap)
+
+        # cached: reading counts would fail
+        self.xrmfile.get_counts_area = None
+        for (name, dtc), counts in mcas.items():
+            mca = self.xrmfile.get_mca_area(name, det=1, dtcorrect=dtc)
+            assert_allclose(mca.counts, counts)
+
+        # saved when closing, with one group per area
+        self.reopen()
+        cache_grp = self.xrmfile.xrmmap[AREA_CACHE]
+        self.assertEqual(sorted(cache_grp.keys()), ['a-1', 'a_1', 'a_1_mcasum'])
+        self.assertEqual(sorted(cache_grp['a-1'].keys()),
+                         ['mca1_dtc', 'mca1_raw'])
+        self.xrmfile.get_counts_area = None
+        for (name, dtc), counts in mcas.items():
+            mca = self.xrmfile.get_mca_area(name, det=1, dtcorrect=dtc)
+            assert_allclose(mca.counts, counts)
+
+    def test_clear(self):
+        lshape, sparse = make_areas()
+        for name in ('area_1', 'area_10', 'area_1_b'):
+            self.xrmfile.add_area(lshape, name=name)
+            self.xrmfile.get_mca_area(name, det='mcasum')
+        self.xrmfile.save_area_cache()
+        self.xrmfile.clear_area_cache('area_1')
+        self.assertEqual(sorted(self.xrmfile.area_cache.keys()),
+                         ['area_10', 'area_1_b'])
+        self.assertEqual(sorted(self.xrmfile.xrmmap[AREA_CACHE].keys()),
+                         ['area_10', 'area_1_b'])
+        self.xrmfile.clear_area_cache()
+        self.assertEqual(self.xrmfile.area_cache, {})
+        self.assertNotIn(AREA_CACHE, self.xrmfile.xrmmap)
+
+    def test_invalidate(self):
+        lshape, sparse = make_areas()
+        self.xrmfile.add_area(lshape, name='area_1')
+        mca = self.xrmfile.get_mca_area('area_1', det='mcasum')
+        assert_allclose(mca.counts, self.area_sum(lshape), rtol=1.e-6)
+
+        # changed area mask
+        self.xrmfile.xrmmap['areas/area_1'][:] = sparse
+        mca = self.xrmfile.get_mca_area('area_1', det='mcasum')
+        assert_allclose(mca.counts, self.area_sum(sparse), rtol=1.e-6)
+
+        # new map data
+        self.xrmfile.xrmmap['mcasum/counts'][:] = 0
+        self.xrmfile.last_row += 1
+        mca = self.xrmfile.get_mca_area('area_1', det='mcasum')
+        assert_allclose(mca.counts, 0)
+
+class RoiMapTest(MapFileTest):
+    def roi_map(self, roiname, det=None, dtcorrect=True):
+        "ROI map from the synthetic counts"
+        lo, hi = dict(ROIS)[roiname]
+        rmap = self.counts[:, :, :, lo:hi].sum(axis=3)*1.0
+        if dtcorrect:
+            rmap *= self.dtfactor
+        if det is None:
+            return rmap.sum(axis=0)
+        return rmap[det-1]
+
+    def test_get_roimaps(self):
+        roinames, dets = ['Fe Ka', 'cu ka'], [None, 1, 2]
+        for dtc in (True, False):
+            # from roimap/det_raw, det_cor, sum_raw, sum_cor
+            maps = self.xrmfile.get_roimaps(roinames, dets=dets, dtcorrect=dtc)
+            self.assertEqual(maps.shape, (2, 3, 9, 12))
+            for i, roiname in enumerate(('Fe Ka', 'Cu Ka')):
+                for j, det in enumerate(dets):
+                    expected = self.roi_map(roiname, det=det, dtcorrect=dtc)
+                    assert_allclose(maps[i, j], expected, rtol=1.e-5)
+                    self.xrmfile.roimap_cache.clear()
+                    one = self.xrmfile.get_roimap(roiname, det=det, dtcorrect=dtc)
+                    assert_allclose(one, expected, rtol=1.e-5)
+
+        # get_roimap() has filled the per-ROI datasets, which are
+        # then read by both get_roimap() and get_roimaps()
+        dset = self.xrmfile.xrmmap['roimap/mca2/Fe Ka/cor']
+        self.assertEqual(dset.shape, (9, 12))
+        dset[:] = 3.0
+        self.xrmfile.roimap_cache.clear()
+        maps = self.xrmfile.get_roimaps(roinames, dets=dets, as_dict=True)
+        assert_allclose(maps[('Fe Ka', 2)], 3.0)
+        assert_allclose(self.xrmfile.get_roimap('Fe Ka', det=2), 3.0)
+        for key, rmap in maps.items():
+            assert_allclose(rmap, self.xrmfile.get_roimap(key[0], det=key[1]))
+
+    def test_roimap_cache(self):
+        xrmfile = self.xrmfile
+        cachesize = xrm_mapfile.ROIMAP_CACHESIZE
+        xrm_mapfile.ROIMAP_CACHESIZE = 3
+        try:
+            for det in (1, 2, None):
+                xrmfile.get_roimap('Fe Ka', det=det)
+            xrmfile.get_roimap('Fe Ka', det=1)   # most recently used
+            xrmfile.get_roimaps('Cu Ka', dets=2)
+        finally:
+            xrm_mapfile.ROIMAP_CACHESIZE = cachesize
+        self.assertEqual([k[:2] for k in xrmfile.roimap_cache.keys()],
+                         [('Fe Ka', 'mcasum'), ('Fe Ka', 'mca1'), ('Cu Ka', 'mca2')])
+
+        # returned maps are copies of the cached maps
+        rmap = xrmfile.get_roimap('Fe Ka', det=1)
+        rmap[:] = -1
+        assert_allclose(xrmfile.get_roimap('Fe Ka', det=1),
+                        self.roi_map('Fe Ka', det=1), rtol=1.e-5)
+
+        # cached maps are used until the last row or file mtime change
+        fstat = os.stat(self.fname)
+        xrmfile.xrmmap['roimap/det_cor'][:] = 5.0
+        xrmfile.xrmmap['roimap/mca1/Fe Ka/cor'][:] = 5.0
+        xrmfile.h5root.flush()
+        os.utime(self.fname, ns=(fstat.st_atime_ns, fstat.st_mtime_ns))
+        assert_allclose(xrmfile.get_roimap('Fe Ka', det=1),
+                        self.roi_map('Fe Ka', det=1), rtol=1.e-5)
+        xrmfile.last_row += 1
+        assert_allclose(xrmfile.get_roimap('Fe Ka', det=1), 5.0)
+        assert_allclose(xrmfile.get_roimaps('Cu Ka', dets=2)[0, 0], 5.0)
+
+        xrmfile.get_roimap('Fe Ka', det=1)
+        xrmfile.xrmmap['roimap/mca1/Fe Ka/cor'][:] = 7.0
+        xrmfile.h5root.flush()
+        mtime = os.stat(self.fname).st_mtime + 10
+        os.utime(self.fname, (mtime, mtime))
+        assert_allclose(xrmfile.get_roimap('Fe Ka', det=1), 7.0)
+
+class SinogramAxesTest(unittest.TestCase):
+    def test_axes(self):
+        sino = np.arange(4*9*12).reshape(4, 9, 12)
+        for x, omega in ((range(12), range(9)), (range(9), range(12)),
+                         (range(4), range(9)), (range(9), range(9)), ([], range(9))):
+            expected, order = reshape_sinogram(sino, list(x), list(omega))
+            subscripts, order2 = sinogram_axes(sino.shape, list(x), list(omega))
+            out = sino
+            for subs in subscripts:
+                out = np.einsum(subs, out)
+            self.assertEqual(order, order2)
+            assert_allclose(out, expected)
+
+@unittest.skipUnless(HAS_tomopy, 'tomopy not installed')
+class TomographTest(MapFileTest):
+    def set_axes(self, rotation_rows=True):
+        "use map rows or columns as rotation angle (0 to 180 degrees)"
+        xrmap = self.xrmfile.xrmmap
+        pos = xrmap['positions/pos']
+        nrow, ncol, npos = pos.shape
+        names = ['fine x', 'theta']
+        if rotation_rows:
+            pos[:, :, 1] = np.linspace(0, 180, nrow)[:, np.newaxis]
+        else:
+            names = ['theta', 'fine x']
+            pos[:, :, 0] = np.linspace(0, 180, ncol)[np.newaxis, :]
+        del xrmap['positions/name']
+        self.xrmfile.add_data(xrmap['positions'], 'name', strlist(names))
+
+    def test_stream(self):
+        for rotation_rows in (True, False):
+            self.set_axes(rotation_rows=rotation_rows)
+            for det in ('mca1', 'mcasum'):
+                datapath = '/xrmmap/%s/counts' % det
+                tomopath = 'tomo/%s' % det
+                self.xrmfile.save_tomograph(datapath, dtcorrect=True)
+                tomo = self.xrmfile.xrmmap[tomopath]['counts'][:]
+                center = self.xrmfile.xrmmap[tomopath].attrs['center']
+                # small memory ceiling, to use many slabs of channels
+                for ncpus in (1, 2):
+                    self.xrmfile.save_tomograph(datapath, dtcorrect=True,
+                                                stream=True, max_memory=0.02,
+                                                ncpus=ncpus)
+                    grp = self.xrmfile.xrmmap[tomopath]
+                    self.assertEqual(grp.attrs['center'], center)
+                    assert_allclose(grp['counts'][:], tomo, rtol=1.e-4,
+                                    atol=1.e-6*abs(tomo).max())
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (CountsAreaTest, AreaCacheTest, RoiMapTest,
+                  SinogramAxesTest, TomographTest):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)
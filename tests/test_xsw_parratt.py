@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+tests of the array Parratt solver xsw.SimpleParratt.parratt,
+compared to the angle-by-angle reflectivity() calculation
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from numpy.testing import assert_allclose
+
+from larch.xsw.SimpleParratt import reflectivity, parratt
+
+AIR = 'N1.56O0.48C0.03Ar0.01Kr0.000001Xe0.0000009'
+
+class ParrattTest(unittest.TestCase):
+    def setUp(self):
+        # reflectivity() writes SimpleParratt.txt to the current folder
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def test_default_stack(self):
+        expected = np.array(reflectivity())
+        th, refl, efi = parratt()
+        self.assertEqual(efi.shape, (len(th), 1))
+        assert_allclose(th, expected[:, 0])
+        assert_allclose(refl, expected[:, 1], rtol=1.e-10, atol=1.e-14)
+        assert_allclose(efi[:, 0], expected[:, 2], rtol=1.e-10)
+
+    def test_above_surface(self):
+        angles = np.linspace(0.05, 0.8, 76)
+        depths = [-40.0, -10.0, 0.0]
+        th, refl, efi = parratt(eV0=9000.0, th_deg=angles, depths=depths)
+        self.assertEqual(efi.shape, (len(angles), len(depths)))
+        for i, depth in enumerate(depths):
+            expected = np.array(reflectivity(eV0=9000.0, th_deg=angles,
+                                             depths=[depth]))
+            assert_allclose(refl, expected[:, 1], rtol=1.e-10, atol=1.e-14)
+            assert_allclose(efi[:, i], expected[:, 2], rtol=1.e-10)
+
+    def test_field_continuity(self):
+        # with no roughness, the E-field is continuous across interfaces
+        angles = np.linspace(0.05, 0.8, 51)
+        for depth in (0.0, 200.0, 250.0):
+            th, refl, efi = parratt(th_deg=angles, mat=[AIR, 'Pt', 'Cr', 'Si'],
+                                    thick=[0., 200., 50., 10000.],
+                                    den=[1.e-10, 21.45, 7.19, 2.33],
+                                    rough=[0, 0, 0, 0],
+                                    depths=[depth, depth+1.e-6])
+            assert_allclose(efi[:, 0], efi[:, 1], rtol=1.e-5)
+
+if __name__ == '__main__':  # pragma: no cover
+    for suite in (ParrattTest,):
+        suite = unittest.TestLoader().loadTestsFromTestCase(suite)
+        unittest.TextTestRunner(verbosity=2).run(suite)